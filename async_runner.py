@@ -0,0 +1,231 @@
+import asyncio
+import time
+from typing import Iterable, Optional
+
+from multi_runner import Link, SerialLink
+from tick_profiler import Histogram
+
+
+class AsyncRunnerStats:
+    """
+    How the observer was driven: ticks started by new data (with their latency, from the data arriving to the tick
+    starting) and idle ticks (no new data within idle_period). A tick is throttled if it had to wait for max_rate.
+    Motor writes that repeat the value last sent are coalesced (not sent again, unless it was sent idle_period ago).
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.idle_ticks = 0
+        self.throttled = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.tick = Histogram()  # the observer's _update alone
+        self.latency = Histogram()
+
+    def as_dict(self) -> dict:
+        return {"ticks": self.ticks, "idle_ticks": self.idle_ticks, "throttled": self.throttled,
+                "writes": self.writes, "coalesced": self.coalesced,
+                "tick": self.tick.as_dict(), "latency": self.latency.as_dict()}
+
+
+class AsyncThymioRunner:
+    """
+    Drives a ThymioObserver (e.g. a MazeWalker, unchanged) on an asyncio event loop, the async counterpart of
+    SingleSerialThymioRunner: instead of ticking at a fixed period and sleeping even when new sensor values are already
+    there, it ticks as soon as the link reports new values, so the observer reacts within a few milliseconds instead
+    of up to a period. max_rate caps the ticks per second, data that arrives faster is coalesced into the next tick.
+    If no data arrives for idle_period seconds, it ticks anyway, so timed turns still end on time.
+
+    The observer's writes are held back during a tick and only the ones that changed a value are sent afterwards (a
+    walker sets both motor targets on every tick, mostly to what they already are). A value that stays the same is
+    sent again every idle_period, so a write lost on the link doesn't stay lost for the rest of the run.
+
+    The link is a SerialLink (the first Thymio found) by default. Any Link from multi_runner works, links that can't
+    tell when new values arrive are ticked every idle_period. run() returns once the observer called stop() or
+    max_seconds have passed, it raises what the observer raised.
+    """
+
+    def __init__(self, variables: Iterable[str], observer, link: Optional[Link] = None, max_rate: float = 100.0,
+                 idle_period: float = 0.1):
+        self.variables = tuple(variables)
+        self.observer = observer
+        self.link = link if link is not None else SerialLink()
+        self.min_interval_ns = round(1e9 / max_rate)
+        self.idle_period = idle_period
+        self.stats = AsyncRunnerStats()
+        self.stopped = False
+
+    def run(self, max_seconds: Optional[float] = None):
+        asyncio.run(self.run_async(max_seconds))
+
+    async def run_async(self, max_seconds: Optional[float] = None):
+        observer, link, stats = self.observer, self.link, self.stats
+        deadline = None if max_seconds is None else time.monotonic_ns() + round(max_seconds * 1e9)
+
+        def stop():
+            self.stopped = True
+            original_stop()
+
+        await link.connect()
+        node = _CoalescingNode(link.node, round(self.idle_period * 1e9))
+        observer.th = node
+        original_stop = observer.stop
+        observer.stop = stop
+        try:
+            last_tick = None
+            while not self.stopped:
+                if deadline is not None and time.monotonic_ns() >= deadline:
+                    observer.stop()
+                    await self._flush(node)
+                    break
+
+                fresh = await link.wait_for_data(self.idle_period)
+                if last_tick is not None:
+                    wait = last_tick + self.min_interval_ns - time.monotonic_ns()
+                    if wait > 0:
+                        stats.throttled += 1
+                        await asyncio.sleep(wait / 1e9)
+
+                last_tick = time.monotonic_ns()
+                if fresh:
+                    stats.latency.record(max(last_tick - link.data_ns, 0))
+                else:
+                    stats.idle_ticks += 1
+                await link.refresh(self.variables)
+                began = time.perf_counter_ns()
+                try:
+                    observer._update()
+                except Exception:
+                    if not self.stopped:
+                        observer.stop()
+                    raise
+                finally:
+                    stats.tick.record(time.perf_counter_ns() - began)
+                    stats.ticks += 1
+                    await self._flush(node)
+        finally:
+            del observer.stop
+            link.close()
+
+    async def _flush(self, node: "_CoalescingNode"):
+        sent, coalesced = node.flush(time.monotonic_ns())
+        self.stats.writes += sent
+        self.stats.coalesced += coalesced
+        if sent:
+            await self.link.flush()
+
+
+class _CoalescingNode:
+    # holds the writes of a tick back, flush sends the ones that change what was sent before and the ones last sent
+    # resend_ns or longer ago
+    def __init__(self, node, resend_ns: int):
+        self.node = node
+        self.resend_ns = resend_ns
+        self.pending = {}
+        self.sent = {}  # variable -> (value, time it was sent)
+
+    def __getitem__(self, variable):
+        if variable in self.pending:
+            return self.pending[variable]
+        return self.node[variable]
+
+    def __setitem__(self, variable, value):
+        self.pending[variable] = value
+
+    def flush(self, now_ns: int):
+        sent = coalesced = 0
+        pending, self.pending = self.pending, {}
+        for variable, value in pending.items():
+            last = self.sent.get(variable)
+            if last is not None and last[0] == value and now_ns - last[1] < self.resend_ns:
+                coalesced += 1
+                continue
+            self.node[variable] = value
+            self.sent[variable] = (value, now_ns)
+            sent += 1
+        return sent, coalesced
+
+
+def test_async_runner():
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from multi_runner import SimulatedLink
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+    from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    start, end = (7, 0), (1, 6)
+
+    # new values every 2 ms, each of them moves the simulation on by 80 ms
+    simulator = Simulator(maze, start)
+    link = SimulatedLink(simulator, step=0.08, sample_period=0.002)
+    instructions = InstructionCompiler(maze).route(start, end)[1]
+    walker = MazeWalker(OrderedInstructionsGuide(instructions), events=EventLog(Level.OFF), clock=link.clock)
+    runner = AsyncThymioRunner({BUTTON_CENTER, PROXIMITY_FRONT_BACK}, walker, link, max_rate=1000)
+    runner.run(max_seconds=30)
+
+    stats = runner.stats
+    assert runner.stopped and simulator.cell == end and not simulator.collisions
+    assert stats.ticks == stats.tick.count == stats.latency.count + stats.idle_ticks > 0
+    # ticks follow the data within milliseconds, not a period (80 ms) later; loose enough for a busy host
+    assert stats.latency.percentile(0.5) <= 20_000_000
+    # the walker sets both motors every tick, only the changes are sent
+    assert stats.coalesced > stats.writes > 0
+
+    # data twice as fast as the cap: the ticks are throttled to max_rate
+    simulator = Simulator(maze, start)
+    link = SimulatedLink(simulator, step=0.08, sample_period=0.0025)
+    walker = MazeWalker(OrderedInstructionsGuide([]), events=EventLog(Level.OFF), clock=link.clock)
+    runner = AsyncThymioRunner({BUTTON_CENTER, PROXIMITY_FRONT_BACK}, walker, link, max_rate=200)
+    began = time.monotonic()
+    runner.run(max_seconds=0.3)
+    # a busy host only makes for fewer ticks, the cap holds anyway
+    assert runner.stopped and runner.stats.ticks <= 200 * (time.monotonic() - began) + 1
+
+
+def test_idle_ticks():
+    from multi_runner import SimulatedLink
+    from simulator import Simulator
+    from thymio_python.thymiodirect.thymio_constants import MOTOR_LEFT
+
+    class Counter:
+        th = None
+        ticks = 0
+
+        def _update(self):
+            self.ticks += 1
+            self.th[MOTOR_LEFT] = 0
+
+        def stop(self):
+            pass
+
+    # a link that can't tell when data arrives is ticked every idle_period
+    counter = Counter()
+    runner = AsyncThymioRunner((), counter, SimulatedLink(Simulator([[1, 1]], (0, 0))), idle_period=0.01)
+    runner.run(max_seconds=0.2)
+    assert runner.stats.idle_ticks == runner.stats.ticks == counter.ticks >= 5
+    assert runner.stats.writes + runner.stats.coalesced == counter.ticks
+
+    # the same value is only sent again once resend_ns have passed, in case it got lost
+    sent = {}
+    node = _CoalescingNode(sent, resend_ns=100)
+    flushes = []
+    for now_ns in (0, 50, 99, 100, 150, 200):
+        node[MOTOR_LEFT] = 0 if now_ns < 150 else 1
+        flushes.append(node.flush(now_ns))
+    assert flushes == [(1, 0), (0, 1), (0, 1), (1, 0), (1, 0), (0, 1)] and sent == {MOTOR_LEFT: 1}
+
+
+if __name__ == "__main__":
+    test_async_runner()
+    test_idle_ticks()
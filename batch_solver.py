@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from direction import Direction
+from grid_search import Maze, Point, as_grid
+from maze_graph import MazeGraph
+
+
+class Solution(NamedTuple):
+    """Result of one (start, end) query. Both lists are empty if there is no route."""
+    path: List[Point]
+    directions: List[Direction]
+
+
+Query = Tuple[int, Point, Point]  # (position in the input, start, end)
+
+# state of a worker process, set up once by _init_worker and reused for every chunk it solves
+_worker_graph: Optional[MazeGraph] = None
+
+
+def solve_many(maze: Maze, pairs: Sequence[Tuple[Point, Point]], workers: Optional[int] = None,
+               chunk_size: Optional[int] = None) -> List[Solution]:
+    """
+    Solves many (start, end) pairs on the same maze and returns the solutions in the order of pairs.
+    See iter_solve_many for the parameters.
+    """
+    solutions: List[Optional[Solution]] = [None] * len(pairs)
+    for index, solution in iter_solve_many(maze, pairs, workers, chunk_size):
+        solutions[index] = solution
+
+    return solutions
+
+
+def iter_solve_many(maze: Maze, pairs: Iterable[Tuple[Point, Point]], workers: Optional[int] = None,
+                    chunk_size: Optional[int] = None) -> Iterator[Tuple[int, Solution]]:
+    """
+    Solves many (start, end) pairs on the same maze and yields (index into pairs, solution) as soon as they are done,
+    so not necessarily in input order.
+
+    Parameter
+    ----------
+    maze:
+    Maze in the same format find_path takes.
+
+    pairs:
+    (start, end) points to find routes for.
+
+    workers:
+    Number of worker processes, defaults to the number of CPUs. With one worker everything runs in this process.
+    The maze is put into shared memory once and every worker compiles it into a MazeGraph once, so only the points
+    and the results are sent between the processes.
+
+    chunk_size:
+    How many pairs are sent to a worker at once. Defaults to splitting the pairs into four chunks per worker.
+    """
+    queries = [(index, tuple(start), tuple(end)) for index, (start, end) in enumerate(pairs)]
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, max(len(queries), 1))
+    grid = as_grid(maze)
+
+    if workers == 1:
+        graph = MazeGraph.compile(grid)
+        for query in queries:
+            yield query[0], _solve(graph, query)
+        return
+
+    chunk_size = chunk_size or max(1, -(-len(queries) // (4 * workers)))
+    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+
+    memory = shared_memory.SharedMemory(create=True, size=max(grid.nbytes, 1))
+    try:
+        np.ndarray(grid.shape, dtype=grid.dtype, buffer=memory.buf)[...] = grid
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(memory.name, grid.shape, grid.dtype.str)) as executor:
+            futures = [executor.submit(_solve_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                yield from future.result()
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def _init_worker(name: str, shape: Tuple[int, int], dtype: str):
+    global _worker_graph
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        grid = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        _worker_graph = MazeGraph.compile(grid)  # copies what it needs, the shared block isn't referenced afterwards
+        del grid
+    finally:
+        memory.close()
+
+
+def _solve_chunk(chunk: List[Query]) -> List[Tuple[int, Solution]]:
+    return [(query[0], _solve(_worker_graph, query)) for query in chunk]
+
+
+def _solve(graph: MazeGraph, query: Query) -> Solution:
+    _, start, end = query
+    route = graph.route(start, end)
+    if route is None:
+        return Solution([], [])
+
+    path = graph.cells(route)
+    return Solution(path, graph.directions(route) if len(path) > 1 else [])
+
+
+def benchmark(size: int = 151, queries: int = 2000, seed: int = 0):
+    """
+    Prints the time solve_many takes for random queries on a random maze with 1, 2, 4, ... workers up to the number of
+    CPUs. Pool start-up and compiling the graph in every worker are included. Run with python batch_solver.py
+    --benchmark.
+    """
+    rng = np.random.default_rng(seed)
+    maze = np.ones((size, size), dtype=np.int64)
+    maze[1::2, 1::2] = 0  # pillars, so there is a junction on every other cell
+    maze[rng.random(maze.shape) < 0.15] = 0
+    walkable = np.argwhere(maze)
+    ends = walkable[rng.integers(len(walkable), size=(queries, 2))]
+    pairs = [((int(a[1]), int(a[0])), (int(b[1]), int(b[0]))) for a, b in ends]
+
+    baseline = None
+    workers = 1
+    while True:
+        began = time.perf_counter()
+        solve_many(maze, pairs, workers=workers)
+        elapsed = time.perf_counter() - began
+        baseline = baseline or elapsed
+        print(f"{workers:3} worker(s): {elapsed:7.3f} s  speedup {baseline / elapsed:5.2f}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(2 * workers, os.cpu_count())
+
+
+def test_solve_many():
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    pairs = [((7, 0), (1, 6)), ((1, 6), (1, 6)), ((7, 0), (3, 3))] * 5
+    expected = [
+        Solution([(7, 0), (7, 1), (7, 2), (7, 3), (7, 4), (7, 5), (6, 5), (5, 5), (4, 5), (3, 5), (3, 4), (3, 3),
+                  (2, 3), (1, 3), (1, 4), (1, 5), (1, 6)],
+                 [Direction.RIGHT, Direction.RIGHT, Direction.LEFT, Direction.LEFT]),
+        Solution([(1, 6)], []),
+        Solution([(7, 0), (7, 1), (7, 2), (7, 3), (7, 4), (7, 5), (6, 5), (5, 5), (4, 5), (3, 5), (3, 4), (3, 3)],
+                 [Direction.RIGHT, Direction.RIGHT]),
+    ] * 5
+
+    assert solve_many(maze, pairs, workers=1) == expected
+    assert solve_many(maze, pairs, workers=2, chunk_size=2) == expected
+    assert sorted(index for index, _ in iter_solve_many(maze, pairs, workers=2)) == list(range(len(pairs)))
+
+    maze[5][5] = 0
+    assert solve_many(maze, pairs[:1], workers=1) == [Solution([], [])]
+
+
+if __name__ == "__main__":
+    test_solve_many()
+    if "--benchmark" in sys.argv[1:]:
+        benchmark()
@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from grid_search import is_uniform
+from maze_file import load_maze, save_maze
+from maze_generator import KINDS, corners, generate_maze
+from maze_solver import Engine, Search, get_directions, search_path
+
+SIZES = (10, 100, 1000, 4000)
+# the pathfinding library builds one object per cell, bigger mazes take minutes with it
+MAX_CELLS = {Engine.NATIVE: None, Engine.PATHFINDING: 250_000}
+
+
+def run_benchmark(sizes: Sequence[int] = SIZES, kinds: Sequence[str] = KINDS,
+                  engines: Sequence[Engine] = tuple(Engine), seed: int = 0, repeat: int = 3,
+                  cache_dir: Optional[str] = None, log=None,
+                  searches: Sequence[Search] = (Search.AUTO,)) -> List[dict]:
+    """
+    Solves a generated size x size maze of every kind (see maze_generator) from the top left to the bottom right
+    corner with every engine and (for the native engine) every search, and returns one record per (kind, size,
+    engine, search):
+
+    find_path_s / get_directions_s: the fastest of repeat runs, in seconds
+    peak_bytes: the most memory allocated at once during the search and get_directions (traced in a separate run, so
+                the tracing doesn't slow down the timed ones)
+    expansions: nodes the search expanded, path_length and directions: what it found
+    algorithm: the search that actually ran (what AUTO picked)
+
+    Engines are skipped on mazes bigger than MAX_CELLS allows, searches on mazes they don't work on (the uniform ones
+    on weighted mazes). Generated mazes are kept in cache_dir (in the maze_file format) if it's set, since generating
+    the big ones takes longer than solving them.
+    """
+    records = []
+    for size in sizes:
+        for kind in kinds:
+            maze = _maze(kind, size, seed, cache_dir)
+            start, end = corners(maze)
+            uniform = is_uniform(maze)
+            for engine in engines:
+                limit = MAX_CELLS.get(engine)
+                if limit is not None and maze.size > limit:
+                    continue
+                for search in searches if engine == Engine.NATIVE else (Search.ASTAR,):
+                    if not uniform and search not in (Search.AUTO, Search.ASTAR):
+                        continue
+                    record = _measure(maze, start, end, engine, search, repeat)
+                    record.update(kind=kind, size=size, seed=seed, engine=engine.value, search=search.value)
+                    records.append(record)
+                    if log is not None:
+                        print(_format(record), file=log, flush=True)
+
+    return records
+
+
+def compare(baseline: Iterable[dict], records: Iterable[dict], tolerance: float = 0.25) -> List[str]:
+    """
+    The regressions of records against a baseline run, as readable messages: a different path length (a bug, the
+    mazes are the same for the same seed), more expansions, or a time or memory peak more than tolerance above the
+    baseline. Records without a counterpart in the baseline are ignored.
+    """
+    known = {_key(record): record for record in baseline}
+    regressions = []
+    for record in records:
+        before = known.get(_key(record))
+        if before is None:
+            continue
+        name = "{kind} {size}x{size} {engine} {search}".format(**record)
+        if record["path_length"] != before["path_length"]:
+            regressions.append(f"{name}: path length {before['path_length']} -> {record['path_length']}")
+        if record["expansions"] > before["expansions"]:
+            regressions.append(f"{name}: expansions {before['expansions']} -> {record['expansions']}")
+        for measure in ("find_path_s", "get_directions_s", "peak_bytes"):
+            worse = record[measure] - before[measure]
+            if worse > before[measure] * tolerance and worse > _NOISE[measure]:
+                regressions.append(f"{name}: {measure} {before[measure]:.6g} -> {record[measure]:.6g}")
+
+    return regressions
+
+
+def save_results(path: str, records: List[dict]):
+    with open(path, "w") as file:
+        json.dump({"environment": _environment(), "results": records}, file, indent=2)
+
+
+def load_results(path: str) -> List[dict]:
+    with open(path) as file:
+        return json.load(file)["results"]
+
+
+# differences below these are noise no matter how big they are relative to the baseline
+_NOISE = {"find_path_s": 0.001, "get_directions_s": 0.001, "peak_bytes": 64 * 1024}
+
+
+def _key(record: dict):
+    return record["kind"], record["size"], record["seed"], record["engine"], record["search"]
+
+
+def _maze(kind: str, size: int, seed: int, cache_dir: Optional[str]) -> np.ndarray:
+    if cache_dir is None:
+        return generate_maze(kind, size, seed=seed)
+    path = os.path.join(cache_dir, f"{kind}-{size}-{seed}.maze")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        save_maze(path, generate_maze(kind, size, seed=seed))
+    return load_maze(path)
+
+
+def _measure(maze: np.ndarray, start, end, engine: Engine, search: Search, repeat: int) -> dict:
+    solver_maze = maze if engine == Engine.NATIVE else maze.tolist()
+    search_s = get_directions_s = float("inf")
+    for _ in range(max(repeat, 1)):
+        began = time.perf_counter()
+        result = search_path(solver_maze, start, end, engine, search)
+        search_s = min(search_s, time.perf_counter() - began)
+        began = time.perf_counter()
+        directions = get_directions(result.path) if len(result.path) > 1 else []
+        get_directions_s = min(get_directions_s, time.perf_counter() - began)
+
+    tracemalloc.start()
+    try:
+        traced = search_path(solver_maze, start, end, engine, search).path
+        if len(traced) > 1:
+            get_directions(traced)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "cells": int(maze.size),
+        "path_length": len(result.path),
+        "directions": len(directions),
+        "expansions": result.expansions,
+        "algorithm": result.search.value,
+        "find_path_s": search_s,
+        "get_directions_s": get_directions_s,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def _format(record: dict) -> str:
+    return ("{kind:>8} {size:>5} {engine:>11} {search:>13} -> {algorithm:>13}: find_path {find_path_s:9.4f} s"
+            "  get_directions {get_directions_s:8.4f} s  peak {peak_mb:8.1f} MB  expansions {expansions:>9}"
+            "  path {path_length}"
+            .format(peak_mb=record["peak_bytes"] / 2 ** 20, **record))
+
+
+def _environment() -> Dict[str, str]:
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+            "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def test_benchmark():
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        records = run_benchmark(sizes=(15, 31), repeat=1, cache_dir=directory)
+        assert len(records) == 2 * len(KINDS) * len(Engine)
+        assert len(os.listdir(directory)) == 2 * len(KINDS)
+        # everything but the measurements is the same on the next run (from the cached mazes)
+        again = run_benchmark(sizes=(15, 31), repeat=1, cache_dir=directory)
+        assert [_key(record) + (record["path_length"], record["expansions"]) for record in records] == \
+            [_key(record) + (record["path_length"], record["expansions"]) for record in again]
+
+        for record in records:
+            assert record["expansions"] > 0 and record["path_length"] > 1
+        # both engines find equally long routes on the mazes without weights
+        for native, reference in zip(records[::2], records[1::2]):
+            assert native["engine"] == Engine.NATIVE.value and reference["engine"] == Engine.PATHFINDING.value
+            assert reference["algorithm"] == Search.ASTAR.value
+            if native["kind"] != "weighted":
+                assert native["path_length"] == reference["path_length"]
+                assert native["algorithm"] != Search.ASTAR.value
+
+        # every search, except for the uniform ones on the weighted maze
+        searches = run_benchmark(sizes=(31,), engines=(Engine.NATIVE,), repeat=1, cache_dir=directory,
+                                 searches=tuple(Search))
+        assert len(searches) == len(KINDS) * len(Search) - 2
+        assert len({(record["kind"], record["path_length"]) for record in searches}) == len(KINDS)
+
+        path = os.path.join(directory, "results.json")
+        save_results(path, records)
+        baseline = load_results(path)
+        assert compare(baseline, records) == []
+
+        slower = [dict(record) for record in records]
+        slower[0]["find_path_s"] = records[0]["find_path_s"] * 2 + 0.01
+        slower[1]["expansions"] += 1
+        regressions = compare(baseline, slower)
+        assert len(regressions) == 2 and "find_path_s" in regressions[0] and "expansions" in regressions[1]
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks find_path and get_directions on generated mazes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=KINDS)
+    parser.add_argument("--engines", nargs="+", choices=[engine.value for engine in Engine],
+                        default=[engine.value for engine in Engine])
+    parser.add_argument("--searches", nargs="+", choices=[search.value for search in Search],
+                        default=[Search.AUTO.value], help="the searches to run with the native engine")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache", help="directory to keep the generated mazes in")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run, regressions against it fail the run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    options = parser.parse_args(arguments)
+
+    records = run_benchmark(options.sizes, options.kinds, [Engine(engine) for engine in options.engines],
+                            options.seed, options.repeat, options.cache, log=sys.stdout,
+                            searches=[Search(search) for search in options.searches])
+    if options.output:
+        save_results(options.output, records)
+    if options.baseline:
+        regressions = compare(load_results(options.baseline), records, options.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
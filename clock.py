@@ -0,0 +1,58 @@
+import time
+from abc import ABC, abstractmethod
+
+
+class Clock(ABC):
+    """
+    Source of time for everything that times robot behaviour (e.g. the turns of the MazeWalker), so it can run on wall
+    clock time on the robot and on virtual time in simulations and replays.
+    """
+    @abstractmethod
+    def time_ns(self) -> int:
+        """Current time in nanoseconds. Only differences between two readings are meaningful."""
+        pass
+
+
+class RealClock(Clock):
+    """Wall clock time (time.time_ns). Jumps when the system clock is adjusted, e.g. by NTP."""
+    def time_ns(self) -> int:
+        return time.time_ns()
+
+
+class MonotonicClock(Clock):
+    """Monotonic time (time.monotonic_ns), never jumps. The right choice for measuring durations on the robot."""
+    def time_ns(self) -> int:
+        return time.monotonic_ns()
+
+
+class SimulatedClock(Clock):
+    """Virtual time that only moves when it's advanced, e.g. by the simulator after every tick."""
+    def __init__(self, start_ns: int = 0):
+        self._now_ns = start_ns
+
+    def time_ns(self) -> int:
+        return self._now_ns
+
+    def advance(self, seconds: float):
+        self.advance_ns(round(seconds * 1e9))
+
+    def advance_ns(self, nanoseconds: int):
+        if nanoseconds < 0:
+            raise ValueError("Time can't go backwards.")
+        self._now_ns += nanoseconds
+
+
+def test_clocks():
+    clock = SimulatedClock()
+    clock.advance(0.08)
+    clock.advance_ns(5)
+    assert clock.time_ns() == 80_000_005
+
+    monotonic = MonotonicClock()
+    first = monotonic.time_ns()
+    assert monotonic.time_ns() >= first
+    assert abs(RealClock().time_ns() - time.time_ns()) < 1e9
+
+
+if __name__ == "__main__":
+    test_clocks()
@@ -1,4 +1,4 @@
-from maze_solver import get_directions, find_path
+from instruction_compiler import InstructionCompiler
 from maze_walker import MazeWalker
 from ordered_instructions_guide import OrderedInstructionsGuide
 from thymio_python.thymiodirect import SingleSerialThymioRunner
@@ -16,5 +16,6 @@ maze = \
 start = (7, 0)
 end = (1, 6)
 
-walker = MazeWalker(OrderedInstructionsGuide(get_directions(find_path(maze, start, end))))
+path, instructions = InstructionCompiler(maze).route(start, end)
+walker = MazeWalker(OrderedInstructionsGuide(instructions))
 SingleSerialThymioRunner({BUTTON_CENTER, PROXIMITY_FRONT_BACK}, walker, 0.08).run()
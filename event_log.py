@@ -0,0 +1,239 @@
+import threading
+from array import array
+from enum import IntEnum
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Sequence
+
+from clock import Clock, MonotonicClock
+from direction import Direction
+
+if TYPE_CHECKING:
+    # recording and flushing get by without NumPy, so a walker doesn't load it when it starts
+    import numpy as np
+
+
+class Level(IntEnum):
+    DEBUG = 10  # every tick, e.g. the proximity readings
+    INFO = 20  # once per intersection
+    OFF = 100
+
+
+class Event(IntEnum):
+    TURNING = 1
+    PROXIMITY = 2
+    FRONT_BLOCKADE_MISSED = 3
+    TURN_CHOSEN = 4
+    INTERSECTION_IN_SIGHT = 5
+    MOVING_TO_CENTER = 6
+    NEW_DIRECTIONS = 7
+
+
+LEVELS = {
+    Event.TURNING: Level.DEBUG,
+    Event.PROXIMITY: Level.DEBUG,
+    Event.MOVING_TO_CENTER: Level.DEBUG,
+    Event.FRONT_BLOCKADE_MISSED: Level.INFO,
+    Event.TURN_CHOSEN: Level.INFO,
+    Event.INTERSECTION_IN_SIGHT: Level.INFO,
+    Event.NEW_DIRECTIONS: Level.INFO,
+}
+
+# columns of a record, all of them int64
+TIME, EVENT, LEFT, RIGHT, FRONT, TURN, WAITING, DIRECTIONS, EXTRA = range(9)
+FIELDS = 9
+NONE = -1  # stored for a direction that is None
+
+
+class EventLog:
+    """
+    Structured replacement for printing in the control loop.
+
+    Every event is one fixed size record of int64 columns (see TIME ... EXTRA) written into a preallocated ring buffer,
+    so recording it is a handful of integer stores and no I/O. A background thread drains the buffer every
+    flush_interval seconds and appends the raw records to path and/or prints them decoded (echo). It's only started
+    with the first event recorded, so a log nothing is recorded into (e.g. a walker that never runs) costs no thread.
+    Records the thread couldn't drain before the ring wrapped around are counted in dropped.
+
+    Events below the level are not recorded at all: debug() and info() are replaced by a function that does nothing, so
+    a disabled call costs as much as calling an empty function.
+    Use decode to turn records (from the buffer or from a file, see read) back into the messages MazeWalker used to
+    print.
+    """
+
+    def __init__(self, level: Level = Level.INFO, capacity: int = 4096, path: Optional[str] = None,
+                 echo: bool = False, flush_interval: float = 0.5, clock: Optional[Clock] = None):
+        self.capacity = capacity
+        self.path = path
+        self.echo = echo
+        self.flush_interval = flush_interval
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.dropped = 0
+        self._buffer = array("q", [0]) * (capacity * FIELDS)
+        self._written = 0  # number of records ever written, only the recording thread changes it
+        self._flushed = 0  # number of records ever drained, only the flushing side changes it
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.level = level
+
+        if path:
+            open(path, "wb").close()
+
+    @property
+    def level(self) -> Level:
+        return self._level
+
+    @level.setter
+    def level(self, level: Level):
+        self._level = level
+        record = self._record if self._thread is not None or not (self.path or self.echo) else self._record_first
+        self.debug = record if level <= Level.DEBUG else _ignore
+        self.info = record if level <= Level.INFO else _ignore
+
+    def _record_first(self, *args, **kwargs):
+        """Starts the flushing thread, then records like _record, which takes over from here on."""
+        self._thread = threading.Thread(target=self._flush_periodically, name="event-log-flush", daemon=True)
+        self._thread.start()
+        self.level = self._level
+        self._record(*args, **kwargs)
+
+    def _record(self, event: Event, turn: Direction = Direction.STOP, waiting: Optional[Direction] = None,
+                directions: Optional[Direction] = None, extra: Optional[Direction] = None,
+                left: int = 0, right: int = 0, front: int = 0):
+        buffer = self._buffer
+        i = (self._written % self.capacity) * FIELDS
+        buffer[i] = self.clock.time_ns()
+        buffer[i + EVENT] = event
+        buffer[i + LEFT] = left
+        buffer[i + RIGHT] = right
+        buffer[i + FRONT] = front
+        buffer[i + TURN] = turn.value
+        buffer[i + WAITING] = NONE if waiting is None else waiting.value
+        buffer[i + DIRECTIONS] = NONE if directions is None else directions.value
+        buffer[i + EXTRA] = NONE if extra is None else extra.value
+        self._written += 1
+
+    def records(self) -> "np.ndarray":
+        """The records that are still in the ring buffer (oldest first) as a n x FIELDS array, without draining them."""
+        import numpy as np
+
+        written = self._written
+        count = min(written, self.capacity)
+        ring = np.frombuffer(self._buffer, dtype=np.int64).reshape(self.capacity, FIELDS)
+        return np.roll(ring, -(written % self.capacity), axis=0)[self.capacity - count:].copy()
+
+    def flush(self):
+        """Drains everything recorded so far to the sinks. Called by the background thread, but can be called anytime."""
+        with self._flush_lock:
+            written = self._written
+            start = max(self._flushed, written - self.capacity)
+            self.dropped += start - self._flushed
+            if start == written:
+                return
+
+            # slicing copies, the recording thread may keep on writing
+            first, last = start % self.capacity, start % self.capacity + written - start
+            if last <= self.capacity:
+                chunk = self._buffer[first * FIELDS:last * FIELDS]
+            else:
+                chunk = self._buffer[first * FIELDS:] + self._buffer[:(last - self.capacity) * FIELDS]
+            # records that were overwritten while copying are lost as well
+            overwritten = max(self._written - self.capacity - start, 0)
+            chunk = chunk[overwritten * FIELDS:]
+            self.dropped += overwritten
+            self._flushed = written
+
+        if self.path:
+            with open(self.path, "ab") as file:
+                file.write(chunk.tobytes())
+        if self.echo:
+            for line in decode(chunk[i:i + FIELDS] for i in range(0, len(chunk), FIELDS)):
+                print(line)
+
+    def close(self):
+        """Stops the background thread and flushes what's left."""
+        self._closed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+
+def _ignore(*args, **kwargs):
+    pass
+
+
+def read(path: str) -> "np.ndarray":
+    """Loads the records an EventLog wrote to path as a n x FIELDS array."""
+    import numpy as np
+
+    return np.fromfile(path, dtype=np.int64).reshape(-1, FIELDS)
+
+
+def decode(records: Iterable[Sequence[int]]) -> Iterator[str]:
+    """Turns records into the human-readable messages MazeWalker used to print, one or more lines per record."""
+    for record in records:
+        yield from _MESSAGES[Event(record[EVENT])](record)
+
+
+def _direction(value: int) -> Optional[Direction]:
+    return None if value == NONE else Direction(int(value))
+
+
+_MESSAGES = {
+    Event.TURNING: lambda r: [f"Doing turn: {_direction(r[TURN])}"],
+    Event.PROXIMITY: lambda r: [f"Left: {r[LEFT]} | Right: {r[RIGHT]} | Front: {r[FRONT]}"],
+    Event.FRONT_BLOCKADE_MISSED: lambda r: [
+        "Didn't see front blockade when spotting the intersection; removing STRAIGHT from possibilities."],
+    Event.TURN_CHOSEN: lambda r: [
+        "On intersection; ready to take a turn.",
+        f"Chose {_direction(r[TURN])} from {{{_direction(r[DIRECTIONS])}}}"],
+    Event.INTERSECTION_IN_SIGHT: lambda r: [
+        f"Intersection in sight: {_direction(r[WAITING])}",
+        f"Possible directions as of now: {_direction(r[DIRECTIONS])}"],
+    Event.MOVING_TO_CENTER: lambda r: [f"Moving to the center of the intersection: {_direction(r[WAITING])}"],
+    Event.NEW_DIRECTIONS: lambda r: [
+        f"Found new direction(s): {{{_direction(r[DIRECTIONS])}}} -> Possibilities now: {{{_direction(r[EXTRA])}}}"],
+}
+
+
+def test_event_log():
+    import os
+    import tempfile
+
+    from clock import SimulatedClock
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "events.bin")
+
+    clock = SimulatedClock()
+    log = EventLog(Level.INFO, capacity=4, path=path, clock=clock, flush_interval=60)
+
+    log.debug(Event.PROXIMITY, left=1, right=2, front=3)  # below the level, not recorded
+    assert log._thread is None  # nothing recorded yet
+    log.info(Event.INTERSECTION_IN_SIGHT, waiting=Direction.RIGHT, directions=Direction.RIGHT | Direction.U_TURN)
+    clock.advance_ns(1)
+    log.info(Event.TURN_CHOSEN, turn=Direction.RIGHT, directions=Direction.RIGHT | Direction.U_TURN)
+    assert log.records()[:, TIME].tolist() == [0, 1] and log._thread.is_alive()
+    log.flush()
+
+    log.level = Level.DEBUG
+    for i in range(6):  # laps the ring before the next flush
+        log.debug(Event.PROXIMITY, left=i, right=2 * i, front=3 * i)
+    assert len(log.records()) == 4
+    log.close()
+    assert log.dropped == 2
+
+    records = read(path)
+    directory.cleanup()
+    assert records[:, EVENT].tolist() == [Event.INTERSECTION_IN_SIGHT, Event.TURN_CHOSEN] + [Event.PROXIMITY] * 4
+    lines = list(decode(records))
+    assert lines[0] == f"Intersection in sight: {Direction.RIGHT}"
+    assert lines[3] == f"Chose {Direction.RIGHT} from {{{Direction.RIGHT | Direction.U_TURN}}}"
+    assert lines[-1] == "Left: 5 | Right: 10 | Front: 15"
+
+
+if __name__ == "__main__":
+    test_event_log()
@@ -0,0 +1,390 @@
+import json
+import os
+from heapq import heappop, heappush
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from direction import Direction
+from grid_search import Point
+from guide import Guide, copy_containers
+from heading import Heading
+from ordered_instructions_guide import OrderedInstructionsGuide
+
+_State = Tuple[Point, Heading]  # a crossing and the heading the walker reached it in
+_TURNS = (Direction.STRAIGHT, Direction.RIGHT, Direction.LEFT, Direction.U_TURN)  # also the order ties are broken in
+
+
+class ExplorationGuide(Guide):
+    """
+    A Guide for mazes nobody has a map of: it explores the maze with Trémaux's algorithm, drawing a map of the
+    crossings as it goes, and once it has a map that leads to the end it drives the shortest route on it instead.
+
+    The walker only reports relative options, so the guide keeps track of its position by dead reckoning: odometer
+    returns the distance driven forward so far in cells (e.g. from the wheel speeds, or Simulator.distance divided by
+    the cell size). Corridors between two crossings are straight (a bend is a crossing for the walker too), so the
+    distance since the last crossing rounded to whole cells tells which cell the walker is on. What's left over after
+    rounding is carried into the next corridor, so stopping a bit off the center of a crossing doesn't add up.
+
+    Exploring (Trémaux): every corridor end at a crossing is marked when it's entered or left. On a crossing it hasn't
+    been to, the walker takes an unmarked corridor; if it arrives on a known crossing through a new corridor, it turns
+    around; otherwise it takes the corridor with the fewest marks, never one marked twice. Ties go to the corridor that
+    leads closest to the end (like flood fill with all walls still unknown). Every decision is a handful of dict
+    lookups, no matter how big the maze is. Only if Trémaux gets stuck, the guide plans the way to the closest
+    corridor that hasn't been driven yet on the map. The walker stops on the end, or with complete, once the whole
+    maze is explored. The end has to be a cell the walker stops on (a dead end or crossing). Known crossings the walker
+    drives through without stopping are found by looking at the cells of the corridor it just drove, so that costs one
+    lookup per cell driven.
+
+    The map is saved to path when the walker is told to stop. If path already holds a map with a route from start to
+    the end, the guide doesn't explore at all but drives that route (one instruction per crossing, as
+    OrderedInstructionsGuide does), shortest by the number of cells.
+    """
+
+    def __init__(self, start: Point, end: Point, heading: Heading, odometer: Callable[[], float],
+                 path: Optional[str] = None, complete: bool = False):
+        self.start = tuple(start)
+        self.end = tuple(end)
+        self.path = path
+        self.complete = complete
+        self.position = self.start
+        self.start_heading = heading
+        self.heading = heading
+        self.explored = False  # the end (or with complete, everything) was reached and the map saved
+        self._odometer = odometer
+        self._odometer_last = odometer()
+        self._residual = 0.0  # cells the walker is past the center of its last crossing, along its heading
+
+        self._exits: Dict[Point, Tuple[Heading, ...]] = {}  # every crossing and the headings it can be left in
+        self._edges: Dict[Tuple[Point, Heading], int] = {}  # (crossing, heading) -> length of the corridor
+        self._marks: Dict[Tuple[Point, Heading], int] = {(self.start, heading): 1}
+        self._visited = {self.start}
+        self._walls = set()  # (crossing, heading) the walker reported as open but turned out to be walls
+        self._plan: Dict[Point, Heading] = {}  # crossing -> heading to leave it in, on the way to unexplored corridors
+
+        self._route: Optional[OrderedInstructionsGuide] = None
+        if path and os.path.exists(path):
+            self.load(path)
+            instructions = self.route()
+            if instructions is not None:
+                self._route = OrderedInstructionsGuide(instructions)
+
+    @property
+    def speed_run(self) -> bool:
+        """Whether the guide drives a route from a saved map instead of exploring."""
+        return self._route is not None
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        if self._route is not None:
+            return self._route.on_detected_crossing(options)
+        if self.explored:
+            return Direction.STOP
+
+        previous = self.position
+        cell, back = self._arrive()
+        if cell == previous:
+            # the walker saw an opening that isn't there (e.g. one it passed on the way), turned into the wall and
+            # reports the same crossing again
+            self._walls.add((cell, self.heading))
+            self._marks[cell, self.heading] -= 1
+            # U_TURN is always an option for the walker, but now behind it is the wall it turned away from
+            if (cell, back) not in self._edges:
+                options &= ~Direction.U_TURN
+        headings = tuple(heading for heading in (self.heading.turn(direction) for direction in _TURNS
+                                                 if direction in options) if (cell, heading) not in self._walls)
+        new = cell not in self._visited
+        self._visited.add(cell)
+        self._exits[cell] = headings
+        if cell != previous:
+            self._marks[cell, back] = self._marks.get((cell, back), 0) + 1
+
+        if cell == self.end and not self.complete:
+            return self._finish()
+
+        choice = self._plan.pop(cell, None)
+        if choice not in headings:
+            self._plan.clear()  # the walker didn't stop where the plan expected it to
+            if not new and cell != previous and self._marks[cell, back] == 1 and back in headings:
+                choice = back  # a new corridor led to a known crossing, it's a loop
+            else:
+                choice = self._least_marked(cell, headings)
+            if choice is None:
+                choice = self._plan_to_unexplored(cell)
+                if choice is None:
+                    return self._finish()
+
+        self._marks[cell, choice] = self._marks.get((cell, choice), 0) + 1
+        direction = self.heading.turn_to(choice)
+        if direction == Direction.U_TURN:
+            self._residual = -self._residual
+        elif direction != Direction.STRAIGHT:
+            self._residual = 0.0  # the error is to the side now
+        self.heading = choice
+        return direction
+
+    def checkpoint(self):
+        # the map's containers only hold tuples, numbers and headings, copying the containers is enough
+        state = copy_containers(self.__dict__)
+        state["_route"] = None if self._route is None else self._route.checkpoint()
+        return state
+
+    def restore(self, checkpoint):
+        route = self._route
+        self.__dict__.update(copy_containers(checkpoint))
+        self._route = route
+        if route is not None:
+            route.restore(checkpoint["_route"])
+
+    def on_stop(self):
+        """Saves the map so far if there is a path to save it to, also when the exploration was cut short."""
+        if self.path and not self.speed_run:
+            self.save()
+
+    def route(self) -> Optional[List[Direction]]:
+        """
+        Instructions for the shortest route from start to the end on the map, one per crossing including the STOP on
+        the end. None if the map doesn't lead to the end.
+        """
+        first = self._edges.get((self.start, self.start_heading))
+        if first is None:
+            return None
+
+        origin = (_step(self.start, self.start_heading, first), self.start_heading)
+        path = self._search(origin, first, lambda state: state[1] if state[0] == self.end else None)
+        if path is None:
+            return None
+        return [state[1].turn_to(leaving) for state, leaving in path[:-1]] + [Direction.STOP]
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to save the map to.")
+        with open(path, "w") as file:
+            json.dump({
+                "exits": [[x, y, [int(heading) for heading in headings]] for (x, y), headings in self._exits.items()],
+                "edges": [[x, y, int(heading), length] for ((x, y), heading), length in self._edges.items()],
+            }, file)
+
+    def load(self, path: str):
+        """Adds the crossings and corridors of a saved map to the map."""
+        with open(path) as file:
+            data = json.load(file)
+        for x, y, headings in data["exits"]:
+            self._exits[x, y] = tuple(Heading(heading) for heading in headings)
+        for x, y, heading, length in data["edges"]:
+            self._edges[(x, y), Heading(heading)] = length
+
+    def _arrive(self) -> Tuple[Point, Heading]:
+        """Moves the position to the crossing the walker just reached and records the corridor that led there."""
+        reading = self._odometer()
+        distance = reading - self._odometer_last + self._residual
+        self._odometer_last = reading
+        length = max(0, round(distance))
+        self._residual = distance - length
+
+        heading, back = self.heading, self.heading.turn(Direction.U_TURN)
+        cell = _step(self.position, heading, length)
+        if not length:
+            return cell, back
+        # the walker doesn't always stop on a crossing it knows already, e.g. a T it reaches from the side with the
+        # wall. It drove straight through it, so split the corridor there and mark both of its ends.
+        last, last_step = self.position, 0
+        for step in range(1, length):
+            passed = _step(self.position, heading, step)
+            if passed in self._exits:
+                self._connect(last, heading, step - last_step)
+                self._marks[passed, back] = self._marks.get((passed, back), 0) + 1
+                self._marks[passed, heading] = self._marks.get((passed, heading), 0) + 1
+                last, last_step = passed, step
+        self._connect(last, heading, length - last_step)
+
+        self.position = cell
+        return cell, back
+
+    def _connect(self, cell: Point, heading: Heading, length: int):
+        self._edges[cell, heading] = length
+        self._edges[_step(cell, heading, length), heading.turn(Direction.U_TURN)] = length
+
+    def _plan_to_unexplored(self, cell: Point) -> Optional[Heading]:
+        """
+        Plans the shortest way on the map to the closest corridor nobody has driven yet, for when Trémaux is stuck
+        (the walker drove through crossings without stopping, so it couldn't always take the corridor it should have).
+        Returns the heading to leave cell in, None if everything is explored.
+        """
+        def unexplored(state):
+            return next((heading for heading in self._exits.get(state[0], ())
+                         if (state[0], heading) not in self._edges), None)
+
+        path = self._search((cell, self.heading), 0, unexplored)
+        if path is None:
+            return None
+        self._plan = {state[0]: leaving for state, leaving in path}
+        return self._plan.pop(cell)
+
+    def _search(self, origin: _State, distance: int,
+                goal: Callable[[_State], Optional[Heading]]) -> Optional[List[Tuple[_State, Heading]]]:
+        """
+        Dijkstra on the map from origin, a (crossing, heading it was reached in) state, to the closest state goal
+        returns a heading for. Returns the states on the way and the heading each one is left in (the one from goal
+        for the last one), None if no goal can be reached.
+        """
+        distances = {origin: distance}
+        previous: Dict[_State, Tuple[_State, Heading]] = {}
+        queue = [(distance, 0, origin)]
+        pushed = 1
+        while queue:
+            distance, _, state = heappop(queue)
+            if distance > distances[state]:
+                continue
+            leaving = goal(state)
+            if leaving is not None:
+                path = [(state, leaving)]
+                while state in previous:
+                    state, leaving = previous[state]
+                    path.append((state, leaving))
+                return path[::-1]
+
+            cell = state[0]
+            for heading in self._exits.get(cell, ()):
+                length = self._edges.get((cell, heading))
+                if length is None:
+                    continue
+                # corridors are straight, so they're reached in the heading they're left in
+                following = (_step(cell, heading, length), heading)
+                if distance + length < distances.get(following, float("inf")):
+                    distances[following] = distance + length
+                    previous[following] = (state, heading)
+                    heappush(queue, (distance + length, pushed, following))
+                    pushed += 1
+
+        return None
+
+    def _least_marked(self, cell: Point, headings: Sequence[Heading]) -> Optional[Heading]:
+        best, best_key = None, None
+        for order, heading in enumerate(headings):
+            marks = self._marks.get((cell, heading), 0)
+            if marks >= 2:
+                continue
+            x, y = _step(cell, heading, 1)
+            key = (marks, abs(x - self.end[0]) + abs(y - self.end[1]), order)
+            if best_key is None or key < best_key:
+                best, best_key = heading, key
+        return best
+
+    def _finish(self) -> Direction:
+        self.explored = True
+        if self.path:
+            self.save()
+        return Direction.STOP
+
+
+def _step(cell: Point, heading: Heading, length: int) -> Point:
+    dx, dy = heading.offset
+    return cell[0] + dx * length, cell[1] + dy * length
+
+
+def test_exploration_guide():
+    import tempfile
+
+    from maze_graph import MazeGraph
+    from replanning_guide import _drive
+
+    # loops everywhere and the corridor that heads for the end the most directly is a dead end
+    maze = \
+        [[1, 1, 1, 1, 1, 1, 1, 0, 1],
+         [1, 0, 0, 0, 1, 0, 1, 0, 1],
+         [1, 0, 1, 1, 1, 0, 1, 0, 1],
+         [1, 0, 1, 0, 0, 0, 0, 0, 1],
+         [1, 1, 1, 1, 1, 1, 1, 0, 1],
+         [0, 0, 1, 0, 0, 0, 1, 0, 1],
+         [1, 1, 1, 0, 1, 1, 1, 1, 1],
+         [1, 0, 0, 0, 1, 0, 0, 0, 0]]
+    start, end = (0, 7), (8, 0)
+    graph = MazeGraph.compile(maze)
+    shortest = len(graph.cells(graph.route(start, end)))
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "map.json")
+
+    def run():
+        cells = [start]
+        guide = ExplorationGuide(start, end, Heading.UP, lambda: len(cells) - 1, path)
+        crossings = _drive(maze, guide, start, Heading.UP, on_move=cells.append)
+        assert crossings[-1] == end
+        return guide, cells
+
+    guide, cells = run()
+    assert not guide.speed_run and guide.explored and os.path.exists(path)
+    assert len(cells) > shortest
+    assert all(maze[y][x] for x, y in guide._exits)
+
+    guide, cells = run()
+    assert guide.speed_run
+    assert len(cells) == shortest
+
+    # a checkpoint brings back the map as it was, the guide doesn't share its containers with it
+    driven = [0.0]
+    guide = ExplorationGuide(start, end, Heading.UP, lambda: driven[0])
+    driven[0] = 1.0
+    checkpoint = guide.checkpoint()
+    for _ in range(2):
+        assert guide.on_detected_crossing(Direction.RIGHT | Direction.U_TURN) == Direction.RIGHT
+        assert guide.position == (0, 6) and (0, 6) in guide._exits
+        guide.restore(checkpoint)
+        assert guide.position == start and not guide._exits and guide.heading == Heading.UP
+
+    directory.cleanup()
+
+
+def test_complete_exploration():
+    import tempfile
+
+    from event_log import EventLog, Level
+    from maze_walker import MazeWalker
+    from simulator import Simulator
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "map.json")
+
+    def run():
+        simulator = Simulator(maze, (7, 0))
+        guide = ExplorationGuide((7, 0), (1, 6), Heading.DOWN, lambda: simulator.distance / simulator.cell_size,
+                                 path, complete=True)
+        simulator.run(MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock), max_seconds=300)
+        assert simulator.stopped and not simulator.collisions
+        return guide, simulator
+
+    guide, simulator = run()
+    assert guide.explored
+    assert set(guide._exits) == {(7, 5), (3, 5), (3, 3), (1, 3), (1, 6), (1, 1), (5, 1), (5, 3)}
+    assert guide.route() == [Direction.RIGHT, Direction.RIGHT, Direction.LEFT, Direction.LEFT, Direction.STOP]
+
+    # the second run goes straight to the end on the saved map
+    guide, simulator = run()
+    assert guide.speed_run and simulator.cell == (1, 6)
+
+    # stopped (e.g. with the button) before it's done, what it has found so far is saved anyway
+    os.remove(path)
+    simulator = Simulator(maze, (7, 0))
+    guide = ExplorationGuide((7, 0), (1, 6), Heading.DOWN, lambda: simulator.distance / simulator.cell_size, path)
+    walker = MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock)
+    simulator.run(walker, max_seconds=20)
+    assert not guide.explored and not os.path.exists(path)
+    walker.stop()
+    assert os.path.exists(path) and guide._exits
+    with open(path) as file:
+        assert len(json.load(file)["exits"]) == len(guide._exits)
+
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    test_exploration_guide()
+    test_complete_exploration()
@@ -0,0 +1,344 @@
+from array import array
+from heapq import heappop, heappush
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+Maze = Union[Sequence[Sequence[int]], np.ndarray]
+Point = Tuple[int, int]
+
+
+def as_grid(maze: Maze) -> np.ndarray:
+    """
+    Returns the maze as a 2d integer NumPy array (rows = y, columns = x). Arrays that already have an integer dtype are
+    returned as they are, nested lists are converted once.
+    """
+    grid = np.asarray(maze)
+    if grid.ndim != 2:
+        raise ValueError(f"A maze has to be a 2d matrix but got {grid.ndim} dimension(s).")
+    if grid.dtype.kind not in "iu":
+        # same as pathfinding which truncates every value with int()
+        grid = grid.astype(np.int64)
+
+    return grid
+
+
+def padded_weights(grid: np.ndarray) -> Tuple[array, int]:
+    """
+    Flattens the grid into a buffer of movement costs surrounded by a one cell wall, so the neighbours of every walkable
+    cell can be reached with a constant offset and without bounds checks.
+    Returns the buffer and its row stride. Cell (x, y) lives at index (y + 1) * stride + x + 1.
+    """
+    height, width = grid.shape
+    padded = np.zeros((height + 2, width + 2), dtype=np.int64)
+    padded[1:-1, 1:-1] = grid
+    np.maximum(padded, 0, out=padded)  # anything below 1 is a wall
+
+    weights = array("q")
+    weights.frombytes(memoryview(padded).cast("B"))
+
+    return weights, width + 2
+
+
+def astar(grid: np.ndarray, start_node: Point, end_node: Point) -> Tuple[List[Point], int]:
+    """
+    A* on a 2d grid without diagonal movement, the same semantics as pathfinding's AStarFinder with
+    DiagonalMovement.never: values >= 1 are walkable, entering a cell costs its value and the heuristic is the manhattan
+    distance.
+    Instead of one object per cell, all state lives in flat buffers indexed by the padded cell index. The open set is a
+    heap of (f, h, index) tuples with lazy deletion, ties on f are broken towards the end node.
+
+    Returns the path as a list of x/y tuples (empty if there is none) and the number of expanded nodes.
+    """
+    _check_points(grid, start_node, end_node)
+    weights, stride = padded_weights(grid)
+    size = len(weights)
+
+    g = array("d", [float("inf")]) * size
+    parent = array("q", [-1]) * size
+    closed = bytearray(size)
+
+    start = (start_node[1] + 1) * stride + start_node[0] + 1
+    end = (end_node[1] + 1) * stride + end_node[0] + 1
+    end_x = end_node[0] + 1
+    end_y = end_node[1] + 1
+    # same order as pathfinding: up, right, down, left
+    offsets = (-stride, 1, stride, -1)
+
+    h = abs(start_node[0] - end_node[0]) + abs(start_node[1] - end_node[1])
+    g[start] = 0
+    open_set = [(h, h, start)]
+    runs = 0
+
+    while open_set:
+        _, _, node = heappop(open_set)
+        if closed[node]:
+            continue  # stale entry, the node was pushed again with a lower cost
+        closed[node] = 1
+        runs += 1
+
+        if node == end:
+            return _backtrace(parent, node, stride), runs
+
+        node_g = g[node]
+        for offset in offsets:
+            neighbour = node + offset
+            weight = weights[neighbour]
+            if not weight or closed[neighbour]:
+                continue
+
+            neighbour_g = node_g + weight
+            if neighbour_g < g[neighbour]:
+                g[neighbour] = neighbour_g
+                parent[neighbour] = node
+                y, x = divmod(neighbour, stride)
+                h = abs(x - end_x) + abs(y - end_y)
+                heappush(open_set, (neighbour_g + h, h, neighbour))
+
+    return [], runs
+
+
+def is_uniform(grid: np.ndarray) -> bool:
+    """Whether every walkable cell of the grid costs the same (1), so a shortest path is one with the fewest steps."""
+    return not grid.size or grid.max() <= 1
+
+
+def find_junctions(maze: Maze) -> np.ndarray:
+    """
+    The cells MazeWalker stops on and asks its guide about, as a boolean matrix of the maze's shape: every walkable
+    cell except the ones in the middle of a straight corridor (walkable neighbours exactly in front and behind). That's
+    crossings, T junctions and dead ends, but also corners, where the walker sees an opening to the side too. It
+    doesn't depend on the heading the walker arrives in, so it's computed once for the whole maze from the neighbours
+    of every cell.
+    """
+    grid = as_grid(maze)
+    walkable = np.zeros((grid.shape[0] + 2, grid.shape[1] + 2), dtype=bool)
+    walkable[1:-1, 1:-1] = grid >= 1
+    cells = walkable[1:-1, 1:-1]
+    up, down = walkable[:-2, 1:-1], walkable[2:, 1:-1]
+    left, right = walkable[1:-1, :-2], walkable[1:-1, 2:]
+    vertical = up & down & ~left & ~right
+    horizontal = left & right & ~up & ~down
+
+    return cells & ~vertical & ~horizontal
+
+
+def bidirectional_search(grid: np.ndarray, start_node: Point, end_node: Point) -> Tuple[List[Point], int]:
+    """
+    Breadth first search from both ends at once, for grids where every walkable cell costs 1 (see is_uniform), on
+    which it finds a path with as few steps as astar. Each round expands one whole level of the smaller of the two
+    frontiers, the search stops as soon as they touch, so in the common case each side only covers about half the
+    distance and nothing is ever pushed on a heap.
+
+    Returns the path as a list of x/y tuples (empty if there is none) and the number of expanded nodes.
+    """
+    _check_points(grid, start_node, end_node)
+    walkable, stride = _padded_walkable(grid)
+    start = (start_node[1] + 1) * stride + start_node[0] + 1
+    end = (end_node[1] + 1) * stride + end_node[0] + 1
+    if start == end:
+        return [start_node], 1
+    if not walkable[end]:
+        return [], 0
+    walkable[start] = 1  # like astar, the start is left even if it's a wall
+
+    parent = array("q", [-1]) * len(walkable)
+    # which side reached a cell first: 1 = from the start, 2 = from the end. No cell is reached by both.
+    side = bytearray(len(walkable))
+    side[start], side[end] = 1, 2
+    frontiers = {1: [start], 2: [end]}
+    offsets = (-stride, 1, stride, -1)
+    expansions = 0
+
+    while frontiers[1] and frontiers[2]:
+        mine = 1 if len(frontiers[1]) <= len(frontiers[2]) else 2
+        level = []
+        for node in frontiers[mine]:
+            expansions += 1
+            for offset in offsets:
+                neighbour = node + offset
+                if not walkable[neighbour]:
+                    continue
+                reached = side[neighbour]
+                if not reached:
+                    side[neighbour] = mine
+                    parent[neighbour] = node
+                    level.append(neighbour)
+                elif reached != mine:
+                    # the first touch is already a shortest path, the other side is never more than a level behind
+                    forward, backward = (node, neighbour) if mine == 1 else (neighbour, node)
+                    path = _backtrace(parent, forward, stride)
+                    path.extend(reversed(_backtrace(parent, backward, stride)))
+                    return path, expansions
+        frontiers[mine] = level
+
+    return [], expansions
+
+
+def jump_point_search(grid: np.ndarray, start_node: Point, end_node: Point) -> Tuple[List[Point], int]:
+    """
+    Jump point search for 4-connected grids where every walkable cell costs 1 (see is_uniform), finds a path with as
+    few steps as astar. Of all the shortest paths, it only follows the ones that don't turn from a horizontal into a
+    vertical move unless the wall behind them forces it, so instead of every cell, only the cells where such a path can
+    branch (jump points) go through the open set: a horizontal scan stops next to a gap in the wall above or below it,
+    a vertical scan stops where a horizontal scan from it would. This pays off in open areas, in narrow winding
+    corridors almost every cell is a jump point.
+
+    Returns the path as a list of x/y tuples (empty if there is none) and the number of expanded jump points.
+    """
+    _check_points(grid, start_node, end_node)
+    walkable, stride = _padded_walkable(grid)
+    start = (start_node[1] + 1) * stride + start_node[0] + 1
+    end = (end_node[1] + 1) * stride + end_node[0] + 1
+    if not walkable[end] and start != end:
+        return [], 0
+    walkable[start] = 1
+
+    size = len(walkable)
+    g = array("q", [size]) * size  # no path is longer than the number of cells
+    parent = array("q", [-1]) * size
+    closed = bytearray(size)
+    end_y, end_x = divmod(end, stride)
+
+    g[start] = 0
+    h = abs(start_node[0] - end_node[0]) + abs(start_node[1] - end_node[1])
+    open_set = [(h, h, start)]
+    expansions = 0
+
+    while open_set:
+        _, _, node = heappop(open_set)
+        if closed[node]:
+            continue
+        closed[node] = 1
+        expansions += 1
+
+        if node == end:
+            return _fill(_backtrace_indices(parent, node), stride), expansions
+
+        came_from = parent[node]
+        if came_from == -1:
+            steps = (-stride, 1, stride, -1)
+        else:
+            step = node - came_from
+            if -stride < step < stride:
+                step = 1 if step > 0 else -1
+                behind = node - step
+                # up and down only where the wall behind this cell forces it
+                steps = [step] + [vertical for vertical in (-stride, stride)
+                                  if walkable[node + vertical] and not walkable[behind + vertical]]
+            else:
+                step = stride if step > 0 else -stride
+                steps = (step, 1, -1)
+
+        node_g = g[node]
+        for step in steps:
+            if -stride < step < stride:
+                point = _jump_horizontal(walkable, node, step, stride, end)
+            else:
+                point = _jump_vertical(walkable, node, step, stride, end)
+            if point == -1 or closed[point]:
+                continue
+            distance = point - node
+            distance = abs(distance) if -stride < distance < stride else abs(distance) // stride
+            point_g = node_g + distance
+            if point_g < g[point]:
+                g[point] = point_g
+                parent[point] = node
+                y, x = divmod(point, stride)
+                h = abs(x - end_x) + abs(y - end_y)
+                heappush(open_set, (point_g + h, h, point))
+
+    return [], expansions
+
+
+def grid_str(grid: np.ndarray, path: Sequence[Point] = (), start: Point = None, end: Point = None) -> str:
+    """
+    Renders the grid in the same ASCII format as pathfinding's Grid.grid_str (border, '#' for walls, 'x' for the path
+    and 's'/'e' for start and end), but vectorized so it stays usable for large mazes.
+    """
+    height, width = grid.shape
+    chars = np.where(grid >= 1, " ", "#")
+    if len(path):
+        xs, ys = np.asarray(path).T
+        chars[ys, xs] = "x"
+    if start is not None:
+        chars[start[1], start[0]] = "s"
+    if end is not None:
+        chars[end[1], end[0]] = "e"
+
+    border = "+" + "-" * width + "+"
+    rows = ["|" + "".join(row) + "|" for row in chars]
+
+    return "\n".join([border, *rows, border])
+
+
+def _backtrace(parent: array, node: int, stride: int) -> List[Point]:
+    path = []
+    while node != -1:
+        y, x = divmod(node, stride)
+        path.append((x - 1, y - 1))
+        node = parent[node]
+    path.reverse()
+
+    return path
+
+
+def _check_points(grid: np.ndarray, *points: Point):
+    height, width = grid.shape
+    for x, y in points:
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"Point {(x, y)} is outside of the {width}x{height} maze.")
+
+
+def _padded_walkable(grid: np.ndarray) -> Tuple[bytearray, int]:
+    # like padded_weights, but one byte per cell: 1 = walkable
+    height, width = grid.shape
+    padded = np.zeros((height + 2, width + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = grid >= 1
+
+    return bytearray(padded.tobytes()), width + 2
+
+
+def _jump_horizontal(walkable: bytearray, node: int, step: int, stride: int, end: int) -> int:
+    while True:
+        node += step
+        if not walkable[node]:
+            return -1
+        if node == end:
+            return node
+        behind = node - step
+        if walkable[node - stride] and not walkable[behind - stride] or \
+                walkable[node + stride] and not walkable[behind + stride]:
+            return node
+
+
+def _jump_vertical(walkable: bytearray, node: int, step: int, stride: int, end: int) -> int:
+    while True:
+        node += step
+        if not walkable[node]:
+            return -1
+        if node == end or _jump_horizontal(walkable, node, 1, stride, end) != -1 or \
+                _jump_horizontal(walkable, node, -1, stride, end) != -1:
+            return node
+
+
+def _backtrace_indices(parent: array, node: int) -> List[int]:
+    nodes = []
+    while node != -1:
+        nodes.append(node)
+        node = parent[node]
+    nodes.reverse()
+
+    return nodes
+
+
+def _fill(jump_points: List[int], stride: int) -> List[Point]:
+    # the cells on the straight lines between consecutive jump points
+    path = []
+    for node, following in zip(jump_points, jump_points[1:]):
+        distance = following - node
+        step = (1 if distance > 0 else -1) if -stride < distance < stride else (stride if distance > 0 else -stride)
+        path.extend(divmod(cell, stride) for cell in range(node, following, step))
+    path.append(divmod(jump_points[-1], stride))
+
+    return [(x - 1, y - 1) for y, x in path]
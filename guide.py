@@ -1,4 +1,6 @@
+import copy
 from abc import ABC, abstractmethod
+from array import array
 
 from direction import Direction
 
@@ -11,3 +13,36 @@ class Guide(ABC):
     def on_detected_crossing(self, options: Direction) -> Direction:
         """Returns the direction the MazeWalker should turn, given a set of possible directions."""
         pass
+
+    def anticipate(self, options: Direction):
+        """
+        Called by the MazeWalker as soon as it sees an intersection coming up, and again whenever it sees more options
+        before reaching it. Does nothing by default, see PredictiveGuide.
+        """
+        pass
+
+    def on_stop(self):
+        """Called by the MazeWalker when it's told to stop, also when it stops before reaching the end."""
+        pass
+
+    def checkpoint(self):
+        """
+        A snapshot of the guide's state that restore() can go back to. Override it for cheaper snapshots (e.g. with
+        copy_containers), a deep copy walks every value of a big map.
+        """
+        return copy.deepcopy(self.__dict__)
+
+    def restore(self, checkpoint):
+        """Resets the guide to a snapshot from checkpoint(). The same snapshot can be restored more than once."""
+        self.__dict__.clear()
+        self.__dict__.update(copy.deepcopy(checkpoint))
+
+
+def copy_containers(state: dict) -> dict:
+    """
+    A copy of state (e.g. a guide's __dict__) with every list, dict, set and array in it copied as a whole, the values
+    in them are shared. Enough for the checkpoint of a guide whose containers only hold immutable values, and a lot
+    cheaper than a deep copy.
+    """
+    return {name: copy.copy(value) if isinstance(value, (list, dict, set, array)) else value
+            for name, value in state.items()}
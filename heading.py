@@ -0,0 +1,44 @@
+from enum import IntEnum
+from typing import Tuple
+
+from direction import Direction
+
+
+class Heading(IntEnum):
+    """
+    Absolute heading in a maze matrix, where x grows to the right and y grows downwards (row index).
+    The values go clockwise, so turning right adds one and turning left subtracts one (modulo 4).
+    """
+    UP = 0
+    RIGHT = 1
+    DOWN = 2
+    LEFT = 3
+
+    @property
+    def offset(self) -> Tuple[int, int]:
+        """The x/y step of one cell in this heading."""
+        return _OFFSETS[self]
+
+    def turn(self, direction: Direction) -> "Heading":
+        """The heading after taking the given turn (STRAIGHT, LEFT, RIGHT or U_TURN)."""
+        return Heading((self + _QUARTER_TURNS[direction]) % 4)
+
+    def turn_to(self, other: "Heading") -> Direction:
+        """The turn that changes this heading into the other one."""
+        return _TURNS[(other - self) % 4]
+
+    @staticmethod
+    def between(a: Tuple[int, int], b: Tuple[int, int]) -> "Heading":
+        """The heading of the step from point a to the adjacent point b."""
+        return _HEADINGS[(b[0] - a[0], b[1] - a[1])]
+
+
+_OFFSETS = {
+    Heading.UP: (0, -1),
+    Heading.RIGHT: (1, 0),
+    Heading.DOWN: (0, 1),
+    Heading.LEFT: (-1, 0),
+}
+_HEADINGS = {offset: heading for heading, offset in _OFFSETS.items()}
+_QUARTER_TURNS = {Direction.STRAIGHT: 0, Direction.RIGHT: 1, Direction.U_TURN: 2, Direction.LEFT: 3}
+_TURNS = {quarters: direction for direction, quarters in _QUARTER_TURNS.items()}
@@ -0,0 +1,122 @@
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+from direction import Direction
+from grid_search import Maze, Point, as_grid, find_junctions
+from maze_solver import get_directions, search_path
+
+
+class InstructionCompiler:
+    """
+    Turns solved paths through one maze into the instructions for an OrderedInstructionsGuide, exactly one per
+    junction (see find_junctions) the walker will stop on after leaving the start: LEFT or RIGHT where the path turns,
+    STRAIGHT where it passes through a crossing or T junction, U_TURN in dead ends it has to come back out of.
+    get_directions on its own only knows the turns, so the guide runs out of sync at the first junction the path
+    passes straight through.
+
+    The walker stops on the end if it's a junction, the guide has no instruction left for it then and stops it. On an
+    end in the middle of a corridor, it would drive on to the next junction.
+    """
+
+    def __init__(self, maze: Maze):
+        self.maze = as_grid(maze)
+        self.junctions = find_junctions(self.maze)
+
+    def compile(self, path: Union[Sequence[Point], np.ndarray]) -> List[Direction]:
+        """
+        The instructions for a path of adjacent cells (e.g. from find_path). Raises a ValueError if the path goes back
+        where the walker can't turn around, in the middle of a corridor.
+        """
+        points = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+        if len(points) > 2:
+            inner = points[1:-1]
+            reverses = np.all(points[2:] == points[:-2], axis=1) & ~self.junctions[inner[:, 1], inner[:, 0]]
+            if reverses.any():
+                x, y = inner[reverses.argmax()]
+                raise ValueError(f"The path turns around at {(int(x), int(y))}, which isn't a junction.")
+
+        return get_directions(points, self.junctions)
+
+    def route(self, start: Point, end: Point) -> Tuple[List[Point], List[Direction]]:
+        """Solves the shortest path from start to end (see search_path) and returns it with its instructions."""
+        path = search_path(self.maze, start, end).path
+        return path, self.compile(path)
+
+
+def test_find_junctions():
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    junctions = {(int(x), int(y)) for y, x in np.argwhere(find_junctions(maze))}
+    # dead ends, corners, T junctions
+    assert junctions == {(7, 0), (1, 6), (1, 1), (5, 1), (1, 3), (3, 3), (5, 3), (3, 5), (7, 5)}
+
+
+def test_compile_instructions():
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    compiler = InstructionCompiler(maze)
+
+    # straight through the T junction at (3, 3)
+    path, instructions = compiler.route((1, 6), (5, 3))
+    assert instructions == [Direction.RIGHT, Direction.STRAIGHT]
+    assert get_directions(path) == [Direction.RIGHT]
+
+    # into the dead end and back out of it
+    path = [(3, 3), (2, 3), (1, 3), (1, 4), (1, 5), (1, 6), (1, 5), (1, 4), (1, 3), (1, 2)]
+    assert compiler.compile(path) == [Direction.LEFT, Direction.U_TURN, Direction.STRAIGHT]
+    try:
+        compiler.compile([(7, 0), (7, 1), (7, 2), (7, 1)])
+        assert False, "the walker can't turn in a corridor"
+    except ValueError:
+        pass
+
+
+def test_simulated_junction_run():
+    from event_log import EventLog, Level
+    from maze_solver import find_directions
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    # the corridor passes a branch at x = 4, the walker stops there and has to be told to go on straight
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 0, 0],
+         [0, 1, 1, 1, 1, 1, 1, 1, 0],
+         [0, 0, 0, 0, 1, 0, 0, 1, 0],
+         [0, 0, 0, 0, 1, 0, 0, 1, 0],
+         [0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 0, 0, 0, 0, 0, 0, 0, 0]]
+    start = (1, 1)
+    compiler = InstructionCompiler(maze)
+
+    def run(instructions: List[Direction]) -> Simulator:
+        simulator = Simulator(maze, start)
+        walker = MazeWalker(OrderedInstructionsGuide(instructions), events=EventLog(Level.OFF), clock=simulator.clock)
+        simulator.run(walker, max_seconds=60)
+        return simulator
+
+    for end in ((7, 4), (4, 3)):
+        simulator = run(compiler.route(start, end)[1])
+        assert simulator.stopped and simulator.cell == end and not simulator.collisions
+    # the turns alone take the branch instead of passing it
+    assert run(find_directions(maze, start, (7, 4))).cell == (4, 3)
+
+
+if __name__ == "__main__":
+    test_find_junctions()
+    test_compile_instructions()
+    test_simulated_junction_run()
@@ -0,0 +1,177 @@
+import os
+import struct
+from typing import List, Optional, Union
+
+import numpy as np
+
+from grid_search import Maze, as_grid
+
+MAGIC = b"MAZE"
+VERSION = 1
+BITS = 0  # one bit per cell, 1 = walkable
+WEIGHTS = 1  # one byte per cell, the weight (0 = wall, up to 255)
+
+# magic, version, encoding, two reserved bytes, width, height. The cells start right after it, 16 bytes in.
+_HEADER = struct.Struct("<4sBBxxII")
+
+PathLike = Union[str, os.PathLike]
+
+
+def save_maze(path: PathLike, maze: Maze, encoding: Optional[int] = None):
+    """
+    Writes a maze (in the matrix format of maze_solver) to a file in the compact maze format: a 16 byte header
+    followed by the cells row by row, either as bits (BITS, for mazes that only have walls and walkable cells, every
+    row padded to whole bytes) or as one byte per cell (WEIGHTS). By default, BITS is used whenever it can hold the
+    maze. Raises a ValueError if a weight doesn't fit into a byte.
+    """
+    grid = as_grid(maze)
+    height, width = grid.shape
+    highest = grid.max() if grid.size else 0
+    if highest > 255:
+        raise ValueError("The maze format only holds weights up to 255.")
+    if encoding is None:
+        encoding = BITS if highest <= 1 else WEIGHTS
+    if encoding == BITS:
+        if highest > 1:
+            raise ValueError("Weights other than 1 can't be stored as bits, use WEIGHTS.")
+        cells = np.packbits(grid > 0, axis=1, bitorder="little")
+    elif encoding == WEIGHTS:
+        cells = np.maximum(grid, 0).astype(np.uint8)
+    else:
+        raise ValueError(f"Unknown encoding {encoding}.")
+
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, encoding, width, height))
+        file.write(np.ascontiguousarray(cells).tobytes())
+
+
+def load_maze(path: PathLike, mmap: bool = True) -> np.ndarray:
+    """
+    Reads a maze written by save_maze as a 2d uint8 NumPy array that find_path and everything else working on mazes
+    takes.
+    WEIGHTS files are memory mapped (read only) unless mmap is False, so nothing is read or copied up front and only
+    the pages a search touches are ever loaded. BITS files are an eighth of the size but have to be unpacked into a
+    new array, which is a single vectorized pass over the file.
+    """
+    with open(path, "rb") as file:
+        header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError(f"{path} is too short to be a maze file.")
+    magic, version, encoding, width, height = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a maze file of version {VERSION}.")
+
+    if encoding == WEIGHTS:
+        if mmap and width and height:
+            return np.memmap(path, dtype=np.uint8, mode="r", offset=_HEADER.size, shape=(height, width))
+        return np.fromfile(path, dtype=np.uint8, count=width * height, offset=_HEADER.size).reshape(height, width)
+    if encoding == BITS:
+        row_bytes = (width + 7) // 8
+        packed = np.fromfile(path, dtype=np.uint8, count=row_bytes * height, offset=_HEADER.size)
+        return np.unpackbits(packed.reshape(height, row_bytes), axis=1, count=width, bitorder="little")
+    raise ValueError(f"{path} has an unknown encoding {encoding}.")
+
+
+def to_lists(maze: Maze) -> List[List[int]]:
+    """The maze as nested lists of ints, like the literals in demo.py."""
+    return as_grid(maze).tolist()
+
+
+def from_text(text: str) -> np.ndarray:
+    """
+    Parses text art of a maze, one row per line: '#' is a wall, a digit is a cell with that weight ('0' is a wall too)
+    and everything else is walkable. The border grid_str draws ('+--+' and '|' around the rows) is skipped, so its
+    output (with the path and start/end marks) can be parsed again. Short lines are padded with walls. Empty lines
+    before and after the maze are skipped, lines of spaces are rows of walkable cells.
+    """
+    lines = text.splitlines()
+    while lines and not lines[-1]:
+        lines.pop()
+    while lines and not lines[0]:
+        lines.pop(0)
+    border = lines[0].strip() if lines else ""
+    if len(border) > 1 and border[0] == border[-1] == "+" and set(border) <= {"+", "-"}:
+        lines = [line.strip()[1:-1] for line in lines[1:-1]]
+    width = max((len(line) for line in lines), default=0)
+    grid = np.zeros((len(lines), width), dtype=np.uint8)
+    for y, line in enumerate(lines):
+        row = np.frombuffer(line.encode("ascii"), dtype=np.uint8)
+        digits = (row >= ord("0")) & (row <= ord("9"))
+        grid[y, :len(row)] = np.where(digits, row - ord("0"), np.where(row == ord("#"), 0, 1))
+
+    return grid
+
+
+def test_maze_file():
+    import tempfile
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "maze")
+
+        save_maze(path, maze)
+        assert os.path.getsize(path) == 16 + 7 * 2  # two bytes per row of nine cells
+        assert to_lists(load_maze(path)) == maze
+
+        weighted = [row[:] for row in maze]
+        weighted[1][1] = 9
+        save_maze(path, weighted)
+        grid = load_maze(path)
+        assert isinstance(grid, np.memmap) and not grid.flags.writeable
+        assert to_lists(grid) == weighted and to_lists(load_maze(path, mmap=False)) == weighted
+        del grid
+
+        try:
+            save_maze(path, weighted, encoding=BITS)
+            assert False, "weights can't be stored as bits"
+        except ValueError:
+            pass
+
+    # text art, also the output of grid_str
+    from grid_search import grid_str
+    assert to_lists(from_text(grid_str(as_grid(maze), path=[(7, 0), (7, 1)], start=(7, 0)))) == maze
+    assert to_lists(from_text("#  #\n#19\n")) == [[0, 1, 1, 0], [0, 1, 9, 0]]
+    # an open row is still a row
+    assert to_lists(from_text("\n###\n   \n###\n\n")) == [[0, 0, 0], [1, 1, 1], [0, 0, 0]]
+    # an open first row isn't a border
+    assert to_lists(from_text("   \n# #\n   ")) == [[1, 1, 1], [0, 1, 0], [1, 1, 1]]
+
+
+def test_find_path_on_file():
+    import tempfile
+    import time
+
+    from maze_solver import find_path
+
+    # a million cells: every other row is a corridor, connected alternately at the left and right end
+    grid = np.zeros((1001, 1000), dtype=np.uint8)
+    grid[::2] = 1
+    grid[1::4, -1] = 1
+    grid[3::4, 0] = 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "maze")
+        for encoding in (BITS, WEIGHTS):
+            save_maze(path, grid, encoding)
+            began = time.perf_counter()
+            loaded = load_maze(path)
+            assert time.perf_counter() - began < 0.1
+            assert np.array_equal(loaded, grid)
+            del loaded
+
+        small = [[1, 1, 1], [0, 0, 1], [1, 1, 1]]
+        save_maze(path, small)
+        assert find_path(path, (0, 0), (0, 2), show_grid=False) == find_path(small, (0, 0), (0, 2), show_grid=False)
+
+
+if __name__ == "__main__":
+    test_maze_file()
+    test_find_path_on_file()
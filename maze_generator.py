@@ -0,0 +1,179 @@
+from typing import Optional
+
+import numpy as np
+
+PERFECT = "perfect"
+LOOPY = "loopy"
+ROOMS = "rooms"
+WEIGHTED = "weighted"
+KINDS = (PERFECT, LOOPY, ROOMS, WEIGHTED)
+
+
+def perfect_maze(width: int, height: int, seed: Optional[int] = 0) -> np.ndarray:
+    """
+    A maze without loops (exactly one route between any two cells) in the matrix format of maze_solver, carved by a
+    randomized depth first search. The rooms are the cells with odd x and y, the walls between them are knocked out,
+    so the corridors are one cell wide and long and winding, the hardest case for a search. With an even width or
+    height, the last column or row stays wall.
+    """
+    if width < 3 or height < 3:
+        raise ValueError("A maze needs to be at least 3x3.")
+    rng = np.random.default_rng(seed)
+    columns, rows = (width - 1) // 2, (height - 1) // 2
+    rooms = columns * rows
+
+    # depth first search on the room grid, room r = row * columns + column
+    visited = bytearray(rooms)
+    # the walls knocked out: 1 = to the right of the room, 2 = below the room
+    opened = bytearray(rooms)
+    # one random permutation of the four neighbours per room, drawn up front, as flat bytes (room r's at 4 * r)
+    orders = rng.permuted(np.tile(np.arange(4, dtype=np.int8), (rooms, 1)), axis=1).tobytes()
+    offsets = (-columns, 1, columns, -1)
+
+    start = int(rng.integers(rooms))
+    visited[start] = 1
+    stack = [start]
+    tried = [0] * rooms  # how many of its neighbours a room on the stack has tried so far
+    while stack:
+        room = stack[-1]
+        while tried[room] < 4:
+            side = orders[4 * room + tried[room]]
+            tried[room] += 1
+            neighbour = room + offsets[side]
+            column = room % columns
+            if neighbour < 0 or neighbour >= rooms or (side == 1 and column == columns - 1) or \
+                    (side == 3 and column == 0) or visited[neighbour]:
+                continue
+            if side == 0:
+                opened[neighbour] |= 2
+            elif side == 1:
+                opened[room] |= 1
+            elif side == 2:
+                opened[room] |= 2
+            else:
+                opened[neighbour] |= 1
+            visited[neighbour] = 1
+            stack.append(neighbour)
+            break
+        else:
+            stack.pop()
+
+    opened = np.frombuffer(bytes(opened), dtype=np.uint8).reshape(rows, columns)
+    maze = np.zeros((height, width), dtype=np.uint8)
+    maze[1:2 * rows:2, 1:2 * columns:2] = 1
+    maze[1:2 * rows:2, 2:2 * columns + 1:2] = opened & 1
+    maze[2:2 * rows + 1:2, 1:2 * columns:2] = opened >> 1
+
+    return maze
+
+
+def loopy_maze(width: int, height: int, seed: Optional[int] = 0, loops: float = 0.1) -> np.ndarray:
+    """A perfect maze with a fraction (loops) of the remaining walls between two rooms knocked out as well."""
+    maze = perfect_maze(width, height, seed)
+    rng = np.random.default_rng(None if seed is None else seed + 1)
+    # walls between two rooms sit on an odd row and even column (horizontal neighbours) or the other way around
+    candidates = np.zeros(maze.shape, dtype=bool)
+    candidates[1:-1:2, 2:-1:2] = True
+    candidates[2:-1:2, 1:-1:2] = True
+    candidates &= maze == 0
+    candidates[:, -1] = candidates[-1, :] = False
+    maze[candidates & (rng.random(maze.shape) < loops)] = 1
+
+    return maze
+
+
+def room_maze(width: int, height: int, seed: Optional[int] = 0, room_size: int = 8,
+              pillars: float = 0.2) -> np.ndarray:
+    """
+    Open rooms of room_size x room_size cells in a grid, every wall between two rooms has one door at a random
+    position. Some of the cells inside the rooms (about pillars of the ones that can be) are single wall cells that
+    break up the straight lines, they are never next to each other or to a wall, so they can't block anything.
+    """
+    if room_size < 2:
+        raise ValueError("Rooms need to be at least 2 cells wide.")
+    rng = np.random.default_rng(seed)
+    period = room_size + 1
+    local_y, local_x = np.ogrid[:height, :width]
+    local_y, local_x = local_y % period, local_x % period
+    possible = (local_x % 2 == 1) & (local_y % 2 == 1) & (local_x > 1) & (local_x < room_size) & \
+        (local_y > 1) & (local_y < room_size)
+    possible[:, -2:] = possible[-2:, :] = False
+    maze = (~(possible & (rng.random((height, width)) < pillars))).astype(np.uint8)
+    maze[:, ::period] = 0
+    maze[::period, :] = 0
+    maze[:, -1] = maze[-1, :] = 0
+
+    for x in range(period, width - 1, period):
+        for top in range(1, height - 1, period):
+            maze[rng.integers(top, min(top + room_size, height - 1)), x] = 1
+    for y in range(period, height - 1, period):
+        for left in range(1, width - 1, period):
+            maze[y, rng.integers(left, min(left + room_size, width - 1))] = 1
+
+    return maze
+
+
+def weighted_maze(width: int, height: int, seed: Optional[int] = 0, max_weight: int = 9,
+                  loops: float = 0.1) -> np.ndarray:
+    """A loopy maze where every walkable cell costs a random weight from 1 to max_weight to enter."""
+    maze = loopy_maze(width, height, seed, loops)
+    rng = np.random.default_rng(None if seed is None else seed + 2)
+    weights = rng.integers(1, max_weight + 1, size=maze.shape, dtype=np.uint8)
+
+    return maze * weights
+
+
+def generate_maze(kind: str, width: int, height: Optional[int] = None, seed: Optional[int] = 0) -> np.ndarray:
+    """
+    A random maze of the given kind (PERFECT, LOOPY, ROOMS or WEIGHTED) as a uint8 matrix in the format of
+    maze_solver. The same seed always gives the same maze, None gives a different one every time.
+    """
+    height = width if height is None else height
+    if kind == PERFECT:
+        return perfect_maze(width, height, seed)
+    if kind == LOOPY:
+        return loopy_maze(width, height, seed)
+    if kind == ROOMS:
+        return room_maze(width, height, seed)
+    if kind == WEIGHTED:
+        return weighted_maze(width, height, seed)
+    raise ValueError(f"Unknown kind of maze {kind}, expected one of {', '.join(KINDS)}.")
+
+
+def corners(maze: np.ndarray):
+    """The walkable cells closest to the top left and the bottom right corner, as x/y points."""
+    cells = np.argwhere(maze > 0)
+    if not len(cells):
+        raise ValueError("The maze has no walkable cells.")
+    distance = cells.sum(axis=1)
+    first, last = cells[distance.argmin()], cells[distance.argmax()]
+
+    return (int(first[1]), int(first[0])), (int(last[1]), int(last[0]))
+
+
+def test_generate_maze():
+    from maze_graph import MazeGraph
+
+    for kind in KINDS:
+        maze = generate_maze(kind, 41, 31, seed=1)
+        assert maze.shape == (31, 41) and maze.dtype == np.uint8
+        assert np.array_equal(maze, generate_maze(kind, 41, 31, seed=1))
+        assert not np.array_equal(maze, generate_maze(kind, 41, 31, seed=2))
+        # the outer wall is closed
+        assert not maze[0].any() and not maze[-1].any() and not maze[:, 0].any() and not maze[:, -1].any()
+        # everything is connected
+        start, end = corners(maze)
+        graph = MazeGraph.compile(maze)
+        tree = graph.search(start)
+        assert all(tree.route_to((int(x), int(y))) is not None for y, x in np.argwhere(maze > 0)[::17])
+
+    # a perfect maze is a tree: one edge less than cells
+    maze = perfect_maze(41, 31)
+    edges = (maze[:, :-1] & maze[:, 1:]).sum() + (maze[:-1] & maze[1:]).sum()
+    assert edges == maze.sum() - 1
+    assert loopy_maze(41, 31).sum() > maze.sum()
+    assert weighted_maze(41, 31).max() > 1
+
+
+if __name__ == "__main__":
+    test_generate_maze()
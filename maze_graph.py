@@ -0,0 +1,441 @@
+from array import array
+from heapq import heappop, heappush
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from direction import Direction
+from grid_search import Maze, Point, as_grid, padded_weights
+from heading import Heading
+
+_INFINITY = float("inf")
+_ROOT = -1  # parent marker of the node the search started on
+_START_LEG = -2  # parent marker of nodes reached directly from a start in the middle of a corridor
+
+
+class Corridor(NamedTuple):
+    """
+    A contracted stretch of the maze between two nodes (junctions or dead ends). All cells in between have exactly two
+    walkable neighbours, so there is nothing to decide on them, but there can be corners.
+    """
+    start: int  # node id
+    end: int  # node id, the same as start for a loop
+    cells: array  # padded cell indices from start to end, both included
+    forward_cost: int  # cost of going from start to end (sum of the entered cells)
+    backward_cost: int  # cost of going from end to start
+    exit_heading: Heading  # heading when leaving the start node
+    entry_heading: Heading  # heading when arriving on the end node
+    turns: Tuple[Tuple[int, Direction], ...]  # (position in cells, turn) of every corner when going from start to end
+
+
+class Leg(NamedTuple):
+    """Part of a route that follows one corridor from one position (index into its cells) to another."""
+    corridor: int
+    source: int
+    target: int
+
+
+class Route(NamedTuple):
+    start: Point
+    legs: Tuple[Leg, ...]
+    cost: float
+
+
+class MazeGraph:
+    """
+    A maze compiled into a graph where the nodes are the junctions and dead ends and the edges are the corridors
+    between them. Corners are kept on the corridors as turn instructions, so a route can be turned into a list of
+    directions without ever walking it cell by cell.
+
+    Compile it once with MazeGraph.compile and then search it as often as needed. Start and end points don't need to
+    be nodes, points in the middle of a corridor are attached to the nodes on both ends of it during the search.
+    """
+
+    def __init__(self, shape: Tuple[int, int], weights: array, stride: int, nodes: array, corridors: List[Corridor],
+                 adjacency: List[List[Tuple[int, bool]]], node_of: array, corridor_of: array, position_of: array):
+        self.shape = shape
+        self.nodes = nodes
+        self.corridors = corridors
+        self._weights = weights
+        self._stride = stride
+        self._adjacency = adjacency
+        self._node_of = node_of
+        self._corridor_of = corridor_of
+        self._position_of = position_of
+        self._headings = {-stride: Heading.UP, 1: Heading.RIGHT, stride: Heading.DOWN, -1: Heading.LEFT}
+
+    @classmethod
+    def compile(cls, maze: Maze) -> "MazeGraph":
+        """
+        Contracts a maze in the matrix format of maze_solver (0 = wall, >= 1 = walkable with that cost) into a graph.
+        """
+        grid = as_grid(maze)
+        weights, stride = padded_weights(grid)
+        size = len(weights)
+        offsets = (-stride, 1, stride, -1)  # indexed by Heading
+
+        walkable = np.frombuffer(weights, dtype=np.int64).reshape(-1, stride) > 0
+        degree = np.zeros(walkable.shape, dtype=np.int8)
+        degree[1:-1, 1:-1] = (walkable[:-2, 1:-1].astype(np.int8) + walkable[2:, 1:-1] + walkable[1:-1, :-2]
+                              + walkable[1:-1, 2:])
+        node_cells = np.flatnonzero(walkable & (degree != 2))
+
+        nodes = array("q", node_cells.tolist())
+        node_of = array("q", [-1]) * size
+        for node, cell in enumerate(nodes):
+            node_of[cell] = node
+
+        corridors = []
+        adjacency = [[] for _ in nodes]
+        corridor_of = array("q", [-1]) * size
+        position_of = array("q", [-1]) * size
+        ports = bytearray(4 * size)  # (cell, heading) pairs which already lead into a traced corridor
+
+        def trace(node: int):
+            cell = nodes[node]
+            for exit_heading in Heading:
+                if ports[4 * cell + exit_heading] or not weights[cell + offsets[exit_heading]]:
+                    continue
+
+                corridor_id = len(corridors)
+                cells = array("q", [cell])
+                turns = []
+                heading = exit_heading
+                current = cell + offsets[heading]
+                forward_cost = 0
+                backward_cost = weights[cell]
+                while True:
+                    cells.append(current)
+                    forward_cost += weights[current]
+                    if node_of[current] != -1:
+                        break
+
+                    corridor_of[current] = corridor_id
+                    position_of[current] = len(cells) - 1
+                    backward_cost += weights[current]
+                    # exactly two walkable neighbours, one of them is where we come from
+                    for next_heading in (heading, Heading((heading + 1) % 4), Heading((heading + 3) % 4)):
+                        if weights[current + offsets[next_heading]]:
+                            break
+                    if next_heading != heading:
+                        turns.append((len(cells) - 1, heading.turn_to(next_heading)))
+                        heading = next_heading
+                    current += offsets[heading]
+
+                end = node_of[current]
+                ports[4 * cell + exit_heading] = 1
+                ports[4 * current + (heading + 2) % 4] = 1
+
+                corridors.append(Corridor(node, end, cells, forward_cost, backward_cost, exit_heading, heading,
+                                          tuple(turns)))
+                adjacency[node].append((corridor_id, True))
+                adjacency[end].append((corridor_id, False))
+
+        for node in range(len(nodes)):
+            trace(node)
+
+        # cycles without a single junction or dead end on them don't have any nodes yet, promote one cell of each
+        while True:
+            uncovered = walkable.ravel() & (np.frombuffer(corridor_of, dtype=np.int64) == -1)
+            uncovered[np.frombuffer(nodes, dtype=np.int64)] = False
+            remaining = np.flatnonzero(uncovered)
+            if not len(remaining):
+                break
+
+            cell = int(remaining[0])
+            node_of[cell] = len(nodes)
+            nodes.append(cell)
+            adjacency.append([])
+            trace(len(nodes) - 1)
+
+        return cls(grid.shape, weights, stride, nodes, corridors, adjacency, node_of, corridor_of, position_of)
+
+    def route(self, start: Point, end: Point) -> Optional[Route]:
+        """Shortest route from start to end or None if the end can't be reached."""
+        return self.search(start, end).route_to(end)
+
+    def directions_between(self, start: Point, end: Point) -> List[Direction]:
+        """
+        Turn instructions for the shortest route from start to end, the same as get_directions would produce for the
+        cell path. Empty if there is no route.
+        """
+        route = self.route(start, end)
+        return self.directions(route) if route else []
+
+    def search(self, start: Point, end: Optional[Point] = None) -> "ShortestPathTree":
+        """
+        Runs Dijkstra from start over the nodes. Without an end, the whole tree is built, so it can answer routes to
+        every reachable point. With an end, the search stops as soon as the end is settled.
+        """
+        start_cell = self._cell(start)
+        distance = array("d", [_INFINITY]) * len(self.nodes)
+        parent = array("q", [_ROOT]) * len(self.nodes)
+        start_legs: Dict[int, Leg] = {}
+        open_set = []
+
+        start_node = self._node_of[start_cell]
+        if start_node != -1:
+            distance[start_node] = 0
+            open_set.append((0, start_node))
+        else:
+            corridor_id = self._corridor_of[start_cell]
+            corridor = self.corridors[corridor_id]
+            position = self._position_of[start_cell]
+            for node, leg in ((corridor.start, Leg(corridor_id, position, 0)),
+                              (corridor.end, Leg(corridor_id, position, len(corridor.cells) - 1))):
+                cost = self._leg_cost(leg)
+                if cost < distance[node]:
+                    distance[node] = cost
+                    parent[node] = _START_LEG
+                    start_legs[node] = leg
+                    heappush(open_set, (cost, node))
+
+        targets = set(self._attachments(end)) if end is not None else set()
+        corridors = self.corridors
+        adjacency = self._adjacency
+        settled = bytearray(len(self.nodes))
+
+        while open_set:
+            node_distance, node = heappop(open_set)
+            if settled[node]:
+                continue
+            settled[node] = 1
+
+            if end is not None:
+                targets.discard(node)
+                if not targets:
+                    break
+
+            for corridor_id, forward in adjacency[node]:
+                corridor = corridors[corridor_id]
+                if forward:
+                    neighbour, cost = corridor.end, corridor.forward_cost
+                else:
+                    neighbour, cost = corridor.start, corridor.backward_cost
+
+                neighbour_distance = node_distance + cost
+                if neighbour_distance < distance[neighbour]:
+                    distance[neighbour] = neighbour_distance
+                    parent[neighbour] = 2 * corridor_id + (0 if forward else 1)
+                    heappush(open_set, (neighbour_distance, neighbour))
+
+        return ShortestPathTree(self, start_cell, distance, parent, start_legs)
+
+    def directions(self, route: Route) -> List[Direction]:
+        """
+        Turn instructions (one per intersection) for following the route, only changes in heading are emitted, just
+        like get_directions.
+        """
+        directions = []
+        heading = None
+        for leg in route.legs:
+            corridor = self.corridors[leg.corridor]
+            if leg.source == leg.target:
+                continue
+
+            if heading is not None:
+                turn = heading.turn_to(self._leg_exit_heading(leg))
+                if turn == Direction.LEFT or turn == Direction.RIGHT:
+                    directions.append(turn)
+
+            if leg.source < leg.target:
+                directions.extend(turn for position, turn in corridor.turns if leg.source < position < leg.target)
+            else:
+                directions.extend(_MIRRORED[turn] for position, turn in reversed(corridor.turns)
+                                  if leg.target < position < leg.source)
+
+            heading = self._leg_entry_heading(leg)
+
+        return directions
+
+    def cells(self, route: Route) -> List[Point]:
+        """The route as a list of x/y points, like find_path returns it."""
+        path = [route.start]
+        for leg in route.legs:
+            cells = self.corridors[leg.corridor].cells
+            step = 1 if leg.target >= leg.source else -1
+            # the first cell is the start or the last one of the previous leg
+            positions = range(leg.source + step, leg.target + step, step)
+            path.extend(self._point(cells[position]) for position in positions)
+
+        return path
+
+    def grid(self) -> np.ndarray:
+        """The maze the graph was compiled from, as a matrix of the cell weights (0 = wall)."""
+        stride = self._stride
+        return np.frombuffer(self._weights, dtype=np.int64).reshape(-1, stride)[1:-1, 1:-1]
+
+    def _attachments(self, point: Point) -> Tuple[int, ...]:
+        """The nodes a route to this point has to go through (unless it starts on the same corridor)."""
+        cell = self._cell(point)
+        if self._node_of[cell] != -1:
+            return self._node_of[cell],
+        corridor = self.corridors[self._corridor_of[cell]]
+        return corridor.start, corridor.end
+
+    def _cell(self, point: Point) -> int:
+        height, width = self.shape
+        x, y = point
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"Point {point} is outside of the {width}x{height} maze.")
+        cell = (y + 1) * self._stride + x + 1
+        if not self._weights[cell]:
+            raise ValueError(f"Point {point} is not walkable.")
+        return cell
+
+    def _point(self, cell: int) -> Point:
+        y, x = divmod(cell, self._stride)
+        return x - 1, y - 1
+
+    def _leg_cost(self, leg: Leg) -> int:
+        cells = self.corridors[leg.corridor].cells
+        if leg.target >= leg.source:
+            return sum(self._weights[cells[position]] for position in range(leg.source + 1, leg.target + 1))
+        return sum(self._weights[cells[position]] for position in range(leg.target, leg.source))
+
+    def _leg_exit_heading(self, leg: Leg) -> Heading:
+        corridor = self.corridors[leg.corridor]
+        if leg.source == 0 and leg.target > 0:
+            return corridor.exit_heading
+        step = 1 if leg.target > leg.source else -1
+        return self._headings[corridor.cells[leg.source + step] - corridor.cells[leg.source]]
+
+    def _leg_entry_heading(self, leg: Leg) -> Heading:
+        corridor = self.corridors[leg.corridor]
+        if leg.target == len(corridor.cells) - 1 and leg.source < leg.target:
+            return corridor.entry_heading
+        step = 1 if leg.target > leg.source else -1
+        return self._headings[corridor.cells[leg.target] - corridor.cells[leg.target - step]]
+
+
+class ShortestPathTree:
+    """
+    Result of MazeGraph.search, shortest distances and parent corridors for every node settled from one start point.
+    Routes to any point that is attached to settled nodes can be read off it in O(route length).
+    """
+
+    def __init__(self, graph: MazeGraph, start_cell: int, distance: array, parent: array, start_legs: Dict[int, Leg]):
+        self.graph = graph
+        self._start_cell = start_cell
+        self._start = graph._point(start_cell)
+        self._distance = distance
+        self._parent = parent
+        self._start_legs = start_legs
+
+    def route_to(self, end: Point) -> Optional[Route]:
+        """Shortest route from the start of the search to end or None if end is not reachable."""
+        graph = self.graph
+        end_cell = graph._cell(end)
+        if end_cell == self._start_cell:
+            return Route(end, (), 0)
+
+        end_node = graph._node_of[end_cell]
+        if end_node != -1:
+            if self._distance[end_node] == _INFINITY:
+                return None
+            return Route(self._start, tuple(self._legs_to(end_node)), self._distance[end_node])
+
+        corridor_id = graph._corridor_of[end_cell]
+        corridor = graph.corridors[corridor_id]
+        position = graph._position_of[end_cell]
+        candidates = []
+        for node, leg in ((corridor.start, Leg(corridor_id, 0, position)),
+                          (corridor.end, Leg(corridor_id, len(corridor.cells) - 1, position))):
+            if self._distance[node] != _INFINITY:
+                candidates.append((self._distance[node] + graph._leg_cost(leg), node, leg))
+
+        if graph._corridor_of[self._start_cell] == corridor_id:
+            direct = Leg(corridor_id, graph._position_of[self._start_cell], position)
+            candidates.append((graph._leg_cost(direct), -1, direct))
+
+        if not candidates:
+            return None
+
+        cost, node, leg = min(candidates, key=lambda candidate: candidate[0])
+        legs = self._legs_to(node) if node != -1 else []
+        legs.append(leg)
+
+        return Route(self._start, tuple(legs), cost)
+
+    def _legs_to(self, node: int) -> List[Leg]:
+        corridors = self.graph.corridors
+        legs = []
+        while True:
+            parent = self._parent[node]
+            if parent == _ROOT:
+                break
+            if parent == _START_LEG:
+                legs.append(self._start_legs[node])
+                break
+
+            corridor_id, backward = divmod(parent, 2)
+            corridor = corridors[corridor_id]
+            last = len(corridor.cells) - 1
+            if backward:
+                legs.append(Leg(corridor_id, last, 0))
+                node = corridor.end
+            else:
+                legs.append(Leg(corridor_id, 0, last))
+                node = corridor.start
+        legs.reverse()
+
+        return legs
+
+
+_MIRRORED = {Direction.LEFT: Direction.RIGHT, Direction.RIGHT: Direction.LEFT}
+
+
+def test_directions_match_get_directions():
+    from maze_solver import find_path, get_directions
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    graph = MazeGraph.compile(maze)
+    # (7, 0) and (1, 6) are dead ends, (1, 3) and (3, 3) are junctions, everything else is on a corridor
+    assert len(graph.nodes) == 4
+
+    walkable = [(x, y) for y, row in enumerate(maze) for x, value in enumerate(row) if value]
+    for start in walkable:
+        for end in walkable:
+            path = find_path(maze, start, end, show_grid=False)
+            route = graph.route(start, end)
+            assert route.cost == len(path) - 1
+            # the ring in the upper left can be driven both ways, so only the cost has to match find_path
+            cells = graph.cells(route)
+            assert len(cells) == len(path) and cells[0] == start and cells[-1] == end
+            assert all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 for a, b in zip(cells, cells[1:]))
+            if len(cells) > 1:
+                assert graph.directions(route) == get_directions(cells)
+
+
+def test_loops_and_weights():
+    maze = \
+        [[1, 1, 1, 1],
+         [1, 0, 0, 1],
+         [1, 1, 9, 1]]
+
+    graph = MazeGraph.compile(maze)
+    assert len(graph.corridors) == 1  # a ring without junctions gets a single node and a loop corridor
+
+    route = graph.route((0, 0), (2, 2))
+    assert route.cost == 1 + 1 + 1 + 9
+    assert graph.cells(route) == [(0, 0), (0, 1), (0, 2), (1, 2), (2, 2)]
+    assert graph.directions(route) == [Direction.LEFT]
+
+    route = graph.route((1, 2), (3, 2))
+    assert graph.cells(route) == [(1, 2), (0, 2), (0, 1), (0, 0), (1, 0), (2, 0), (3, 0), (3, 1), (3, 2)]
+    assert graph.directions(route) == [Direction.RIGHT, Direction.RIGHT, Direction.RIGHT]
+
+    assert MazeGraph.compile([[1, 0, 1]]).route((0, 0), (2, 0)) is None
+
+
+if __name__ == "__main__":
+    test_directions_match_get_directions()
+    test_loops_and_weights()
@@ -1,57 +1,164 @@
-from typing import List, Tuple
+import os
+from enum import Enum
+from itertools import chain
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
-from pathfinding.core.diagonal_movement import DiagonalMovement
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
+import numpy as np
 
 from direction import Direction
+from grid_search import (Maze, as_grid, astar, bidirectional_search, find_junctions, grid_str, is_uniform,
+                         jump_point_search)
+from heading import Heading
+from maze_file import load_maze
+from maze_graph import MazeGraph
 
 
-def get_directions(path: List[Tuple[int, int]]) -> List[Direction]:
+class Engine(Enum):
     """
-    Transforms a list of maze coordinates to a list of turn instructions (one per intersection).
+    Search backends find_path can use. Both find shortest paths with the same cost semantics.
     """
-    last_direction = (path[0][0] - path[1][0], path[0][1] - path[1][1])
-    last_node = path[0]
+    NATIVE = "native"  # A* directly on a NumPy array (grid_search)
+    PATHFINDING = "pathfinding"  # AStarFinder from the pathfinding library, builds one Node object per cell
 
-    directions = []
 
-    for node in path[1:]:
-        x_difference = last_node[0] - node[0]
-        y_difference = last_node[1] - node[1]
+class Search(Enum):
+    """
+    Search algorithms of the native engine. All of them find paths of the same (lowest) cost, but the uniform ones
+    only work on mazes of just walls and 1s (see grid_search.is_uniform).
+    """
+    AUTO = "auto"  # the best one for the maze, see search_path
+    ASTAR = "astar"  # weighted A*, works on every maze
+    BIDIRECTIONAL = "bidirectional"  # uniform, breadth first from both ends, the fastest in corridors
+    JUMP_POINT = "jump_point"  # uniform, only expands the cells where paths branch, the fastest in open areas
 
-        direction = (x_difference, y_difference)
 
-        # Change in Direction, example: last_direction = (0, -1)  direction = (-1, 0)
-        if direction[0] != last_direction[0] and last_direction[0] == 0:
-            if direction[0] == -1 and last_direction[1] == 1 or direction[0] == 1 and last_direction[1] == -1:
-                directions.append(Direction.RIGHT)
-            else:
-                directions.append(Direction.LEFT)
+# the share of walkable cells above which AUTO picks jump point search over the bidirectional one on uniform mazes
+OPEN_MAZE = 0.65
 
-        # Change in Direction, example: last_direction = (-1, 0)  direction = (0, -1)
-        if direction[1] != last_direction[1] and last_direction[1] == 0:
-            if direction[1] == 1 and last_direction[0] == -1 or direction[1] == -1 and last_direction[0] == 1:
-                directions.append(Direction.LEFT)
-            else:
-                directions.append(Direction.RIGHT)
 
-        last_direction = direction
-        last_node = node
+class SearchResult(NamedTuple):
+    path: List[Tuple[int, int]]  # empty if there is no path
+    expansions: int  # how many nodes the search expanded
+    search: Search  # the algorithm that ran, never AUTO
 
-    return directions
 
+class Segment(NamedTuple):
+    """
+    One straight stretch of a route: the turn taken on the crossing it starts on, then length cells straight ahead to
+    the crossing where the next segment starts (or to the end). The first segment of a route has no turn (STRAIGHT).
+    """
+    turn: Direction
+    length: int
+
+
+def get_directions(path: Union[Sequence[Tuple[int, int]], np.ndarray],
+                   junctions: Optional[np.ndarray] = None) -> List[Direction]:
+    """
+    Transforms a list of maze coordinates to a list of turn instructions (one per intersection): LEFT or RIGHT where the
+    heading changes and U_TURN where the path goes back the way it came.
+    With junctions (a boolean matrix of the maze's shape, True for the cells the walker stops at), also STRAIGHT for
+    every junction the path crosses without turning.
 
-def find_path(maze: List[List[int]], start_node: Tuple[int, int], end_node: Tuple[int, int]) -> List[Tuple[int, int]]:
+    Vectorized: the steps are the differences of consecutive points, the sign of the cross product of two steps tells
+    left from right and a negative dot product means the path reverses. The path can also be an (n, 2) array.
     """
-    Finds a path through the maze using A* from start_node to end_node.
+    points = _as_points(path)
+    if len(points) < 3:
+        return []
+    steps = np.diff(points, axis=0)
+    if np.any(np.abs(steps).sum(axis=1) != 1):
+        raise ValueError("Consecutive points of a path have to be adjacent.")
+
+    steps = steps.astype(np.int8)
+    before, after = steps[:-1], steps[1:]
+    cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+    dot = before[:, 0] * after[:, 0] + before[:, 1] * after[:, 1]
+    codes = _TURN_CODES[3 * cross + dot + 4]
+    if junctions is not None:
+        # the cells between two steps
+        xs, ys = points[1:-1, 0], points[1:-1, 1]
+        codes[(codes == _NONE) & np.asarray(junctions, dtype=bool)[ys, xs]] = _STRAIGHT
+
+    return _CODE_DIRECTIONS[codes[codes != _NONE]].tolist()
+
+
+def iter_directions(nodes: Iterable[Tuple[int, int]], junctions: Optional[np.ndarray] = None) -> Iterator[Direction]:
+    """
+    Yields the same instructions as get_directions one by one while consuming the path, so the path never has to be
+    materialized (e.g. it can come straight from a search or a file) and the first turns are known before its end.
+    """
+    nodes = iter(nodes)
+    last = next(nodes, None)
+    step = None
+    for node in nodes:
+        step_x, step_y = node[0] - last[0], node[1] - last[1]
+        if abs(step_x) + abs(step_y) != 1:
+            raise ValueError("Consecutive points of a path have to be adjacent.")
+        if step is not None:
+            cross = step[0] * step_y - step[1] * step_x
+            if cross > 0:
+                yield Direction.RIGHT
+            elif cross < 0:
+                yield Direction.LEFT
+            elif step[0] != step_x or step[1] != step_y:
+                yield Direction.U_TURN
+            elif junctions is not None and junctions[last[1]][last[0]]:
+                yield Direction.STRAIGHT
+        step = step_x, step_y
+        last = node
+
+
+def get_segments(path: List[Tuple[int, int]], junctions: Optional[np.ndarray] = None) -> List[Segment]:
+    """
+    Transforms a list of maze coordinates to the straight segments between the turns, the turns of all but the first
+    segment are the same as get_directions returns.
+    With junctions (like for get_directions), a segment also ends on every junction the path crosses without turning
+    and the next one starts there with STRAIGHT, since the walker stops there as well.
+    """
+    segments = []
+    heading = None
+    for last_node, node in zip(path, path[1:]):
+        step = Heading.between(last_node, node)
+        if step == heading and not (junctions is not None and junctions[last_node[1]][last_node[0]]):
+            segments[-1] = Segment(segments[-1].turn, segments[-1].length + 1)
+        else:
+            segments.append(Segment(Direction.STRAIGHT if heading is None else heading.turn_to(step), 1))
+            heading = step
+
+    return segments
+
+
+# get_directions works on small integer codes for the instructions, _CODE_DIRECTIONS maps them back
+_NONE, _STRAIGHT, _LEFT, _RIGHT, _U_TURN = range(5)
+_CODE_DIRECTIONS = np.array([None, Direction.STRAIGHT, Direction.LEFT, Direction.RIGHT, Direction.U_TURN],
+                            dtype=object)
+# the code for two consecutive steps by 3 * cross product + dot product + 4 (both are -1, 0 or 1 for unit steps)
+_TURN_CODES = np.full(9, _NONE, dtype=np.int8)
+_TURN_CODES[3 * 1 + 0 + 4] = _RIGHT
+_TURN_CODES[3 * -1 + 0 + 4] = _LEFT
+_TURN_CODES[0 - 1 + 4] = _U_TURN
+
+
+def _as_points(path: Union[Sequence[Tuple[int, int]], np.ndarray]) -> np.ndarray:
+    if isinstance(path, np.ndarray):
+        return path.reshape(-1, 2).astype(np.int64, copy=False)
+    # much faster than np.array on a list of tuples
+    return np.fromiter(chain.from_iterable(path), dtype=np.int64, count=2 * len(path)).reshape(-1, 2)
+
+
+def find_path(maze: Union[Maze, str, os.PathLike], start_node: Tuple[int, int], end_node: Tuple[int, int],
+              engine: Union[Engine, str] = Engine.NATIVE, show_grid: bool = True,
+              search: Union[Search, str] = Search.AUTO) -> List[Tuple[int, int]]:
+    """
+    Finds a shortest path through the maze from start_node to end_node.
 
     Parameter
     ----------
     maze:
-    Nested array of 0 and 1, where 1 means walkable and 0 means blocked (wall).
+    Nested array (or 2d NumPy array) of 0 and 1, where 1 means walkable and 0 means blocked (wall).
     You could also provide values higher than 1 which would indicate a weighted walkable tile so it's walkable but
     potentially more expensive than other tiles.
+    Can also be the path of a file in the compact maze format (see maze_file), it's loaded with load_maze.
 
     start_node:
     Point (x/y tuple) indicating the start position in the maze.
@@ -59,22 +166,102 @@ def find_path(maze: List[List[int]], start_node: Tuple[int, int], end_node: Tupl
     end_node:
     Point (x/y tuple) indicating the end position in the maze.
 
+    engine:
+    Which search backend to use, see Engine. The native one is a lot faster, especially on bigger mazes.
+
+    show_grid:
+    Whether to print the maze with the found path. Turn this off for big mazes.
+
+    search:
+    Which algorithm the native engine uses, see Search and search_path. By default, the fastest one for the maze.
+
     Returns
     -------
-    The path as a list of 2d points (x/y tuples) for nodes to stay on.
+    The path as a list of 2d points (x/y tuples) for nodes to stay on. Use search_path to also get how many nodes the
+    search expanded.
+    """
+    if isinstance(maze, (str, os.PathLike)):
+        maze = load_maze(maze)
+    result = search_path(maze, start_node, end_node, engine, search)
+
+    if show_grid:
+        print(grid_str(as_grid(maze), path=result.path, start=start_node, end=end_node))
+
+    return result.path
+
+
+def search_path(maze: Maze, start_node: Tuple[int, int], end_node: Tuple[int, int],
+                engine: Union[Engine, str] = Engine.NATIVE, search: Union[Search, str] = Search.AUTO) -> SearchResult:
+    """
+    The search behind find_path: returns the path together with the number of nodes expanded to find it and the
+    algorithm that ran.
+    AUTO picks A* for weighted mazes. Mazes of just walls and 1s get one of the uniform searches instead, which find
+    paths with as few steps: jump point search if more than OPEN_MAZE of the cells are walkable (rooms, open areas),
+    bidirectional search otherwise (corridors). The pathfinding engine only has A*.
     """
-    grid = Grid(matrix=maze)
+    engine, search = Engine(engine), Search(search)
+
+    if engine == Engine.PATHFINDING:
+        if search not in (Search.AUTO, Search.ASTAR):
+            raise ValueError(f"The pathfinding engine can't run {search.value} search, only A*.")
+        # imported on first use, the native engine doesn't need the library
+        from pathfinding.core.diagonal_movement import DiagonalMovement
+        from pathfinding.core.grid import Grid
+        from pathfinding.finder.a_star import AStarFinder
+
+        grid = Grid(matrix=maze)
+        start = grid.node(start_node[0], start_node[1])
+        end = grid.node(end_node[0], end_node[1])
+        path, runs = AStarFinder(diagonal_movement=DiagonalMovement.never).find_path(start, end, grid)
+        return SearchResult(path, runs, Search.ASTAR)
+
+    grid = as_grid(maze)
+    if search == Search.AUTO:
+        if not is_uniform(grid):
+            search = Search.ASTAR
+        else:
+            search = Search.JUMP_POINT if np.count_nonzero(grid >= 1) > OPEN_MAZE * grid.size else Search.BIDIRECTIONAL
+    elif search != Search.ASTAR and not is_uniform(grid):
+        raise ValueError(f"{search.value} search only works on mazes without weights, use A*.")
+
+    if search == Search.BIDIRECTIONAL:
+        path, expansions = bidirectional_search(grid, start_node, end_node)
+    elif search == Search.JUMP_POINT:
+        path, expansions = jump_point_search(grid, start_node, end_node)
+    else:
+        path, expansions = astar(grid, start_node, end_node)
+
+    return SearchResult(path, expansions, search)
+
+
+def find_directions(maze: Union[Maze, MazeGraph], start_node: Tuple[int, int],
+                    end_node: Tuple[int, int]) -> List[Direction]:
+    """
+    Finds the shortest route from start_node to end_node and returns the turn instructions for it directly, the same
+    as get_directions(find_path(...)) would but without searching or walking the maze cell by cell.
+    The search runs on a MazeGraph where the corridors are contracted, pass an already compiled one to reuse it.
+    Returns an empty list if there is no route.
+    These are only the turns, don't drive a MazeWalker with them: it also stops on the junctions the route passes
+    straight through and would take the next turn there. Use InstructionCompiler for the walker's instructions.
+    """
+    graph = maze if isinstance(maze, MazeGraph) else MazeGraph.compile(maze)
 
-    start = grid.node(start_node[0], start_node[1])
-    end = grid.node(end_node[0], end_node[1])
+    return graph.directions_between(start_node, end_node)
 
-    finder = AStarFinder(diagonal_movement=DiagonalMovement.never)
-    path, runs = finder.find_path(start, end, grid)
 
-    print('operations:', runs, 'path length:', len(path))
-    print(grid.grid_str(path=path, start=start, end=end))
+def find_segments(maze: Union[Maze, MazeGraph], start_node: Tuple[int, int],
+                  end_node: Tuple[int, int]) -> List[Segment]:
+    """
+    Finds the shortest route from start_node to end_node like find_directions, but returns it as segments that also
+    tell how far it is to every crossing the walker stops on: the turns and the junctions it passes straight through
+    (see find_junctions, get_segments and SpeedProfile). Returns an empty list if there is no route.
+    """
+    graph = maze if isinstance(maze, MazeGraph) else MazeGraph.compile(maze)
+    route = graph.route(start_node, end_node)
+    if not route:
+        return []
 
-    return path
+    return get_segments(graph.cells(route), find_junctions(graph.grid()))
 
 
 def test_get_directions():
@@ -88,7 +275,7 @@ def test_get_directions():
         Direction.LEFT
     ]
 
-    assert directions == get_directions(path)
+    assert directions == get_directions(path) == list(iter_directions(path))
 
     path = [
         (7, 0), (7, 1), (7, 2), (7, 3), (7, 4), (7, 5), (6, 5), (5, 5), (4, 5), (3, 5), (3, 4), (3, 3), (2, 3), (1, 3),
@@ -102,7 +289,26 @@ def test_get_directions():
         Direction.LEFT
     ]
 
-    assert directions == get_directions(path)
+    assert directions == get_directions(path) == list(iter_directions(path))
+    assert directions == get_directions(np.array(path)) == list(iter_directions(iter(path)))
+    assert get_segments(path) == [Segment(Direction.STRAIGHT, 5), Segment(Direction.RIGHT, 4),
+                                  Segment(Direction.RIGHT, 2), Segment(Direction.LEFT, 2), Segment(Direction.LEFT, 3)]
+
+    # straight through the junctions, back out of a dead end
+    junctions = np.zeros((7, 9), dtype=bool)
+    junctions[3, 1] = junctions[5, 3] = junctions[3, 5] = True
+    path = [(1, 6), (1, 5), (1, 4), (1, 3), (1, 2), (1, 1), (1, 2), (1, 3), (2, 3), (3, 3), (4, 3), (5, 3), (6, 3)]
+    directions = [Direction.STRAIGHT, Direction.U_TURN, Direction.LEFT, Direction.STRAIGHT]
+    assert get_directions(path, junctions) == list(iter_directions(path, junctions)) == directions
+    assert get_directions(path) == list(iter_directions(path)) == [Direction.U_TURN, Direction.LEFT]
+
+    assert get_directions([(0, 0), (0, 1)]) == get_directions([]) == list(iter_directions([])) == []
+    for directions in (get_directions, lambda nodes: list(iter_directions(nodes))):
+        try:
+            directions([(0, 0), (0, 1), (1, 2)])
+            assert False, "the points aren't adjacent"
+        except ValueError:
+            pass
 
 
 def test_find_path():
@@ -124,8 +330,86 @@ def test_find_path():
     ]
 
     assert path == find_path(maze, start, end)
+    assert path == find_path(maze, start, end, engine=Engine.PATHFINDING)
+    for search in Search:
+        assert path == find_path(maze, start, end, show_grid=False, search=search)
+    assert get_directions(path) == find_directions(maze, start, end)
+    assert get_segments(path) == find_segments(maze, start, end)
+    assert [segment.turn for segment in find_segments(maze, start, end)[1:]] == get_directions(path)
+    # straight through the junction at (1, 3): the segments end there, like the walker's stops
+    path = find_path(maze, end, (1, 1), show_grid=False)
+    assert get_segments(path) == [Segment(Direction.STRAIGHT, 5)]
+    assert find_segments(maze, end, (1, 1)) == [Segment(Direction.STRAIGHT, 3), Segment(Direction.STRAIGHT, 2)]
+
+
+def test_find_path_weighted():
+    maze = \
+        [[1, 1, 1, 1, 1],
+         [1, 0, 9, 0, 1],
+         [1, 1, 1, 1, 1]]
+
+    start = (2, 0)
+    end = (2, 2)
+
+    def cost(path):
+        return sum(maze[y][x] for x, y in path[1:])
+
+    native = find_path(maze, start, end)
+    reference = find_path(maze, start, end, engine=Engine.PATHFINDING)
+
+    assert cost(native) == cost(reference) == 6
+    assert (2, 1) not in native
+
+    maze[1][2] = 1
+    assert find_path(maze, start, end) == [(2, 0), (2, 1), (2, 2)]
+
+    maze[1][2] = 0
+    maze[0][1] = maze[0][3] = 0
+    assert find_path(maze, start, end) == []
+
+
+def test_search_path():
+    from maze_generator import generate_maze, corners
+
+    for kind, chosen in (("perfect", Search.BIDIRECTIONAL), ("rooms", Search.JUMP_POINT), ("weighted", Search.ASTAR)):
+        maze = generate_maze(kind, 61, seed=3)
+        start, end = corners(maze)
+        result = search_path(maze, start, end)
+        assert result.search == chosen
+        reference = search_path(maze, start, end, search=Search.ASTAR)
+        assert result.expansions <= reference.expansions
+
+        def cost(path):
+            return sum(int(maze[y, x]) for x, y in path[1:])
+
+        assert cost(result.path) == cost(reference.path) > 0
+        if chosen == Search.ASTAR:
+            try:
+                search_path(maze, start, end, search=Search.BIDIRECTIONAL)
+                assert False, "the uniform searches don't take weights"
+            except ValueError:
+                pass
+            continue
+        for search in (Search.BIDIRECTIONAL, Search.JUMP_POINT):
+            path = search_path(maze, start, end, search=search).path
+            assert path[0] == start and path[-1] == end and len(path) == len(reference.path)
+            assert all(abs(x - next_x) + abs(y - next_y) == 1 and maze[next_y, next_x]
+                       for (x, y), (next_x, next_y) in zip(path, path[1:]))
+
+    # no way through
+    maze = [[1, 0, 1]]
+    assert all(search_path(maze, (0, 0), (2, 0), search=search).path == [] for search in Search)
+    assert all(search_path(maze, (0, 0), (0, 0), search=search).path == [(0, 0)] for search in Search)
+
+    try:
+        search_path(maze, (0, 0), (2, 0), engine=Engine.PATHFINDING, search=Search.JUMP_POINT)
+        assert False, "pathfinding only has A*"
+    except ValueError:
+        pass
 
 
 if __name__ == "__main__":
     test_get_directions()
     test_find_path()
+    test_find_path_weighted()
+    test_search_path()
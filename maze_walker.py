@@ -1,11 +1,21 @@
-import time
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
+from clock import Clock, MonotonicClock
 from direction import Direction
+from event_log import Event, EventLog, Level
 from guide import Guide
 from thymio_python.thymiodirect import ThymioObserver
 from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK, MOTOR_LEFT, MOTOR_RIGHT
 
+if TYPE_CHECKING:
+    # the add-ons are only passed in, so a plain walker starts without loading them (recorder and sensor_filter
+    # bring NumPy along)
+    from recorder import Recorder
+    from sensor_filter import SensorFilter
+    from speed_profile import SpeedProfile
+    from tick_profiler import TickProfiler
+    from turn_controller import OdometryTurnController
+
 
 class MazeWalker(ThymioObserver):
     """
@@ -22,9 +32,21 @@ class MazeWalker(ThymioObserver):
     time durations to turn -90, 90 or 180 degrees. Once those time durations have elapsed, it sets itself to go straight
     again.
 
-    Important:
-    - Currently it queries the guide on which direction it should take only when it's on the intersection, not as soon
-      as it sees there is one. This shouldn't be an issue generally speaking but something to keep in mind.
+    What it does is recorded in an EventLog instead of being printed on the control thread. By default, every event is
+    printed (decoded) by the log's background thread, pass your own log to e.g. only write INFO events to a file.
+    Pass a TickProfiler to measure how long every tick and its parts take, without one nothing is measured.
+    Pass a Recorder to record every sensor read, motor write and guide decision for replaying the run later.
+    Pass an OdometryTurnController to turn by the measured wheel speeds instead of the timings below, the runner has to
+    read MOTOR_LEFT_SPEED and MOTOR_RIGHT_SPEED then.
+    Pass a SpeedProfile (and a guide for the same planned segments) to speed up on the straights between the crossings
+    and only slow down to base_speed ahead of them, the runner has to read the wheel speeds for that too.
+    Pass a SensorFilter (e.g. a FilterChain of a MovingMedian and a Hysteresis) to decide on filtered proximity values
+    instead of single raw readings, a noisy reading then can't make up or hide an intersection. It's reset on every
+    turn, the readings from before don't tell anything about the new corridor.
+
+    The guide decides on the intersection, but it's told about the intersection (Guide.anticipate) as soon as it's in
+    sight and again whenever new options show up on the way, so a slow guide wrapped in a PredictiveGuide can think
+    while the robot is still driving to the center.
     """
 
     # comes from quite a bit of testing with Thymio 17, can be adjusted slightly depending on the weather
@@ -47,9 +69,19 @@ class MazeWalker(ThymioObserver):
         }
     }
 
-    def __init__(self, guide: Guide):
+    def __init__(self, guide: Guide, profiler: Optional["TickProfiler"] = None, events: Optional[EventLog] = None,
+                 clock: Optional[Clock] = None, recorder: Optional["Recorder"] = None,
+                 turn_controller: Optional["OdometryTurnController"] = None,
+                 speed_profile: Optional["SpeedProfile"] = None, sensor_filter: Optional["SensorFilter"] = None):
         super().__init__()
         self.guide = guide
+        self.clock = clock if clock is not None else MonotonicClock()  # times the turns, e.g. Simulator.clock
+        self.profiler = profiler
+        self.recorder = recorder
+        self.turn_controller = turn_controller
+        self.speed_profile = speed_profile
+        self.sensor_filter = sensor_filter
+        self.events = events if events is not None else EventLog(Level.DEBUG, echo=True)
         self.turn_initiation_time = 0
         self.current_turn = Direction.STRAIGHT
         self.waiting_until_intersection_in_direction: Optional[Direction] = None
@@ -63,12 +95,25 @@ class MazeWalker(ThymioObserver):
         self.front_space_prox_threshold = 2850  # front is more sensitive so if we want to be able to drive closer to the wall we need a higher threshold
 
     def _update(self):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.begin_tick(self)
+        try:
+            if self.profiler is None:
+                self._step()
+            else:
+                self.profiler.profile_tick(self, self._step)
+        finally:
+            if recorder is not None:
+                recorder.end_tick(self)
+
+    def _step(self):
         if self.current_turn == Direction.STOP or self.th[BUTTON_CENTER]:
             self.stop()
             return
 
         if self.current_turn == Direction.LEFT or self.current_turn == Direction.RIGHT or self.current_turn == Direction.U_TURN:
-            print("Doing turn:", self.current_turn)
+            self.events.debug(Event.TURNING, turn=self.current_turn)
             self._do_turn()
             return
 
@@ -76,11 +121,14 @@ class MazeWalker(ThymioObserver):
 
         # prox values = light reflected -> more reflected = higher values = closer
         prox = self.th[PROXIMITY_FRONT_BACK]
+        if self.sensor_filter is not None:
+            prox = self.sensor_filter.update(prox)
         prox_front_left = prox[0]
         prox_front_right = prox[4]
         prox_front_center = prox[2]
 
-        print("Left:", prox_front_left, "|", "Right:", prox_front_right, "|", "Front:", prox_front_center)
+        self.events.debug(Event.PROXIMITY, turn=self.current_turn, waiting=self.waiting_until_intersection_in_direction,
+                          left=prox_front_left, right=prox_front_right, front=prox_front_center)
 
         opening_left = prox_front_left < self.opening_prox_threshold
         opening_right = prox_front_right < self.opening_prox_threshold
@@ -88,12 +136,18 @@ class MazeWalker(ThymioObserver):
 
         diff = prox_front_left - prox_front_right  # positive if left wall is closer -> correction right
 
+        speed = self.base_speed
+        if self.speed_profile is not None:
+            speed = self.speed_profile.speed(self.th, self.clock.time_ns())
+            if self.waiting_until_intersection_in_direction:
+                speed = self.base_speed
+
         # only do correction if in a corridor and not waiting for an intersection or dead end
         if not opening_left and not opening_right and abs(diff) > self.diff_threshold and not self.waiting_until_intersection_in_direction:
             correction = round(diff / 50)
-            self._set_motors(self.base_speed + correction, self.base_speed - correction)
+            self._set_motors(speed + correction, speed - correction)
         else:
-            self._set_motors_straight()
+            self._set_motors(speed, speed)
 
         # get all possible directions we can currently see in -> potential turns
         possible_dirs = _get_directions(opening_left, opening_right, opening_front)
@@ -120,12 +174,18 @@ class MazeWalker(ThymioObserver):
             # because now that direction is not deemed possible anymore because we can see the wall again.
             self.waiting_until_intersection_in_direction = None
             if Direction.STRAIGHT in self.last_possible_directions and not opening_front:
-                print("Didn't see front blockade when spotting the intersection; removing STRAIGHT from possibilities.")
+                self.events.info(Event.FRONT_BLOCKADE_MISSED, directions=self.last_possible_directions)
                 self.last_possible_directions &= ~Direction.STRAIGHT
             self.current_turn = self.guide.on_detected_crossing(self.last_possible_directions)
-            self.turn_initiation_time = time.time_ns()
-            print("On intersection; ready to take a turn.")
-            print(f"Chose {self.current_turn} from {{{self.last_possible_directions}}}")
+            self.turn_initiation_time = self.clock.time_ns()
+            if self.turn_controller is not None and self.current_turn in self.turn_timings:
+                self.turn_controller.begin(self.current_turn, self.turn_initiation_time)
+            if self.speed_profile is not None:
+                self.speed_profile.next_segment()
+            if self.sensor_filter is not None and self.current_turn in self.turn_timings:
+                self.sensor_filter.reset()
+            self.events.info(Event.TURN_CHOSEN, turn=self.current_turn, directions=self.last_possible_directions,
+                             left=prox_front_left, right=prox_front_right, front=prox_front_center)
         # awaiting a dead end may be overridden if we encounter an actual intersection -> also updates the possible directions to take
         elif not self.waiting_until_intersection_in_direction or self.waiting_until_intersection_in_direction == Direction.STRAIGHT:
             # we are not waiting until we are on an intersection, check if we should be
@@ -136,24 +196,36 @@ class MazeWalker(ThymioObserver):
             elif Direction.STRAIGHT not in possible_dirs:  # handle dead ends the same way as intersections
                 self.waiting_until_intersection_in_direction = Direction.STRAIGHT
 
-            # store options the thymio has for taking a turn once it's on the intersection.
-            # we could also query the guide here just so you know.
+            # store options the thymio has for taking a turn once it's on the intersection and let the guide know.
             if self.waiting_until_intersection_in_direction:
-                print(f"Intersection in sight: {self.waiting_until_intersection_in_direction}")
-                print(f"Possible directions as of now: {possible_dirs}")
+                self.events.info(Event.INTERSECTION_IN_SIGHT, waiting=self.waiting_until_intersection_in_direction,
+                                 directions=possible_dirs,
+                                 left=prox_front_left, right=prox_front_right, front=prox_front_center)
                 self.last_possible_directions = possible_dirs
+                self.guide.anticipate(possible_dirs)
         else:
             # we are still waiting to get to the middle of the intersection but not there yet, so just keep on moving.
-            print(f"Moving to the center of the intersection: {self.waiting_until_intersection_in_direction}")
+            self.events.debug(Event.MOVING_TO_CENTER, waiting=self.waiting_until_intersection_in_direction)
             updated_dir = self.last_possible_directions | possible_dirs
             if updated_dir != self.last_possible_directions:
-                print(f"Found new direction(s): {{{possible_dirs & ~self.last_possible_directions}}} -> "
-                      f"Possibilities now: {{{updated_dir}}}")
+                self.events.info(Event.NEW_DIRECTIONS, waiting=self.waiting_until_intersection_in_direction,
+                                 directions=possible_dirs & ~self.last_possible_directions, extra=updated_dir,
+                                 left=prox_front_left, right=prox_front_right, front=prox_front_center)
                 self.last_possible_directions = updated_dir
+                self.guide.anticipate(updated_dir)
 
     def _do_turn(self):
+        if self.turn_controller is not None:
+            motors = self.turn_controller.step(self.th, self.clock.time_ns())
+            if motors is None:
+                self.current_turn = Direction.STRAIGHT
+                self._set_motors_straight()
+            else:
+                self._set_motors(*motors)
+            return
+
         left, right, duration = self._get_timings(self.current_turn)
-        if time.time_ns() - self.turn_initiation_time >= duration:
+        if self.clock.time_ns() - self.turn_initiation_time >= duration:
             self.current_turn = Direction.STRAIGHT
             # just to be a bit faster / more reactive, it would be set next iteration anyway
             self._set_motors_straight()
@@ -170,6 +242,12 @@ class MazeWalker(ThymioObserver):
     def stop(self):
         self._set_motors(0, 0)
         super().stop()
+        self.guide.on_stop()
+        self.events.close()
+        if self.profiler is not None:
+            self.profiler.on_stop()
+        if self.recorder is not None and self.recorder.path:
+            self.recorder.save()
 
     def _set_motors(self, left: int, right: int):
         self.th[MOTOR_LEFT] = left
@@ -0,0 +1,216 @@
+import time
+
+# taken before anything else is imported, the startup time reported includes all the imports below
+LAUNCHED_NS = time.perf_counter_ns()
+
+import argparse
+import json
+import os
+import sys
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from direction import Direction
+from event_log import EventLog
+from maze_walker import MazeWalker
+from ordered_instructions_guide import OrderedInstructionsGuide
+
+Point = Tuple[int, int]  # (x, y) like grid_search.Point, which would load the solver
+
+
+class Route(NamedTuple):
+    """A pre-solved mission: the instructions (see InstructionCompiler) to get from start to end in the maze file."""
+    maze: str
+    start: Point
+    end: Point
+    instructions: List[Direction]
+
+
+def save_route(path: str, route: Route):
+    """Writes the route to path, with the maze relative to it, so they can be moved together."""
+    maze = os.path.relpath(os.path.abspath(route.maze), os.path.dirname(os.path.abspath(path)))
+    with open(path, "w") as file:
+        json.dump({"maze": maze, "start": list(route.start), "end": list(route.end),
+                   "instructions": [direction.name for direction in route.instructions]}, file, indent=2)
+
+
+def load_route(path: str) -> Route:
+    """Reads a route from save_route, its maze resolved relative to the route file."""
+    with open(path) as file:
+        data = json.load(file)
+    maze = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)), data["maze"]))
+    return Route(maze, tuple(data["start"]), tuple(data["end"]),
+                 [Direction[name] for name in data["instructions"]])
+
+
+def solve_route(maze_path: str, start: Point, end: Point, show_grid: bool = False) -> Route:
+    """
+    Solves a route with an InstructionCompiler. The solver is only imported in here (and read_maze), so running a
+    pre-solved route never loads it. The grid with the path is only rendered and printed if show_grid is set.
+    """
+    from grid_search import grid_str
+    from instruction_compiler import InstructionCompiler
+
+    compiler = InstructionCompiler(read_maze(maze_path))
+    path, instructions = compiler.route(start, end)
+    if show_grid:
+        print(grid_str(compiler.maze, path=path, start=start, end=end))
+    return Route(maze_path, start, end, instructions)
+
+
+def read_maze(path: str):
+    """A maze file (see maze_file.save_maze) or text art of a maze (see maze_file.from_text)."""
+    from maze_file import from_text, load_maze
+
+    try:
+        return load_maze(path)
+    except ValueError:
+        with open(path) as file:
+            return from_text(file.read())
+
+
+class StartupTimer:
+    """
+    Measures the time from launched_ns (perf_counter_ns) to the walker's first motor command by wrapping its
+    _set_motors until then. The interpreter's own startup before mission.py runs isn't included.
+    """
+
+    def __init__(self, walker: MazeWalker, launched_ns: int = LAUNCHED_NS, report: bool = True):
+        self.launched_ns = launched_ns
+        self.report = report
+        self.elapsed_ns: Optional[int] = None
+        set_motors = walker._set_motors
+
+        def first_command(left: int, right: int):
+            set_motors(left, right)
+            self.elapsed_ns = time.perf_counter_ns() - self.launched_ns
+            del walker._set_motors
+            if self.report:
+                print(f"First motor command {self.elapsed_ns / 1e6:.1f} ms after launch.", file=sys.stderr)
+
+        walker._set_motors = first_command
+
+
+def run_route(route: Route, simulator=None, period: float = 0.08, events: Optional[EventLog] = None,
+              launched_ns: int = LAUNCHED_NS, report: bool = True) -> Optional[int]:
+    """
+    Drives the route with a MazeWalker, on the first Thymio found (SingleSerialThymioRunner) or on a Simulator if
+    one is passed. Returns the nanoseconds from launched_ns to the first motor command (None if there was none).
+    """
+    walker = MazeWalker(OrderedInstructionsGuide(route.instructions), events=events,
+                        clock=None if simulator is None else simulator.clock)
+    timer = StartupTimer(walker, launched_ns, report)
+    if simulator is not None:
+        simulator.run(walker, period)
+    else:
+        from thymio_python.thymiodirect import SingleSerialThymioRunner
+        from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK
+
+        SingleSerialThymioRunner({BUTTON_CENTER, PROXIMITY_FRONT_BACK}, walker, period).run()
+    return timer.elapsed_ns
+
+
+def test_mission():
+    import subprocess
+    import tempfile
+
+    from event_log import Level
+    from instruction_compiler import InstructionCompiler
+    from maze_file import save_maze
+    from simulator import Simulator
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    start, end = (7, 0), (1, 6)
+
+    with tempfile.TemporaryDirectory() as directory:
+        maze_path = os.path.join(directory, "demo.maze")
+        route_path = os.path.join(directory, "demo.route.json")
+        save_maze(maze_path, maze)
+        assert main(["compile", maze_path, "--start", "7", "0", "--end", "1", "6", "--output", route_path]) == 0
+
+        route = load_route(route_path)
+        assert route == Route(maze_path, start, end, InstructionCompiler(maze).route(start, end)[1])
+        # text art of the maze works as well
+        text_path = os.path.join(directory, "demo.txt")
+        with open(text_path, "w") as file:
+            file.write("\n".join("".join(" " if cell else "#" for cell in row) for row in maze))
+        assert solve_route(text_path, start, end).instructions == route.instructions
+
+        # the maze is found from anywhere, not just the directory compile ran in
+        with open(route_path) as file:
+            assert json.load(file)["maze"] == "demo.maze"
+        os.makedirs(os.path.join(directory, "elsewhere"))
+        moved_path = os.path.join(directory, "elsewhere", "demo.route.json")
+        save_route(moved_path, route)
+        assert load_route(moved_path) == route
+
+        # running a pre-solved route loads neither the solver nor NumPy, up to the walker's first motor command
+        script = "import sys, mission; route = mission.load_route(sys.argv[1]); walker = mission.MazeWalker(" \
+                 "mission.OrderedInstructionsGuide(route.instructions)); walker.th = {}; walker._set_motors(0, 0); " \
+                 "print(sorted({'maze_solver', 'pathfinding', 'grid_search', 'instruction_compiler', 'numpy'} & " \
+                 "set(sys.modules)))"
+        loaded = subprocess.run([sys.executable, "-c", script, route_path], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        assert loaded.strip() == "[]"
+
+        simulator = Simulator(maze, start)
+        launched_ns = time.perf_counter_ns()
+        elapsed_ns = run_route(route, simulator, events=EventLog(Level.OFF), launched_ns=launched_ns, report=False)
+        assert simulator.stopped and simulator.cell == end and not simulator.collisions
+        assert 0 < elapsed_ns < time.perf_counter_ns() - launched_ns
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Solves a maze once and drives the solved route with a Thymio.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="solve a maze into a route file to run later")
+    compile_parser.add_argument("maze", help="maze file (see maze_file) or text art of a maze")
+    compile_parser.add_argument("--output", "-o", help="route file to write, next to the maze by default")
+
+    run_parser = commands.add_parser("run", help="drive a route file, or solve the maze first if --maze is given")
+    run_parser.add_argument("route", nargs="?", help="route file written by compile")
+    run_parser.add_argument("--maze", help="solve this maze now instead of loading a route file")
+    run_parser.add_argument("--simulate", action="store_true", help="drive in the simulator instead of on a Thymio")
+    run_parser.add_argument("--period", type=float, default=0.08, help="seconds between the walker's ticks")
+
+    for command in (compile_parser, run_parser):
+        command.add_argument("--start", type=int, nargs=2, metavar=("X", "Y"))
+        command.add_argument("--end", type=int, nargs=2, metavar=("X", "Y"))
+        command.add_argument("--show-grid", action="store_true", help="print the maze with the solved path")
+    options = parser.parse_args(arguments)
+
+    solves = options.command == "compile" or options.maze is not None
+    if solves and (options.start is None or options.end is None):
+        parser.error("solving a maze needs --start and --end")
+    if options.command == "run" and (options.route is None) == (options.maze is None):
+        parser.error("run needs either a route file or --maze")
+
+    if options.command == "compile":
+        route = solve_route(options.maze, tuple(options.start), tuple(options.end), options.show_grid)
+        output = options.output or os.path.splitext(options.maze)[0] + ".route.json"
+        save_route(output, route)
+        print(f"{len(route.instructions)} instructions written to {output}.")
+        return 0
+
+    if options.maze is not None:
+        route = solve_route(options.maze, tuple(options.start), tuple(options.end), options.show_grid)
+    else:
+        route = load_route(options.route)
+    simulator = None
+    if options.simulate:
+        from simulator import Simulator
+
+        simulator = Simulator(read_maze(route.maze), route.start)
+    run_route(route, simulator, options.period)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
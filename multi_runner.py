@@ -0,0 +1,350 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional
+
+from clock import Clock, MonotonicClock
+from simulator import SimulatedNode, Simulator
+from tick_profiler import Histogram
+
+
+class Link(ABC):
+    """
+    The connection to one robot as the MultiThymioRunner uses it. The observer reads its sensors from node and writes
+    its motor targets to it, refresh and flush move them over the link before and after every tick.
+    """
+    node = None
+    clock: Clock = MonotonicClock()  # the time the robot's observer should use, e.g. for MazeWalker's clock
+    data_ns: Optional[int] = None  # time.monotonic_ns() when the robot last sent new values, if the link can tell
+
+    async def connect(self):
+        pass
+
+    @abstractmethod
+    async def refresh(self, variables: Iterable[str]):
+        """Makes the current values of the given variables readable on node."""
+        pass
+
+    async def wait_for_data(self, timeout: float) -> bool:
+        """
+        Waits until the robot sent new values (True, data_ns tells when) or timeout seconds have passed (False).
+        Links that aren't told when new values arrive just wait out the timeout.
+        """
+        await asyncio.sleep(timeout)
+        return False
+
+    async def flush(self):
+        """Sends what the observer wrote to node during the tick."""
+        pass
+
+    def close(self):
+        pass
+
+
+class SerialLink(Link):
+    """
+    A Thymio on a serial port (the first one found if port is None), through thymiodirect. The library polls the
+    variables and sends the writes on its own thread, so refresh and flush have nothing left to wait for.
+    """
+
+    def __init__(self, port: Optional[str] = None, refreshing_rate: float = 0.05):
+        self.port = port
+        self.refreshing_rate = refreshing_rate
+        self._thymio = None
+        self._data: Optional[asyncio.Event] = None
+
+    async def connect(self):
+        from thymio_python.thymiodirect import Connection, Thymio
+
+        port = self.port or Connection.serial_default_port()
+        self._thymio = Thymio(serial_port=port, refreshing_rate=self.refreshing_rate)
+        await asyncio.to_thread(self._thymio.connect)
+        node_id = self._thymio.first_node()
+        self.node = self._thymio[node_id]
+
+        # thymiodirect calls the variable observer on its own thread whenever polled values change
+        loop = asyncio.get_running_loop()
+        self._data = asyncio.Event()
+        self._thymio.set_variable_observer(node_id, lambda _: loop.call_soon_threadsafe(self._on_data))
+
+    async def refresh(self, variables: Iterable[str]):
+        pass
+
+    async def wait_for_data(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._data.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._data.clear()
+        return True
+
+    def _on_data(self):
+        self.data_ns = time.monotonic_ns()
+        self._data.set()
+
+    def close(self):
+        if self._thymio is not None:
+            self._thymio.disconnect()
+
+
+class SimulatedLink(Link):
+    """
+    Local stand-in for a robot on a link: a Simulator that is only seen through snapshots, like over a real link.
+    refresh copies the polled variables and flush applies the motor targets, each after latency seconds, reading a
+    variable that isn't polled raises a KeyError.
+    The simulation follows the wall clock, unless step is set: then every refresh advances it by step seconds, so how
+    it goes doesn't depend on how busy the host is (and it can run faster than real time).
+    With sample_period, the robot sends new values every sample_period seconds of wall time, which wait_for_data
+    waits for.
+    """
+
+    def __init__(self, simulator: Simulator, latency: float = 0.0, step: Optional[float] = None,
+                 sample_period: Optional[float] = None):
+        self.simulator = simulator
+        self.latency = latency
+        self.step = step
+        self.sample_period_ns = None if sample_period is None else round(sample_period * 1e9)
+        self.node = _SnapshotNode()
+        self.clock = simulator.clock
+        self._source = SimulatedNode(simulator)
+        self._last_ns: Optional[int] = None
+        self._next_sample_ns: Optional[int] = None
+
+    async def refresh(self, variables: Iterable[str]):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.monotonic_ns()
+        if self._last_ns is not None:
+            self.simulator.advance(self.step if self.step is not None else (now - self._last_ns) / 1e9)
+        self._last_ns = now
+        self.node.values = {variable: self._source[variable] for variable in variables}
+
+    async def wait_for_data(self, timeout: float) -> bool:
+        if self.sample_period_ns is None:
+            return await super().wait_for_data(timeout)
+        now = time.monotonic_ns()
+        if self._next_sample_ns is None:
+            self._next_sample_ns = now
+        wait = (self._next_sample_ns - now) / 1e9
+        if wait > timeout:
+            await asyncio.sleep(timeout)
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        # samples that arrived while nobody was waiting are replaced by the latest one
+        missed = max(time.monotonic_ns() - self._next_sample_ns, 0) // self.sample_period_ns
+        self.data_ns = self._next_sample_ns + missed * self.sample_period_ns
+        self._next_sample_ns = self.data_ns + self.sample_period_ns
+        return True
+
+    async def flush(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writes, self.node.writes = self.node.writes, {}
+        for variable, value in writes.items():
+            self._source[variable] = value
+
+
+class _SnapshotNode:
+    def __init__(self):
+        self.values = {}
+        self.writes = {}
+
+    def __getitem__(self, variable):
+        if variable in self.writes:
+            return self.writes[variable]
+        try:
+            return self.values[variable]
+        except KeyError:
+            raise KeyError(f"{variable} is not polled.") from None
+
+    def __setitem__(self, variable, value):
+        self.writes[variable] = value
+
+
+class RobotStats:
+    """
+    How one robot was served: a tick overruns if it ends (link included) after the start of the next period, the ticks
+    it pushed out are skipped. lateness is how long after its scheduled start every tick actually started.
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.tick = Histogram()  # the observer's _update alone
+        self.lateness = Histogram()
+
+    def as_dict(self) -> dict:
+        return {"ticks": self.ticks, "overruns": self.overruns, "skipped": self.skipped,
+                "tick": self.tick.as_dict(), "lateness": self.lateness.as_dict()}
+
+
+class Robot:
+    def __init__(self, name: str, observer, link: Link, variables: Iterable[str], period: float):
+        self.name = name
+        self.observer = observer
+        self.link = link
+        self.variables = tuple(variables)
+        self.period_ns = round(period * 1e9)
+        self.stats = RobotStats()
+        self.stopped = False
+        self.error: Optional[BaseException] = None  # what the observer raised, it was stopped then
+
+
+class MultiThymioRunner:
+    """
+    Drives several ThymioObservers (e.g. MazeWalkers, each with its own guide) on their own links from one process,
+    where SingleSerialThymioRunner only drives one and blocks.
+
+    Every robot runs as a task on one asyncio event loop: refresh its variables over the link, call the observer's
+    _update, flush the motor targets, sleep until its next period starts. Waiting on the links doesn't hold up the other
+    robots, but the ticks themselves run one at a time on the loop thread, so the observers don't need to be thread
+    safe. Robots are woken in the order their periods start (earliest deadline first), so a robot with a short period
+    doesn't starve the others. A tick that overruns its period doesn't make the robot catch up with a burst of ticks,
+    the missed periods are skipped and counted in its stats.
+
+    A robot is done when its observer calls stop() (or raises, which is kept as the robot's error), run() returns once
+    all of them are done or max_seconds have passed. Observers still running then are stopped.
+    """
+
+    def __init__(self):
+        self.robots: Dict[str, Robot] = {}
+
+    def add(self, name: str, observer, link: Link, variables: Iterable[str], period: float) -> Robot:
+        if name in self.robots:
+            raise ValueError(f"There is already a robot called {name}.")
+        robot = Robot(name, observer, link, variables, period)
+        self.robots[name] = robot
+        return robot
+
+    def run(self, max_seconds: Optional[float] = None) -> List[Robot]:
+        return asyncio.run(self.run_async(max_seconds))
+
+    async def run_async(self, max_seconds: Optional[float] = None) -> List[Robot]:
+        deadline = None if max_seconds is None else time.monotonic_ns() + round(max_seconds * 1e9)
+        robots = list(self.robots.values())
+        await asyncio.gather(*(self._drive(robot, deadline) for robot in robots))
+        return robots
+
+    async def _drive(self, robot: Robot, deadline: Optional[int]):
+        observer, link, stats = robot.observer, robot.link, robot.stats
+
+        def stop():
+            robot.stopped = True
+            original_stop()
+
+        await link.connect()
+        observer.th = link.node
+        original_stop = observer.stop
+        observer.stop = stop
+        try:
+            scheduled = time.monotonic_ns()
+            while not robot.stopped:
+                started = time.monotonic_ns()
+                if deadline is not None and started >= deadline:
+                    observer.stop()
+                    await link.flush()
+                    break
+                stats.lateness.record(max(started - scheduled, 0))
+
+                await link.refresh(robot.variables)
+                began = time.perf_counter_ns()
+                try:
+                    observer._update()
+                except Exception as error:
+                    robot.error = error
+                    if not robot.stopped:
+                        observer.stop()
+                finally:
+                    stats.tick.record(time.perf_counter_ns() - began)
+                    stats.ticks += 1
+                await link.flush()
+
+                scheduled += robot.period_ns
+                now = time.monotonic_ns()
+                if now > scheduled:
+                    stats.overruns += 1
+                    missed = -(-(now - scheduled) // robot.period_ns)
+                    stats.skipped += missed
+                    scheduled += missed * robot.period_ns
+                await asyncio.sleep((scheduled - now) / 1e9)
+        finally:
+            del observer.stop
+            link.close()
+
+
+def test_multi_runner():
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    missions = {"a": ((7, 0), (3, 3)), "b": ((1, 6), (1, 1)), "c": ((7, 0), (1, 6))}
+
+    compiler = InstructionCompiler(maze)
+    runner = MultiThymioRunner()
+    simulators = {}
+    for name, (start, end) in missions.items():
+        # every robot has its own copy of the maze, they don't see each other
+        simulator = Simulator(maze, start)
+        simulators[name] = simulator
+        link = SimulatedLink(simulator, latency=0.0005, step=0.08)
+        # b passes straight through the junction at (1, 3)
+        walker = MazeWalker(OrderedInstructionsGuide(compiler.route(start, end)[1]), events=EventLog(Level.OFF),
+                            clock=link.clock)
+        runner.add(name, walker, link, {BUTTON_CENTER, PROXIMITY_FRONT_BACK}, 0.002)
+
+    # a robot whose observer fails is stopped without taking the others down
+    class Failing:
+        th = None
+
+        def _update(self):
+            raise RuntimeError("broken")
+
+        def stop(self):
+            pass
+
+    runner.add("broken", Failing(), SimulatedLink(Simulator(maze, (7, 0))), (), 0.002)
+
+    robots = {robot.name: robot for robot in runner.run(max_seconds=30)}
+
+    for name, (start, end) in missions.items():
+        robot, simulator = robots[name], simulators[name]
+        assert robot.stopped and robot.error is None
+        assert simulator.cell == end and not simulator.collisions
+        assert robot.stats.ticks == robot.stats.tick.count == robot.stats.lateness.count > 0
+    assert isinstance(robots["broken"].error, RuntimeError) and robots["broken"].stats.ticks == 1
+
+
+def test_snapshot_link():
+    from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, MOTOR_LEFT, PROXIMITY_FRONT_BACK
+
+    simulator = Simulator([[1, 1, 1]], (0, 0))
+    link = SimulatedLink(simulator)
+    asyncio.run(link.refresh([PROXIMITY_FRONT_BACK]))
+    assert len(link.node[PROXIMITY_FRONT_BACK]) == 7
+    try:
+        link.node[BUTTON_CENTER]
+        assert False, "the button isn't polled"
+    except KeyError:
+        pass
+
+    link.node[MOTOR_LEFT] = 100
+    assert simulator.motor_left == 0 and link.node[MOTOR_LEFT] == 100
+    asyncio.run(link.flush())
+    assert simulator.motor_left == 100
+
+
+if __name__ == "__main__":
+    test_multi_runner()
+    test_snapshot_link()
@@ -27,3 +27,9 @@ class OrderedInstructionsGuide(Guide):
         self._instruction_index += 1
 
         return dir
+
+    def checkpoint(self):
+        return self._instruction_index
+
+    def restore(self, checkpoint):
+        self._instruction_index = checkpoint
@@ -0,0 +1,137 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from direction import Direction
+from guide import Guide
+
+
+class _Query(NamedTuple):
+    options: Direction
+    future: Future
+    first: bool  # the first query of this intersection, it takes the checkpoint instead of restoring it
+
+
+class PredictiveGuide(Guide):
+    """
+    Wraps a (slow) guide so the MazeWalker doesn't wait for it on the tick it has to start turning.
+
+    The walker calls anticipate() as soon as it sees an intersection coming up. That submits the query to a worker
+    thread right away, so it runs while the robot is still driving to the center. If the walker sees more options on
+    the way, the query is repeated with them: the guide is reset to a checkpoint taken before its first query (see
+    Guide.checkpoint), so stateful guides like OrderedInstructionsGuide still consume exactly one decision per
+    intersection.
+    When the walker arrives, on_detected_crossing returns the answer right away if it's ready and was asked with the
+    same options (a hit). Otherwise (a miss: nothing anticipated, the options changed at the last moment or the guide
+    is still thinking) it falls back to querying the guide like before and waits for the answer.
+
+    All calls to the wrapped guide happen on the single worker thread, one after the other.
+    """
+
+    def __init__(self, guide: Guide):
+        self.guide = guide
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="guide")
+        self.closed = False
+        self._pending: Optional[_Query] = None
+        self._checkpoint = None  # only used on the worker thread
+
+    def anticipate(self, options: Direction):
+        pending = self._pending
+        if pending is not None and pending.options == options:
+            return
+        self._pending = self._submit(options, pending)
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        pending, self._pending = self._pending, None
+        if pending is not None and pending.options == options and pending.future.done():
+            self.hits += 1
+            return pending.future.result()
+
+        self.misses += 1
+        if pending is not None and pending.options == options:
+            return pending.future.result()
+        return self._submit(options, pending).future.result()
+
+    def on_stop(self):
+        """Passes the stop on to the guide (on the worker thread, like every call) and closes."""
+        if self.closed:
+            self.guide.on_stop()
+            return
+        stopped = self._executor.submit(self.guide.on_stop)
+        self.close()
+        stopped.result()
+
+    def close(self):
+        """Stops the worker thread once it's done with the pending query. The walker does it when it stops."""
+        self.closed = True
+        self._executor.shutdown()
+
+    def _submit(self, options: Direction, pending: Optional[_Query]) -> _Query:
+        # a cancelled query never ran, so if it was the first one nothing has changed the guide yet
+        first = pending is None or (pending.future.cancel() and pending.first)
+        return _Query(options, self._executor.submit(self._query, options, first), first)
+
+    def _query(self, options: Direction, first: bool) -> Direction:
+        if first:
+            self._checkpoint = self.guide.checkpoint()
+        else:
+            self.guide.restore(self._checkpoint)
+        return self.guide.on_detected_crossing(options)
+
+
+def test_predictive_guide():
+    from ordered_instructions_guide import OrderedInstructionsGuide
+
+    guide = PredictiveGuide(OrderedInstructionsGuide([Direction.RIGHT, Direction.LEFT, Direction.STRAIGHT]))
+
+    # seen early and refreshed: the instruction is consumed once
+    guide.anticipate(Direction.RIGHT | Direction.U_TURN)
+    guide.anticipate(Direction.RIGHT | Direction.LEFT | Direction.U_TURN)
+    guide._pending.future.result()
+    assert guide.on_detected_crossing(Direction.RIGHT | Direction.LEFT | Direction.U_TURN) == Direction.RIGHT
+    assert (guide.hits, guide.misses) == (1, 0)
+
+    # the options changed on arrival: the anticipated answer is thrown away and the guide asked again
+    guide.anticipate(Direction.LEFT | Direction.STRAIGHT | Direction.U_TURN)
+    assert guide.on_detected_crossing(Direction.LEFT | Direction.U_TURN) == Direction.LEFT
+    assert (guide.hits, guide.misses) == (1, 1)
+
+    # nothing anticipated
+    assert guide.on_detected_crossing(Direction.STRAIGHT | Direction.U_TURN) == Direction.STRAIGHT
+    assert guide.on_detected_crossing(Direction.U_TURN) == Direction.STOP
+    guide.close()
+
+
+def test_predictive_maze_run():
+    import threading
+
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    guide = PredictiveGuide(OrderedInstructionsGuide(InstructionCompiler(maze).route((7, 0), (1, 6))[1]))
+    simulator = Simulator(maze, (7, 0))
+    simulator.run(MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock))
+
+    # the walker closed the guide when it stopped
+    assert guide.closed and not any(thread.name.startswith("guide") for thread in threading.enumerate())
+    assert simulator.stopped and simulator.cell == (1, 6) and not simulator.collisions
+    assert guide.hits + guide.misses == 6
+
+
+if __name__ == "__main__":
+    test_predictive_guide()
+    test_predictive_maze_run()
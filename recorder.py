@@ -0,0 +1,295 @@
+import os
+from array import array
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from clock import SimulatedClock
+from direction import Direction
+from guide import Guide
+from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK, MOTOR_LEFT, MOTOR_RIGHT
+
+PROXIMITY_SENSORS = 7
+NOT_READ = -1  # stored for a sensor that wasn't read in a tick
+NOT_WRITTEN = -2 ** 31  # stored for a motor that wasn't written in a tick
+
+_COLUMNS = ("time_ns", "button", "proximity", "motors", "decisions")
+
+
+class Recording:
+    """
+    Everything a walker read from and wrote to its Thymio, one row per tick, plus every guide decision.
+    Saved as one .npy file per column in a directory, so it can be loaded memory-mapped without reading it all.
+
+    time_ns: (ticks,) clock time at the start of the tick
+    button: (ticks,) BUTTON_CENTER as read in the tick, NOT_READ if it wasn't
+    proximity: (ticks, 7) PROXIMITY_FRONT_BACK as read in the tick, NOT_READ if it wasn't
+    motors: (ticks, 2) last MOTOR_LEFT and MOTOR_RIGHT target written in the tick, NOT_WRITTEN if there was none
+    decisions: (decisions, 3) tick, options (Direction value) and chosen direction of every guide query
+    """
+
+    def __init__(self, time_ns: np.ndarray, button: np.ndarray, proximity: np.ndarray, motors: np.ndarray,
+                 decisions: np.ndarray):
+        self.time_ns = time_ns
+        self.button = button
+        self.proximity = proximity
+        self.motors = motors
+        self.decisions = decisions
+
+    def __len__(self):
+        return len(self.time_ns)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for column in _COLUMNS:
+            np.save(os.path.join(path, column + ".npy"), getattr(self, column))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "Recording":
+        mode = "r" if mmap else None
+        return cls(*(np.load(os.path.join(path, column + ".npy"), mmap_mode=mode) for column in _COLUMNS))
+
+
+class Recorder:
+    """
+    Records the sensor reads, motor writes and guide decisions of a MazeWalker run. Pass it to MazeWalker, it wraps the
+    walker's node and guide during every tick (like TickProfiler) and appends one row per tick to growing int64
+    columns. If path is set, the recording is saved there when the walker stops.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._time_ns = array("q")
+        self._button = array("q")
+        self._proximity = array("q")
+        self._motors = array("q")
+        self._decisions = array("q")
+        self._wrapped = None
+
+    def begin_tick(self, walker):
+        self._time_ns.append(walker.clock.time_ns())
+        self._button.append(NOT_READ)
+        self._proximity.extend((NOT_READ,) * PROXIMITY_SENSORS)
+        self._motors.extend((NOT_WRITTEN, NOT_WRITTEN))
+        self._wrapped = walker.th, walker.guide
+        walker.th, walker.guide = _RecordingNode(walker.th, self), _RecordingGuide(walker.guide, self)
+
+    def end_tick(self, walker):
+        walker.th, walker.guide = self._wrapped
+        self._wrapped = None
+
+    def recording(self) -> Recording:
+        ticks = len(self._time_ns)
+        return Recording(
+            np.array(self._time_ns, dtype=np.int64),
+            np.array(self._button, dtype=np.int64),
+            np.array(self._proximity, dtype=np.int64).reshape(ticks, PROXIMITY_SENSORS),
+            np.array(self._motors, dtype=np.int64).reshape(ticks, 2),
+            np.array(self._decisions, dtype=np.int64).reshape(-1, 3),
+        )
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to save the recording to.")
+        self.recording().save(path)
+
+
+class _RecordingNode:
+    __slots__ = ("_node", "_recorder")
+
+    def __init__(self, node, recorder: Recorder):
+        self._node = node
+        self._recorder = recorder
+
+    def __getitem__(self, variable):
+        value = self._node[variable]
+        if variable == PROXIMITY_FRONT_BACK:
+            self._recorder._proximity[-PROXIMITY_SENSORS:] = array("q", value[:PROXIMITY_SENSORS])
+        elif variable == BUTTON_CENTER:
+            self._recorder._button[-1] = int(value)
+        return value
+
+    def __setitem__(self, variable, value):
+        self._node[variable] = value
+        if variable == MOTOR_LEFT:
+            self._recorder._motors[-2] = value
+        elif variable == MOTOR_RIGHT:
+            self._recorder._motors[-1] = value
+
+
+class _RecordingGuide:
+    __slots__ = ("_guide", "_recorder")
+
+    def __init__(self, guide, recorder: Recorder):
+        self._guide = guide
+        self._recorder = recorder
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        direction = self._guide.on_detected_crossing(options)
+        self._recorder._decisions.extend((len(self._recorder._time_ns) - 1, options.value, direction.value))
+        return direction
+
+    def __getattr__(self, name):
+        return getattr(self._guide, name)
+
+
+class ReplayGuide(Guide):
+    """Returns the decisions of a recording in order, so a replayed walker takes the same turns as the recorded one."""
+
+    def __init__(self, decisions: np.ndarray):
+        self._choices = [Direction(int(choice)) for choice in decisions[:, 2]]
+        self._index = 0
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        if self._index >= len(self._choices):
+            return Direction.STOP
+        self._index += 1
+        return self._choices[self._index - 1]
+
+
+class ReplayResult(NamedTuple):
+    ticks: int  # ticks the replayed walker ran before it stopped (or the recording ended)
+    motor_differences: List[Tuple[int, Tuple[int, int], Tuple[int, int]]]  # (tick, recorded, replayed)
+    decision_differences: List[Tuple[int, Tuple[int, ...], Tuple[int, ...]]]  # (index, recorded, replayed) rows
+
+    @property
+    def identical(self) -> bool:
+        return not self.motor_differences and not self.decision_differences
+
+
+def replay(recording: Recording, walker, replay_decisions: bool = True) -> ReplayResult:
+    """
+    Feeds a recording into a walker tick by tick, as fast as possible, and compares what it does with what was
+    recorded. The walker gets a simulated clock set to the recorded tick times and, with replay_decisions, a
+    ReplayGuide so it takes the recorded turns. Sensors the walker reads in a tick where the recorded one didn't
+    return the last recorded value.
+    """
+    clock = SimulatedClock(int(recording.time_ns[0]) if len(recording) else 0)
+    node = _ReplayNode(recording)
+    walker.clock = clock
+    if replay_decisions:
+        walker.guide = ReplayGuide(recording.decisions)
+
+    recorder = Recorder()
+    previous_recorder = getattr(walker, "recorder", None)
+    walker.recorder = recorder
+    walker.th = node
+    stopped = []
+
+    def stop():
+        stopped.append(True)
+        original_stop()
+
+    original_stop = walker.stop
+    walker.stop = stop
+    try:
+        for tick in range(len(recording)):
+            clock.advance_ns(int(recording.time_ns[tick]) - clock.time_ns())
+            node.tick = tick
+            walker._update()
+            if stopped:
+                break
+    finally:
+        del walker.stop
+        walker.recorder = previous_recorder
+
+    replayed = recorder.recording()
+    ticks = len(replayed)
+    motor_differences = [(tick, _row(recording.motors[tick]), _row(replayed.motors[tick]))
+                         for tick in np.flatnonzero((recording.motors[:ticks] != replayed.motors).any(axis=1))]
+    if ticks < len(recording):
+        motor_differences += [(tick, _row(recording.motors[tick]), (NOT_WRITTEN, NOT_WRITTEN))
+                              for tick in range(ticks, len(recording))]
+
+    decision_differences = []
+    for index in range(max(len(recording.decisions), len(replayed.decisions))):
+        recorded = _row(recording.decisions[index]) if index < len(recording.decisions) else ()
+        actual = _row(replayed.decisions[index]) if index < len(replayed.decisions) else ()
+        if recorded != actual:
+            decision_differences.append((index, recorded, actual))
+
+    return ReplayResult(ticks, motor_differences, decision_differences)
+
+
+class _ReplayNode:
+    """Serves the recorded sensor values of the current tick, forward filled where a tick didn't read them."""
+
+    def __init__(self, recording: Recording):
+        self.tick = 0
+        self._button = _forward_filled(np.asarray(recording.button))
+        self._proximity = _forward_filled(np.asarray(recording.proximity))
+        self._motors = {MOTOR_LEFT: 0, MOTOR_RIGHT: 0}
+
+    def __getitem__(self, variable):
+        if variable == PROXIMITY_FRONT_BACK:
+            return self._proximity[self.tick].tolist()
+        if variable == BUTTON_CENTER:
+            return int(self._button[self.tick])
+        if variable in self._motors:
+            return self._motors[variable]
+        raise KeyError(f"{variable} is not recorded.")
+
+    def __setitem__(self, variable, value):
+        if variable not in self._motors:
+            raise KeyError(f"{variable} can't be written in a replay.")
+        self._motors[variable] = value
+
+
+def _row(values: np.ndarray) -> Tuple[int, ...]:
+    return tuple(int(value) for value in values)
+
+
+def _forward_filled(column: np.ndarray) -> np.ndarray:
+    """Replaces NOT_READ rows with the last row that was read (0 before the first one)."""
+    read = column != NOT_READ if column.ndim == 1 else (column != NOT_READ).all(axis=1)
+    last = np.maximum.accumulate(np.where(read, np.arange(len(column)), -1))
+    filled = column[np.maximum(last, 0)].copy()
+    filled[last < 0] = 0
+    return filled
+
+
+def test_record_and_replay():
+    import tempfile
+
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    directory = tempfile.TemporaryDirectory()
+    simulator = Simulator(maze, (7, 0))
+    instructions = InstructionCompiler(maze).route((7, 0), (1, 6))[1]
+    walker = MazeWalker(OrderedInstructionsGuide(instructions), events=EventLog(Level.OFF),
+                        clock=simulator.clock, recorder=Recorder(directory.name))
+    simulator.run(walker)
+
+    recording = Recording.load(directory.name)
+    assert len(recording) == simulator.ticks
+    assert len(recording.decisions) == 6 and recording.decisions[-1, 2] == Direction.STOP.value
+
+    result = replay(recording, MazeWalker(OrderedInstructionsGuide([]), events=EventLog(Level.OFF)))
+    assert result.identical and result.ticks == len(recording)
+
+    changed = MazeWalker(OrderedInstructionsGuide([]), events=EventLog(Level.OFF))
+    changed.base_speed = 250
+    result = replay(recording, changed)
+    assert not result.identical and result.motor_differences[0][2] == (250, 250)
+
+    del recording
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    test_record_and_replay()
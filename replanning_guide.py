@@ -0,0 +1,384 @@
+from array import array
+from heapq import heappop, heappush
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from direction import Direction
+from grid_search import Maze, Point, as_grid, padded_weights
+from guide import Guide, copy_containers
+from heading import Heading
+
+_INFINITY = float("inf")
+_CORRIDOR = Direction.STRAIGHT | Direction.U_TURN
+
+# where the belief about a cell comes from
+_MAP, _SEEN, _ASSUMED = 0, 1, 2
+
+
+class ReplanningGuide(Guide):
+    """
+    A Guide that drives the shortest route to an end point on a map of the maze and replans when the walker reports
+    something the map doesn't know about.
+
+    The guide keeps its own belief map, initialised from the given maze matrix (same format as find_path). At every
+    crossing it works out which cell the walker is on by following the belief map straight ahead from the last crossing,
+    writes the reported options into the map and repairs the plan with D* Lite. The search runs backwards from the end,
+    so moving the robot and changing a handful of cells only re-expands the cells whose distance to the end actually
+    changes instead of solving the whole maze again.
+
+    Localisation assumptions (the walker only reports relative options, no positions):
+    - the robot starts on start, facing heading, and reports the first crossing after leaving it
+    - after a turn, the next crossing is on the cell straight ahead (up to the next believed wall) that contradicts the
+      belief map the least: every differing opening on that cell counts once, and so does every opening that must be
+      wrong on the believed crossings before it for the walker to have driven past them. Ties go to a cell that
+      explains all the reported openings (an opening the map has too many is more likely than one it lacks), then to an
+      exact match, then to the closer cell.
+    Every cell driven past without a crossing gets walls on both sides in the belief map.
+
+    The walls of the map nobody has seen yet are only a guess: when the belief map has no route to the end anymore,
+    they're all assumed open (the free-space assumption) and the route is planned through them. They still count as
+    walls for the options the walker is expected to report, until it actually drives there. If the end is reached, or
+    it can't be reached even then, the walker is told to stop.
+    """
+
+    def __init__(self, maze: Maze, start: Point, end: Point, heading: Optional[Heading] = None):
+        grid = as_grid(maze)
+        self.shape = grid.shape
+        self._weights, self._stride = padded_weights(grid)
+        self._offsets = (-self._stride, 1, self._stride, -1)  # indexed by Heading
+
+        self._cell = self._index(start)
+        self._goal = self._index(end)
+        for point, cell in ((start, self._cell), (end, self._goal)):
+            if not self._weights[cell]:
+                raise ValueError(f"Point {point} is not walkable.")
+        self.heading = heading if heading is not None else self._initial_heading()
+
+        size = len(self._weights)
+        self._g = array("d", [_INFINITY]) * size
+        self._rhs = array("d", [_INFINITY]) * size
+        self._queued = [None] * size  # key the cell was last pushed with, None if it isn't in the open set
+        self._sources = array("b", [_MAP]) * size
+        self._sources[self._cell] = _SEEN
+        self._open_set = []
+        self._km = 0
+        self._last_cell = self._cell
+        self.expansions = 0
+
+        self._rhs[self._goal] = 0
+        self._push(self._goal)
+        self._compute_shortest_path()
+
+    def checkpoint(self):
+        # the belief map and the search state are arrays and lists of numbers and tuples, copied as a whole
+        return copy_containers(self.__dict__)
+
+    def restore(self, checkpoint):
+        self.__dict__.update(copy_containers(checkpoint))
+
+    @property
+    def position(self) -> Point:
+        """The cell the guide believes the walker is on (as x/y point)."""
+        return self._point(self._cell)
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        cell = self._locate(options)
+        self._km += self._heuristic(self._last_cell, cell)
+        self._last_cell = self._cell = cell
+        self._observe(cell, options)
+
+        if cell == self._goal:
+            return Direction.STOP
+
+        self._compute_shortest_path()
+        if self._g[cell] == _INFINITY and self._assume_free_space():
+            self._compute_shortest_path()
+
+        best, best_cost = Direction.STOP, _INFINITY
+        for direction in (Direction.STRAIGHT, Direction.RIGHT, Direction.LEFT, Direction.U_TURN):
+            if direction not in options:
+                continue
+            neighbour = cell + self._offsets[self.heading.turn(direction)]
+            if self._weights[neighbour] and self._weights[neighbour] + self._g[neighbour] < best_cost:
+                best, best_cost = direction, self._weights[neighbour] + self._g[neighbour]
+
+        if best != Direction.STOP:
+            self.heading = self.heading.turn(best)
+
+        return best
+
+    def _locate(self, options: Direction) -> int:
+        weights = self._weights
+        step = self._offsets[self.heading]
+        candidates = []
+        best = None
+        skipped = 0  # believed crossings the walker must have driven past without stopping
+        cell = self._cell
+        while weights[cell + step]:
+            cell += step
+            believed = self._believed_options(cell)
+            mismatches = _mismatches(believed, options)
+            unexplained = _mismatches(believed & options, options) > 0  # reported openings the map doesn't have
+            score = (skipped + mismatches, unexplained, mismatches > 0, len(candidates))
+            if best is None or score < best:
+                best = score
+            skipped += _mismatches(believed, _CORRIDOR)  # the openings that are wrong if it was driven past
+            candidates.append(cell)
+
+        if best is None:
+            return self._cell  # the belief map has a wall right in front, the crossing can only be here
+
+        passed = candidates[:best[3]]
+        for driven in candidates[:best[3] + 1]:
+            self._sources[driven] = _SEEN
+        left, right = self._offsets[self.heading.turn(Direction.LEFT)], self._offsets[self.heading.turn(Direction.RIGHT)]
+        self._set_walls(side for passed_cell in passed for side in (passed_cell + left, passed_cell + right))
+
+        return candidates[best[3]]
+
+    def _observe(self, cell: int, options: Direction):
+        """Writes the options reported on cell into the belief map and updates the affected cells."""
+        changed = []
+        for direction in (Direction.STRAIGHT, Direction.LEFT, Direction.RIGHT):
+            neighbour = cell + self._offsets[self.heading.turn(direction)]
+            if self._is_border(neighbour):
+                continue
+            self._sources[neighbour] = _SEEN
+            if direction in options and not self._weights[neighbour]:
+                self._weights[neighbour] = 1  # the real cost isn't known, assume a plain cell
+                changed.append(neighbour)
+            elif direction not in options and self._weights[neighbour]:
+                self._weights[neighbour] = 0
+                changed.append(neighbour)
+
+        self._cells_changed(changed)
+
+    def _set_walls(self, cells: Iterable[int]):
+        changed = []
+        for cell in cells:
+            if cell == self._goal:
+                continue
+            self._sources[cell] = _SEEN
+            if self._weights[cell]:
+                self._weights[cell] = 0
+                changed.append(cell)
+
+        self._cells_changed(changed)
+
+    def _assume_free_space(self) -> bool:
+        """Opens every wall of the map the walker hasn't seen, returns whether there was one."""
+        changed = [cell for cell, weight in enumerate(self._weights)
+                   if not weight and self._sources[cell] == _MAP and not self._is_border(cell)]
+        for cell in changed:
+            self._weights[cell] = 1  # the real cost isn't known, assume a plain cell
+            self._sources[cell] = _ASSUMED
+        self._cells_changed(changed)
+
+        return bool(changed)
+
+    def _cells_changed(self, cells: List[int]):
+        # the cost of entering a cell changed -> the cell itself and every cell that can move onto it
+        for cell in cells:
+            self._update(cell)
+            for offset in self._offsets:
+                self._update(cell + offset)
+
+    def _believed_options(self, cell: int) -> Direction:
+        weights, sources = self._weights, self._sources
+        options = Direction.U_TURN
+        for direction in (Direction.STRAIGHT, Direction.LEFT, Direction.RIGHT):
+            neighbour = cell + self._offsets[self.heading.turn(direction)]
+            if weights[neighbour] and sources[neighbour] != _ASSUMED:
+                options |= direction
+
+        return options
+
+    def _compute_shortest_path(self):
+        g, rhs, queued, open_set = self._g, self._rhs, self._queued, self._open_set
+        weights, offsets = self._weights, self._offsets
+        start = self._cell
+
+        while open_set:
+            key, cell = open_set[0]
+            if queued[cell] != key:
+                heappop(open_set)  # stale entry
+                continue
+            if key >= self._key(start) and rhs[start] == g[start]:
+                break
+
+            heappop(open_set)
+            queued[cell] = None
+            new_key = self._key(cell)
+            if key < new_key:
+                self._push(cell)
+                continue
+
+            self.expansions += 1
+            if g[cell] > rhs[cell]:
+                g[cell] = rhs[cell]
+            else:
+                g[cell] = _INFINITY
+                self._update(cell)
+            if weights[cell]:
+                for offset in offsets:
+                    self._update(cell + offset)
+
+    def _update(self, cell: int):
+        weights, g, rhs = self._weights, self._g, self._rhs
+        if cell != self._goal:
+            best = _INFINITY
+            if weights[cell]:
+                for offset in self._offsets:
+                    neighbour = cell + offset
+                    cost = weights[neighbour]
+                    if cost and cost + g[neighbour] < best:
+                        best = cost + g[neighbour]
+            rhs[cell] = best
+
+        if g[cell] != rhs[cell]:
+            self._push(cell)
+        else:
+            self._queued[cell] = None
+
+    def _push(self, cell: int):
+        key = self._key(cell)
+        self._queued[cell] = key
+        heappush(self._open_set, (key, cell))
+
+    def _key(self, cell: int) -> Tuple[float, float]:
+        k = min(self._g[cell], self._rhs[cell])
+        return k + self._heuristic(self._cell, cell) + self._km, k
+
+    def _heuristic(self, a: int, b: int) -> int:
+        ay, ax = divmod(a, self._stride)
+        by, bx = divmod(b, self._stride)
+        return abs(ax - bx) + abs(ay - by)
+
+    def _initial_heading(self) -> Heading:
+        # the only way out of the start cell, or straight up if there are several
+        exits = [heading for heading in Heading if self._weights[self._cell + self._offsets[heading]]]
+        return exits[0] if len(exits) == 1 else Heading.UP
+
+    def _is_border(self, cell: int) -> bool:
+        y, x = divmod(cell, self._stride)
+        return not (0 < x < self._stride - 1 and 0 < y <= self.shape[0])
+
+    def _index(self, point: Point) -> int:
+        height, width = self.shape
+        x, y = point
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"Point {point} is outside of the {width}x{height} maze.")
+        return (y + 1) * self._stride + x + 1
+
+    def _point(self, cell: int) -> Point:
+        y, x = divmod(cell, self._stride)
+        return x - 1, y - 1
+
+
+def _mismatches(a: Direction, b: Direction) -> int:
+    """How many of the straight, left and right openings differ between a and b."""
+    return sum(direction in a ^ b for direction in (Direction.STRAIGHT, Direction.LEFT, Direction.RIGHT))
+
+
+def _drive(maze: List[List[int]], guide: Guide, start: Point, heading: Heading, max_crossings: int = 100,
+           on_move: Optional[Callable[[Point], None]] = None) -> List[Point]:
+    """
+    Stand-in for MazeWalker on the real maze: drives straight to the next crossing, reports the options there and takes
+    the instructed turn. Returns the crossings it stopped on, on_move is called with every cell it drives to.
+    """
+    def walkable(point):
+        x, y = point
+        return 0 <= y < len(maze) and 0 <= x < len(maze[0]) and maze[y][x] > 0
+
+    def ahead(point, direction):
+        dx, dy = heading.turn(direction).offset
+        return point[0] + dx, point[1] + dy
+
+    crossings = []
+    position = start
+    for _ in range(max_crossings):
+        while True:
+            position = ahead(position, Direction.STRAIGHT)
+            if on_move is not None:
+                on_move(position)
+            options = Direction.U_TURN
+            for direction in (Direction.STRAIGHT, Direction.LEFT, Direction.RIGHT):
+                if walkable(ahead(position, direction)):
+                    options |= direction
+            if options != Direction.STRAIGHT | Direction.U_TURN:
+                break
+
+        crossings.append(position)
+        turn = guide.on_detected_crossing(options)
+        if turn == Direction.STOP:
+            return crossings
+        heading = heading.turn(turn)
+
+    raise AssertionError("The guide didn't stop.")
+
+
+def test_replanning_guide():
+    believed = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    # the map is right: the route from find_path is driven without any replanning
+    guide = ReplanningGuide(believed, (7, 0), (1, 6))
+    assert guide.heading == Heading.DOWN
+    assert _drive(believed, guide, (7, 0), Heading.DOWN) == [(7, 5), (3, 5), (3, 3), (1, 3), (1, 6)]
+
+    # (2, 3) is blocked in reality, so the guide finds out on (3, 3) and goes around the ring at the top instead
+    actual = [row[:] for row in believed]
+    actual[3][2] = 0
+    guide = ReplanningGuide(believed, (7, 0), (1, 6))
+    crossings = _drive(actual, guide, (7, 0), Heading.DOWN)
+    assert crossings == [(7, 5), (3, 5), (3, 3), (5, 3), (5, 1), (1, 1), (1, 6)]
+    assert guide.position == (1, 6)
+
+    # a checkpoint brings back the belief map and the plan, also more than once
+    guide = ReplanningGuide(believed, (7, 0), (1, 6))
+    checkpoint = guide.checkpoint()
+    for _ in range(2):
+        assert _drive(actual, guide, (7, 0), Heading.DOWN) == crossings
+        guide.restore(checkpoint)
+        assert guide.position == (7, 0) and guide._weights[guide._index((2, 3))]
+
+    # the lower corridor doesn't exist at all, the only way is the one the map doesn't know about
+    actual = [row[:] for row in believed]
+    actual[3][5] = actual[3][4] = 0
+    actual[5][5] = 0
+    actual[1][6] = 1
+    guide = ReplanningGuide(believed, (7, 0), (1, 6))
+    crossings = _drive(actual, guide, (7, 0), Heading.DOWN)
+    assert crossings[-1] == (1, 6)
+
+    # the map walls the end in, but nobody has seen that wall yet: the guide tries the way through it, it doesn't stop
+    walled_in = [row[:] for row in believed]
+    walled_in[4][1] = 0
+    guide = ReplanningGuide(walled_in, (7, 0), (1, 6))
+    assert _drive(believed, guide, (7, 0), Heading.DOWN) == [(7, 5), (3, 5), (3, 3), (1, 3), (1, 6)]
+
+    # walled in for real: the guide gives up instead of driving around forever
+    actual = [row[:] for row in believed]
+    actual[4][1] = 0
+    guide = ReplanningGuide(believed, (7, 0), (1, 6))
+    assert _drive(actual, guide, (7, 0), Heading.DOWN)[-1] != (1, 6)
+
+    # (5, 1) isn't open in reality: the crossing on (5, 2) is reported without it, which must not be taken for an
+    # unknown opening on the plain cell (2, 2) the walker comes across first
+    actual = [[0] * 8 for _ in range(6)]
+    actual[2] = [0, 1, 1, 1, 1, 1, 1, 0]
+    actual[3][5] = actual[4][5] = 1
+    believed = [row[:] for row in actual]
+    believed[1][5] = 1
+    guide = ReplanningGuide(believed, (1, 2), (5, 4), Heading.RIGHT)
+    assert _drive(actual, guide, (1, 2), Heading.RIGHT) == [(5, 2), (5, 4)]
+    assert guide.position == (5, 4)
+
+
+if __name__ == "__main__":
+    test_replanning_guide()
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from direction import Direction
+from grid_search import Maze, Point, as_grid
+from maze_graph import MazeGraph, Route, ShortestPathTree
+
+
+def maze_key(maze: Maze) -> bytes:
+    """
+    Content hash of a maze matrix. Two mazes get the same key exactly when they have the same shape and the same
+    values, no matter if they are nested lists or NumPy arrays (of any integer dtype, they are hashed as int64).
+    """
+    grid = as_grid(maze).astype(np.int64, copy=False)
+    digest = blake2b(digest_size=16)
+    digest.update(repr(grid.shape).encode())
+    digest.update(grid.tobytes())
+
+    return digest.digest()
+
+
+class RouteCache:
+    """
+    Serves routes for many missions on the same maze without solving it again every time.
+
+    Every maze is compiled into a MazeGraph once and for every start point a full shortest path tree is built once, so
+    any further (start, end) lookup only reads the route off the tree. Both are stored under the content hash of the
+    maze, which means a changed maze matrix simply ends up under a different key and never gets stale routes.
+    Hashing the maze is linear in its size, but it's a single pass over the raw bytes and a lot cheaper than a search.
+
+    Both caches are bounded and drop the least recently used entry once they are full. Dropping a maze also drops all
+    of its trees.
+    """
+
+    def __init__(self, max_mazes: int = 4, max_trees: int = 64):
+        if max_mazes < 1 or max_trees < 1:
+            raise ValueError("The cache needs room for at least one maze and one tree.")
+        self.max_mazes = max_mazes
+        self.max_trees = max_trees
+        self._graphs: "OrderedDict[bytes, MazeGraph]" = OrderedDict()
+        self._trees: "OrderedDict[Tuple[bytes, Point], ShortestPathTree]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def directions(self, maze: Maze, start: Point, end: Point) -> List[Direction]:
+        """Turn instructions for the shortest route from start to end (see MazeGraph.directions). Empty if there is none."""
+        graph, tree = self._tree(maze, start)
+        route = tree.route_to(end)
+
+        return graph.directions(route) if route else []
+
+    def route(self, maze: Maze, start: Point, end: Point) -> Optional[Route]:
+        """The shortest route from start to end or None if the end can't be reached."""
+        return self._tree(maze, start)[1].route_to(end)
+
+    def graph(self, maze: Maze) -> MazeGraph:
+        """The compiled graph of the maze, compiled now if it isn't cached yet."""
+        return self._graph(maze_key(maze), maze)
+
+    def clear(self):
+        self._graphs.clear()
+        self._trees.clear()
+
+    def __len__(self):
+        """Number of cached shortest path trees."""
+        return len(self._trees)
+
+    def _tree(self, maze: Maze, start: Point) -> Tuple[MazeGraph, ShortestPathTree]:
+        key = maze_key(maze)
+        graph = self._graph(key, maze)
+
+        tree_key = (key, tuple(start))
+        tree = self._trees.get(tree_key)
+        if tree is not None:
+            self.hits += 1
+            self._trees.move_to_end(tree_key)
+            return graph, tree
+
+        self.misses += 1
+        tree = graph.search(start)
+        self._trees[tree_key] = tree
+        if len(self._trees) > self.max_trees:
+            self._trees.popitem(last=False)
+
+        return graph, tree
+
+    def _graph(self, key: bytes, maze: Maze) -> MazeGraph:
+        graph = self._graphs.get(key)
+        if graph is not None:
+            self._graphs.move_to_end(key)
+            return graph
+
+        graph = MazeGraph.compile(maze)
+        self._graphs[key] = graph
+        if len(self._graphs) > self.max_mazes:
+            evicted, _ = self._graphs.popitem(last=False)
+            for tree_key in [tree_key for tree_key in self._trees if tree_key[0] == evicted]:
+                del self._trees[tree_key]
+
+        return graph
+
+
+def test_route_cache():
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    cache = RouteCache(max_trees=2)
+    assert maze_key(maze) == maze_key(np.array(maze, dtype=np.int64)) == maze_key(np.array(maze, dtype=np.int8))
+    assert maze_key(maze) != maze_key(np.array(maze).T)
+
+    directions = [Direction.RIGHT, Direction.RIGHT, Direction.LEFT, Direction.LEFT]
+    assert cache.directions(maze, (7, 0), (1, 6)) == directions
+    assert cache.directions(maze, (7, 0), (1, 6)) == directions
+    assert cache.directions(maze, (7, 0), (3, 3)) == [Direction.RIGHT, Direction.RIGHT]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    cache.directions(maze, (1, 6), (7, 0))
+    cache.directions(maze, (3, 5), (7, 0))
+    assert len(cache) == 2  # the tree from (7, 0) was the least recently used one
+    cache.directions(maze, (7, 0), (1, 6))
+    assert cache.misses == 4
+
+    # blocking the corridor at (5, 5) changes the key, so the old tree is not used anymore
+    maze[5][5] = 0
+    assert cache.directions(maze, (7, 0), (1, 6)) == []
+    assert cache.route(maze, (7, 0), (1, 6)) is None
+
+
+if __name__ == "__main__":
+    test_route_cache()
@@ -0,0 +1,288 @@
+from abc import ABC, abstractmethod
+from typing import Sequence
+
+import numpy as np
+
+PROXIMITY_SENSORS = 7  # values in PROXIMITY_FRONT_BACK
+# the thresholds MazeWalker compares every sensor with: opening and on the intersection on the left (0) and right (4)
+# ones, opening and front space on the center (2) one, none on the others
+WALKER_THRESHOLDS = ((100, 1500), (), (100, 2850), (), (100, 1500), (), ())
+
+
+class SensorFilter(ABC):
+    """
+    One stage between the proximity readings and MazeWalker's decisions (pass it as the walker's sensor_filter).
+    update takes the readings of one tick and returns the filtered ones as an int64 array the filter owns and
+    overwrites on the next update, so the walker thresholds them like raw readings.
+    All state lives in arrays preallocated for channels sensors and updating only writes into them, so ticks don't
+    allocate arrays (the readings come as a list from the Thymio, the first stage copies them into its input array).
+    """
+
+    def __init__(self, channels: int = PROXIMITY_SENSORS):
+        self.channels = channels
+        self.output = np.zeros(channels, dtype=np.int64)
+        self._input = np.zeros(channels, dtype=np.int64)
+
+    def update(self, values: Sequence[int]) -> np.ndarray:
+        if not isinstance(values, np.ndarray):
+            self._input[:] = values
+            values = self._input
+        self._update(values)
+        return self.output
+
+    @abstractmethod
+    def _update(self, values: np.ndarray):
+        """Writes the filtered values for the readings into output."""
+        pass
+
+    def reset(self):
+        """Forgets every reading so far, e.g. after the robot was put down somewhere else."""
+        pass
+
+
+class MovingMedian(SensorFilter):
+    """
+    The median of the last window readings of every sensor: a single reading way off (a reflection, a dropout) never
+    makes it through, a real change does after window // 2 + 1 ticks. That lag lets the walker overshoot the center
+    of an intersection a bit, so keep the window small. The readings are kept in a ring buffer, the median is taken
+    by sorting a preallocated copy of it in place.
+    """
+
+    def __init__(self, window: int = 3, channels: int = PROXIMITY_SENSORS):
+        super().__init__(channels)
+        if window < 1:
+            raise ValueError("The window needs at least one reading.")
+        self.window = window
+        self._ring = np.zeros((window, channels), dtype=np.int64)
+        self._sorted = np.zeros((window, channels), dtype=np.int64)
+        self._index = 0
+        self._count = 0
+
+    def _update(self, values: np.ndarray):
+        self._ring[self._index] = values
+        self._index = (self._index + 1) % self.window
+        if self._count < self.window:
+            self._count += 1
+        count = self._count
+        # before the ring is full, only the readings so far count (they're the first rows)
+        scratch = self._sorted[:count]
+        np.copyto(scratch, self._ring[:count])
+        scratch.sort(axis=0)
+        np.copyto(self.output, scratch[(count - 1) // 2])
+
+    def reset(self):
+        self._index = self._count = 0
+
+
+class ExponentialMovingAverage(SensorFilter):
+    """
+    Smooths every sensor with output = alpha * reading + (1 - alpha) * previous output, rounded to whole values. The
+    lower alpha, the smoother, but the more it lags behind.
+    """
+
+    def __init__(self, alpha: float = 0.5, channels: int = PROXIMITY_SENSORS):
+        super().__init__(channels)
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha has to be in (0, 1].")
+        self.alpha = alpha
+        self._average = np.zeros(channels, dtype=np.float64)
+        self._scaled = np.zeros(channels, dtype=np.float64)
+        self._started = False
+
+    def _update(self, values: np.ndarray):
+        if self._started:
+            np.multiply(self._average, 1 - self.alpha, out=self._average)
+            np.multiply(values, self.alpha, out=self._scaled)
+            np.add(self._average, self._scaled, out=self._average)
+        else:
+            np.copyto(self._average, values)
+            self._started = True
+        np.rint(self._average, out=self._scaled)
+        np.copyto(self.output, self._scaled, casting="unsafe")
+
+    def reset(self):
+        self._started = False
+
+
+class Hysteresis(SensorFilter):
+    """
+    Keeps readings that hover around one of the thresholds from flipping the walker's decisions back and forth: a
+    sensor that was below a threshold has to reach threshold + band before it reads as above it, one that was above
+    has to drop below threshold - band. Until then, the reading is held just on its old side of the threshold
+    (threshold - 1 or threshold + 1, so it doesn't matter if the walker compares with < or >).
+    thresholds holds the thresholds of every channel, the defaults are MazeWalker's (WALKER_THRESHOLDS).
+    """
+
+    def __init__(self, thresholds: Sequence[Sequence[int]] = WALKER_THRESHOLDS, band: int = 50,
+                 channels: int = PROXIMITY_SENSORS):
+        super().__init__(channels)
+        if len(thresholds) != channels:
+            raise ValueError(f"Expected thresholds for {channels} channels, got {len(thresholds)}.")
+        self.thresholds = tuple(tuple(channel) for channel in thresholds)
+        self.band = band
+        # one row per threshold, channels with fewer thresholds than others are masked out in the rows they lack
+        rows = max((len(channel) for channel in self.thresholds), default=0)
+        self._levels = np.zeros((rows, channels), dtype=np.int64)
+        self._active = np.zeros((rows, channels), dtype=bool)
+        for channel, levels in enumerate(self.thresholds):
+            self._levels[:len(levels), channel] = levels
+            self._active[:len(levels), channel] = True
+        self._upper = self._levels + band
+        self._lower = self._levels - band
+        self._held_below = self._levels - 1
+        self._held_above = self._levels + 1
+        self._above = np.zeros((rows, channels), dtype=bool)
+        self._masks = np.zeros((2, channels), dtype=bool)
+        self._started = False
+
+    def _update(self, values: np.ndarray):
+        output = self.output
+        np.copyto(output, values)
+        held, scratch = self._masks
+        for row, above in enumerate(self._above):
+            levels, active = self._levels[row], self._active[row]
+            if self._started:
+                # was below, now above but not by band yet
+                np.greater_equal(output, levels, out=held)
+                np.less(output, self._upper[row], out=scratch)
+                held &= scratch
+                np.logical_not(above, out=scratch)
+                held &= scratch
+                held &= active
+                np.copyto(output, self._held_below[row], where=held)
+                # was above, now below but not by band yet
+                np.less(output, levels, out=held)
+                np.greater(output, self._lower[row], out=scratch)
+                held &= scratch
+                held &= above
+                np.copyto(output, self._held_above[row], where=held)
+            np.greater_equal(output, levels, out=above)
+            above &= active
+        self._started = True
+
+    def reset(self):
+        self._started = False
+
+
+class FilterChain(SensorFilter):
+    """Runs the readings through the stages in order, e.g. FilterChain(MovingMedian(), Hysteresis())."""
+
+    def __init__(self, *stages: SensorFilter):
+        if not stages:
+            raise ValueError("A chain needs at least one stage.")
+        super().__init__(stages[0].channels)
+        self.stages = stages
+
+    def update(self, values: Sequence[int]) -> np.ndarray:
+        for stage in self.stages:
+            values = stage.update(values)
+        return values
+
+    def _update(self, values: np.ndarray):
+        pass
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+
+def test_filters():
+    median = MovingMedian(window=3, channels=2)
+    outputs = [median.update(values).tolist() for values in ([10, 0], [1000, 0], [12, 0], [14, 500], [16, 500])]
+    # the spike in the first sensor never gets through, the step in the second one does after two readings
+    assert outputs == [[10, 0], [10, 0], [12, 0], [14, 0], [14, 500]]
+
+    average = ExponentialMovingAverage(alpha=0.5, channels=1)
+    assert [int(average.update([value])[0]) for value in (100, 200, 200, 0)] == [100, 150, 175, 88]
+
+    hysteresis = Hysteresis(thresholds=((100,),), band=20, channels=1)
+    readings = [90, 105, 95, 119, 125, 110, 85, 99, 105]
+    held = [int(hysteresis.update([value])[0]) for value in readings]
+    assert held == [90, 99, 95, 99, 125, 110, 101, 101, 105]
+
+    # every channel only with its own thresholds: the side sensors aren't held around 2850, the center one is
+    hysteresis = Hysteresis()
+    hysteresis.update([0, 0, 2800, 0, 2800, 0, 0])
+    assert hysteresis.update([0, 0, 2860, 0, 2860, 0, 2860]).tolist() == [0, 0, 2849, 0, 2860, 0, 2860]
+    try:
+        Hysteresis(thresholds=((100,),))
+        assert False, "a threshold set for every channel"
+    except ValueError:
+        pass
+
+    chain = FilterChain(MovingMedian(window=3), Hysteresis())
+    first = chain.update([0, 0, 3000, 0, 0, 0, 0])
+    assert first is chain.update([0, 0, 3000, 0, 0, 0, 0]) and first[2] == 3000
+    chain.reset()
+    assert chain.update(np.arange(7))[6] == 6
+
+
+def test_filters_dont_allocate():
+    import tracemalloc
+
+    chain = FilterChain(MovingMedian(window=5), ExponentialMovingAverage(), Hysteresis())
+    readings = np.random.default_rng(0).integers(0, 4000, size=(1000, PROXIMITY_SENSORS))
+
+    tracemalloc.start()
+    try:
+        # numpy's dispatch keeps a few small objects around on the first calls, so measure from the second batch
+        for values in readings[:100]:
+            chain.update(values)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for values in readings[100:]:
+            chain.update(values)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # nothing kept from 900 ticks (not even a few bytes each), the peak is the work buffer of one median's sort
+    assert current - before < 256 and peak - before < 4096
+    assert chain.stages[0].output.tolist() == np.median(readings[-5:], axis=0).astype(np.int64).tolist()
+
+
+def test_filtered_maze_run():
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    start, end = (7, 0), (1, 6)
+
+    def run(seed: int, sensor_filter=None, noise: float = 500, base_speed: int = 300) -> Simulator:
+        simulator = Simulator(maze, start, noise=noise, seed=seed)
+        guide = OrderedInstructionsGuide(InstructionCompiler(maze).route(start, end)[1])
+        walker = MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock, sensor_filter=sensor_filter)
+        walker.base_speed = base_speed
+        simulator.run(walker, max_seconds=120)
+        return simulator
+
+    # this noisy, the raw readings make up intersections, the filtered ones get the walker to the end
+    for seed in range(3):
+        assert run(seed).cell != end
+        simulator = run(seed, FilterChain(ExponentialMovingAverage(alpha=0.5), Hysteresis()))
+        assert simulator.stopped and simulator.cell == end and not simulator.collisions
+
+    # less noisy, but faster: the raw readings fail at a base_speed of 400, the filtered ones take the walker to the
+    # end about a fifth faster than it gets there at the default 300 without any noise
+    default = run(0, noise=0).clock.time_ns()
+    for seed in (1, 2, 5, 6):
+        assert run(seed, noise=450, base_speed=400).cell != end
+        simulator = run(seed, FilterChain(ExponentialMovingAverage(alpha=0.6), Hysteresis()), noise=450, base_speed=400)
+        assert simulator.stopped and simulator.cell == end and not simulator.collisions
+        assert simulator.clock.time_ns() < 0.85 * default
+
+
+if __name__ == "__main__":
+    test_filters()
+    test_filters_dont_allocate()
+    test_filtered_maze_run()
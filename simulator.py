@@ -0,0 +1,302 @@
+import math
+import random
+from typing import List, Optional, Tuple
+
+from clock import SimulatedClock
+from grid_search import Maze, Point, as_grid
+from heading import Heading
+from thymio_python.thymiodirect.thymio_constants import BUTTON_CENTER, PROXIMITY_FRONT_BACK, MOTOR_LEFT, MOTOR_RIGHT
+from turn_controller import MOTOR_LEFT_SPEED, MOTOR_RIGHT_SPEED
+
+# calibrated so that MazeWalker.ninety_degree_time_ns at +-100 is exactly a quarter turn
+MM_PER_SECOND_PER_UNIT = 0.332
+WHEEL_BASE = 95.0  # mm between the wheels
+ROBOT_RADIUS = 56.0  # mm, the body is treated as a circle for collisions
+
+# horizontal proximity sensors: angle relative to the heading (positive = to the right) and mount point in the robot
+# frame (forward, right) in mm. 0-4 are the front sensors from left to right, 5 and 6 the back ones.
+SENSORS = (
+    (math.radians(-40), (46.0, -38.0)),
+    (math.radians(-20), (56.0, -20.0)),
+    (0.0, (60.0, 0.0)),
+    (math.radians(20), (56.0, 20.0)),
+    (math.radians(40), (46.0, 38.0)),
+    (math.radians(-170), (-30.0, -30.0)),
+    (math.radians(170), (-30.0, 30.0)),
+)
+# the reading falls off with the inverse distance to the wall and reaches 0 at SENSOR_RANGE. Fitted so the thresholds of
+# MazeWalker trigger where they do on the robot: the side sensors see the perpendicular wall when the robot is in the
+# middle of an intersection and the front sensor stops it about in the middle of a dead end.
+SENSOR_RANGE = 180.0  # mm, nothing further away than this is seen
+SENSOR_OFFSET = 67.0  # mm
+SENSOR_SCALE = 610587.0
+SENSOR_MAX = 4500
+# the emitters light up a cone, not a line: every sensor casts SENSOR_RAYS rays spread over +-SENSOR_HALF_ANGLE around
+# its axis and reads the closest wall any of them hits. That's what lets the side sensors see the far wall of a side
+# corridor (and stop the walker in the middle of a junction it passes straight through), a single ray slips past it.
+SENSOR_HALF_ANGLE = math.radians(20)
+SENSOR_RAYS = 5
+_RAY_ANGLES = tuple(SENSOR_HALF_ANGLE * (2 * i / (SENSOR_RAYS - 1) - 1) for i in range(SENSOR_RAYS))
+
+_ANGLES = {Heading.UP: -math.pi / 2, Heading.RIGHT: 0.0, Heading.DOWN: math.pi / 2, Heading.LEFT: math.pi}
+
+
+class Simulator:
+    """
+    Headless stand-in for a Thymio in a grid maze, fast enough to run whole missions in milliseconds.
+
+    The maze has the matrix format of maze_solver (0 = wall), every cell is a cell_size mm square and everything outside
+    of the matrix is wall. The robot is simulated with differential drive kinematics from the motor targets, the
+    horizontal proximity sensors are cones of rays cast into the maze whose reading falls with the distance to the
+    closest wall they hit.
+    Time is virtual: run() advances clock by one period per tick instead of sleeping, pass it to the observer (e.g. as
+    MazeWalker's clock) so its timings follow the simulation.
+
+    The wheels reach their motor targets instantly unless motor_time_constant (seconds) is set, then they follow them
+    with a first order lag. The measured wheel speeds (MOTOR_LEFT_SPEED, MOTOR_RIGHT_SPEED) get speed_noise added.
+
+    Coordinates are in mm with x to the right and y downwards (like the rows of the matrix), so an angle of 0 is
+    Heading.RIGHT and positive angles turn right.
+    """
+
+    def __init__(self, maze: Maze, start: Point, heading: Optional[Heading] = None, cell_size: float = 220.0,
+                 noise: float = 0.0, seed: int = 0, substep: float = 0.01, motor_time_constant: float = 0.0,
+                 speed_noise: float = 0.0):
+        self.grid = as_grid(maze)
+        self.cell_size = cell_size
+        self.noise = noise
+        self.substep = substep
+        self.motor_time_constant = motor_time_constant
+        self.speed_noise = speed_noise
+        self._random = random.Random(seed)
+        if not self._walkable(*start):
+            raise ValueError(f"Start {start} is not walkable.")
+
+        if heading is None:
+            exits = [h for h in Heading if self._walkable(start[0] + h.offset[0], start[1] + h.offset[1])]
+            heading = exits[0] if len(exits) == 1 else Heading.UP
+        self.x = (start[0] + 0.5) * cell_size
+        self.y = (start[1] + 0.5) * cell_size
+        self.angle = _ANGLES[heading]
+
+        self.motor_left = 0
+        self.motor_right = 0
+        self.speed_left = 0.0  # actual wheel speeds in motor units
+        self.speed_right = 0.0
+        self.button_center = 0
+        self.collisions = 0
+        self.distance = 0.0  # mm driven so far, forward positive
+        self.ticks = 0
+        self.stopped = False
+        self.cells: List[Point] = [tuple(start)]  # every cell the robot entered, in order
+        self.clock = SimulatedClock()
+        self._colliding = False
+
+    def time_ns(self) -> int:
+        """Virtual time in nanoseconds since the start of the simulation."""
+        return self.clock.time_ns()
+
+    @property
+    def cell(self) -> Point:
+        return int(self.x // self.cell_size), int(self.y // self.cell_size)
+
+    def set_motors(self, left: int, right: int):
+        self.motor_left = left
+        self.motor_right = right
+
+    def proximity(self) -> List[int]:
+        """The seven horizontal proximity readings as the Thymio reports them."""
+        cos, sin = math.cos(self.angle), math.sin(self.angle)
+        readings = []
+        for angle, (forward, right) in SENSORS:
+            x = self.x + forward * cos - right * sin
+            y = self.y + forward * sin + right * cos
+            distance = None
+            for ray in _RAY_ANGLES:
+                hit = self.cast(x, y, self.angle + angle + ray, SENSOR_RANGE)
+                if hit is not None and (distance is None or hit < distance):
+                    distance = hit
+            if distance is None:
+                reading = 0.0
+            else:
+                reading = SENSOR_SCALE * (1 / (distance + SENSOR_OFFSET) - 1 / (SENSOR_RANGE + SENSOR_OFFSET))
+            if self.noise and reading:
+                reading += self._random.gauss(0, self.noise)
+            readings.append(min(max(0, round(reading)), SENSOR_MAX))
+
+        return readings
+
+    def measured_speeds(self) -> Tuple[int, int]:
+        """The wheel speeds (left, right) as the Thymio measures them."""
+        return tuple(round(speed + (self._random.gauss(0, self.speed_noise) if self.speed_noise else 0))
+                     for speed in (self.speed_left, self.speed_right))
+
+    def advance(self, seconds: float):
+        """Moves the robot for the given time with the current motor targets and advances the clock."""
+        remaining = seconds
+        while remaining > 1e-12:
+            dt = min(self.substep, remaining)
+            self._move(dt)
+            remaining -= dt
+        self.clock.advance(seconds)
+
+    def run(self, observer, period: float = 0.08, max_seconds: float = 600.0) -> float:
+        """
+        Drives the observer like SingleSerialThymioRunner would, but on virtual time: its node (th) is replaced by this
+        simulator and _update is called once per period until it stops or max_seconds of virtual time have passed.
+        Returns the virtual time it ran for in seconds.
+        """
+        began = self.clock.time_ns()
+        observer.th = SimulatedNode(self)
+
+        def stop():
+            self.stopped = True
+            original_stop()
+
+        original_stop = observer.stop
+        observer.stop = stop
+        try:
+            while not self.stopped and (self.clock.time_ns() - began) / 1e9 < max_seconds:
+                observer._update()
+                self.ticks += 1
+                self.advance(period)
+        finally:
+            del observer.stop
+
+        return (self.clock.time_ns() - began) / 1e9
+
+    def cast(self, x: float, y: float, angle: float, max_distance: float) -> Optional[float]:
+        """Distance from (x, y) to the first wall in the direction of angle, None if there is none within max_distance."""
+        size = self.cell_size
+        cx, cy = math.floor(x / size), math.floor(y / size)
+        if not self._walkable(cx, cy):
+            return 0.0
+
+        dx, dy = math.cos(angle), math.sin(angle)
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        t_x = ((cx + (dx > 0)) * size - x) / dx if abs(dx) > 1e-12 else math.inf
+        t_y = ((cy + (dy > 0)) * size - y) / dy if abs(dy) > 1e-12 else math.inf
+        delta_x = size / abs(dx) if abs(dx) > 1e-12 else math.inf
+        delta_y = size / abs(dy) if abs(dy) > 1e-12 else math.inf
+
+        while True:
+            if t_x < t_y:
+                t, cx, t_x = t_x, cx + step_x, t_x + delta_x
+            else:
+                t, cy, t_y = t_y, cy + step_y, t_y + delta_y
+            if t > max_distance:
+                return None
+            if not self._walkable(cx, cy):
+                return t
+
+    def _move(self, dt: float):
+        if self.motor_time_constant > 0:
+            follow = 1 - math.exp(-dt / self.motor_time_constant)
+            self.speed_left += (self.motor_left - self.speed_left) * follow
+            self.speed_right += (self.motor_right - self.speed_right) * follow
+        else:
+            self.speed_left, self.speed_right = self.motor_left, self.motor_right
+
+        v = (self.speed_left + self.speed_right) / 2 * MM_PER_SECOND_PER_UNIT
+        omega = (self.speed_left - self.speed_right) * MM_PER_SECOND_PER_UNIT / WHEEL_BASE
+        angle = self.angle
+        if abs(omega) < 1e-9:
+            x = self.x + v * math.cos(angle) * dt
+            y = self.y + v * math.sin(angle) * dt
+        else:
+            x = self.x + v / omega * (math.sin(angle + omega * dt) - math.sin(angle))
+            y = self.y - v / omega * (math.cos(angle + omega * dt) - math.cos(angle))
+        self.angle = (angle + omega * dt + math.pi) % (2 * math.pi) - math.pi
+
+        if self._hits_wall(x, y):
+            # pushing against the wall, the robot stays where it is but still turns
+            if not self._colliding:
+                self.collisions += 1
+            self._colliding = True
+            return
+
+        self._colliding = False
+        self.x, self.y = x, y
+        self.distance += v * dt
+        if self.cell != self.cells[-1]:
+            self.cells.append(self.cell)
+
+    def _hits_wall(self, x: float, y: float) -> bool:
+        size, radius = self.cell_size, ROBOT_RADIUS
+        for cy in range(math.floor((y - radius) / size), math.floor((y + radius) / size) + 1):
+            for cx in range(math.floor((x - radius) / size), math.floor((x + radius) / size) + 1):
+                if self._walkable(cx, cy):
+                    continue
+                nearest_x = min(max(x, cx * size), (cx + 1) * size)
+                nearest_y = min(max(y, cy * size), (cy + 1) * size)
+                if (nearest_x - x) ** 2 + (nearest_y - y) ** 2 < radius ** 2:
+                    return True
+        return False
+
+    def _walkable(self, x: int, y: int) -> bool:
+        height, width = self.grid.shape
+        return 0 <= x < width and 0 <= y < height and self.grid[y, x] > 0
+
+
+class SimulatedNode:
+    """The node (th) a simulated observer reads its sensors from and writes its motor targets to."""
+
+    def __init__(self, simulator: Simulator):
+        self.simulator = simulator
+
+    def __getitem__(self, variable):
+        if variable == PROXIMITY_FRONT_BACK:
+            return self.simulator.proximity()
+        if variable == BUTTON_CENTER:
+            return self.simulator.button_center
+        if variable == MOTOR_LEFT:
+            return self.simulator.motor_left
+        if variable == MOTOR_RIGHT:
+            return self.simulator.motor_right
+        if variable == MOTOR_LEFT_SPEED:
+            return self.simulator.measured_speeds()[0]
+        if variable == MOTOR_RIGHT_SPEED:
+            return self.simulator.measured_speeds()[1]
+        raise KeyError(f"{variable} is not simulated.")
+
+    def __setitem__(self, variable, value):
+        if variable == MOTOR_LEFT:
+            self.simulator.motor_left = value
+        elif variable == MOTOR_RIGHT:
+            self.simulator.motor_right = value
+        else:
+            raise KeyError(f"{variable} can't be written in the simulation.")
+
+
+def test_simulated_maze_run():
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    start = (7, 0)
+    end = (1, 6)
+
+    simulator = Simulator(maze, start)
+    guide = OrderedInstructionsGuide(InstructionCompiler(maze).route(start, end)[1])
+    walker = MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock)
+    elapsed = simulator.run(walker)
+
+    assert simulator.stopped and elapsed < 600
+    assert simulator.cell == end
+    assert simulator.collisions == 0
+
+
+if __name__ == "__main__":
+    test_simulated_maze_run()
@@ -0,0 +1,153 @@
+import math
+from typing import TYPE_CHECKING, List, Optional
+
+from direction import Direction
+from turn_controller import MOTOR_LEFT_SPEED, MOTOR_RIGHT_SPEED
+
+if TYPE_CHECKING:
+    # the walker imports this module, it shouldn't load the solver with it
+    from maze_solver import Segment
+
+# mm driven per second and unit of wheel speed, the same calibration as the simulator (MM_PER_SECOND_PER_UNIT)
+MM_PER_UNIT_SECOND = 0.332
+
+
+class SpeedProfile:
+    """
+    Drives the straight segments of a planned route (see find_segments) as fast as possible: the MazeWalker asks it for
+    the speed on every tick it drives straight, instead of always going at its base_speed.
+
+    How far the robot has come since the last crossing is integrated from the measured wheel speeds (MOTOR_LEFT_SPEED,
+    MOTOR_RIGHT_SPEED), the segment tells how far the next one is. The speed ramps up by acceleration units per second
+    up to max_speed and brakes by deceleration units per second, so it's back at approach_speed approach cells before
+    the next crossing and the walker sees it coming at the speed its thresholds are tuned for. Once the walker has an
+    intersection in sight, it goes at its base_speed anyway.
+    If the robot gets further than planned (e.g. the walker didn't stop where it should have) or there are no segments
+    left, it also goes at approach_speed.
+
+    Pass it to MazeWalker as speed_profile, along with a guide that gives the turns of the same segments
+    (e.g. OrderedInstructionsGuide(instructions(segments))). The runner has to read the wheel speeds then.
+    """
+
+    def __init__(self, segments: List["Segment"], cell_size: float = 220.0, max_speed: int = 500,
+                 approach_speed: int = 300, acceleration: float = 300.0, deceleration: float = 300.0,
+                 approach: float = 1.0, mm_per_unit_second: float = MM_PER_UNIT_SECOND):
+        self.segments = segments
+        self.cell_size = cell_size  # mm
+        self.max_speed = max_speed
+        self.approach_speed = approach_speed  # should be the walker's base_speed
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.approach = approach  # cells before a crossing that are driven at approach_speed
+        self.mm_per_unit_second = mm_per_unit_second
+        self.index = 0  # segment the robot is on
+        self.distance = 0.0  # mm driven on the current segment
+        self._last_ns: Optional[int] = None
+        self._last_speed = 0.0
+        self._speed = approach_speed  # last speed handed out
+
+    def next_segment(self):
+        """Called by the walker on every crossing it stops on, the robot is on its center."""
+        self.index += 1
+        self.distance = 0.0
+        self._last_ns = None
+        self._speed = self.approach_speed
+
+    def speed(self, node, time_ns: int) -> int:
+        """The speed of both wheels for this tick, steering corrections are added on top."""
+        speed = (node[MOTOR_LEFT_SPEED] + node[MOTOR_RIGHT_SPEED]) / 2
+        if self._last_ns is None:
+            tick = 0.0
+        else:
+            tick = (time_ns - self._last_ns) / 1e9
+            self.distance += (speed + self._last_speed) / 2 * self.mm_per_unit_second * tick
+        self._last_ns = time_ns
+        self._last_speed = speed
+
+        if self.index >= len(self.segments):
+            self._speed = self.approach_speed
+            return self._speed
+
+        # distance left until approach_speed has to be reached, minus what is driven until the speed set now applies
+        remaining = ((self.segments[self.index].length - self.approach) * self.cell_size - self.distance
+                     - max(speed, 0.0) * self.mm_per_unit_second * tick)
+        if remaining <= 0:
+            self._speed = self.approach_speed
+            return self._speed
+
+        braking = math.sqrt(self.approach_speed ** 2 + 2 * self.deceleration * remaining / self.mm_per_unit_second)
+        ramp = self._speed + self.acceleration * tick
+        self._speed = round(max(self.approach_speed, min(self.max_speed, ramp, braking)))
+        return self._speed
+
+
+def instructions(segments: List["Segment"]) -> List[Direction]:
+    """The instructions for the segments, one per crossing the walker stops on like InstructionCompiler returns them."""
+    return [segment.turn for segment in segments[1:]]
+
+
+def test_speed_profile():
+    from maze_solver import Segment
+
+    profile = SpeedProfile([Segment(Direction.STRAIGHT, 10), Segment(Direction.LEFT, 1)])
+    node = {MOTOR_LEFT_SPEED: 0, MOTOR_RIGHT_SPEED: 0}
+    time_ns = 0
+    speeds = []
+    # drives exactly at the speed it's told to, 10 ticks per second
+    while profile.distance < 10 * profile.cell_size:
+        speed = profile.speed(node, time_ns)
+        speeds.append(speed)
+        node[MOTOR_LEFT_SPEED] = node[MOTOR_RIGHT_SPEED] = speed
+        time_ns += 100_000_000
+
+    assert max(speeds) == profile.max_speed
+    assert speeds == sorted(speeds[:speeds.index(profile.max_speed)]) + speeds[speeds.index(profile.max_speed):]
+    # back at approach speed for the last cell
+    approach = [speed for speed in speeds if speed == profile.approach_speed]
+    assert len(approach) * 0.1 * profile.approach_speed * MM_PER_UNIT_SECOND >= 0.9 * profile.cell_size
+
+    # a single cell is driven slowly all the way
+    profile.next_segment()
+    assert profile.speed(node, time_ns) == profile.approach_speed
+    profile.next_segment()
+    assert profile.speed(node, time_ns) == profile.approach_speed
+
+
+def test_speed_profile_maze_run():
+    from event_log import EventLog, Level
+    from maze_solver import Segment, find_segments
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]]
+    start, end = (12, 0), (1, 8)
+    segments = find_segments(maze, start, end)
+    # the walker stops on the junction with the dead end at (7, 6) too
+    assert segments[1:3] == [Segment(Direction.RIGHT, 5), Segment(Direction.STRAIGHT, 4)]
+
+    def run(speed_profile):
+        simulator = Simulator(maze, start, motor_time_constant=0.05, speed_noise=3.0)
+        walker = MazeWalker(OrderedInstructionsGuide(instructions(segments)), events=EventLog(Level.OFF),
+                            clock=simulator.clock, speed_profile=speed_profile)
+        elapsed = simulator.run(walker, max_seconds=300)
+        assert simulator.stopped and simulator.cell == end and not simulator.collisions
+        return elapsed
+
+    constant = run(None)
+    profiled = run(SpeedProfile(segments))
+    assert profiled < 0.8 * constant, (profiled, constant)
+
+
+if __name__ == "__main__":
+    test_speed_profile()
+    test_speed_profile_maze_run()
@@ -0,0 +1,257 @@
+import json
+import time
+from array import array
+from typing import Callable, Dict, Optional
+
+from direction import Direction
+
+# sections of a tick, decision is whatever is left of the tick after the others
+SENSORS = "sensors"
+GUIDE = "guide"
+MOTORS = "motors"
+DECISION = "decision"
+TICK = "tick"
+INTERVAL = "interval"  # time between the start of two consecutive ticks
+
+_BUCKETS = 24  # bucket i counts durations below 2^i microseconds, the last one everything above
+
+
+class Histogram:
+    """
+    Duration histogram with power of two buckets in microseconds, plus count, total, min and max in nanoseconds.
+    Recording only does integer arithmetic on preallocated counters.
+    """
+
+    def __init__(self):
+        self.buckets = array("q", [0]) * _BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def record(self, duration_ns: int):
+        self.buckets[min((duration_ns // 1000).bit_length(), _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def percentile(self, fraction: float) -> Optional[int]:
+        """Upper bound (in ns) of the bucket the given fraction of all durations falls into."""
+        if not self.count:
+            return None
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= fraction * self.count:
+                return min(1000 * 2 ** bucket, self.max_ns)
+        return self.max_ns
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "min_ns": self.min_ns,
+            "max_ns": self.max_ns,
+            "mean_ns": self.total_ns // self.count if self.count else None,
+            "p50_ns": self.percentile(0.5),
+            "p99_ns": self.percentile(0.99),
+            "bucket_upper_bounds_us": [2 ** bucket for bucket in range(_BUCKETS - 1)] + [None],
+            "buckets": list(self.buckets),
+        }
+
+
+class TickProfiler:
+    """
+    Measures how long the ticks of a MazeWalker take and how long the sensor reads, the guide and the motor writes
+    take within them. Pass it to MazeWalker to enable it, without one the walker doesn't measure anything.
+
+    A tick overruns if it takes longer than the period the runner calls it with, an interval overruns if the next tick
+    starts later than one period (plus the tolerance) after the previous one.
+    If export_path is set, the statistics are written there as JSON once the walker stops (after the tick it stopped
+    in has been recorded).
+    """
+
+    def __init__(self, period: float, export_path: Optional[str] = None, interval_tolerance: float = 0.1):
+        self.period_ns = round(period * 1e9)
+        self.export_path = export_path
+        self.interval_tolerance = interval_tolerance
+        self.histograms: Dict[str, Histogram] = {section: Histogram()
+                                                 for section in (SENSORS, GUIDE, MOTORS, DECISION, TICK, INTERVAL)}
+        self.tick_overruns = 0
+        self.interval_overruns = 0
+        self.guide_overruns = 0  # guide calls that alone took longer than a period
+        self._last_tick_start: Optional[int] = None
+        self._spent = {SENSORS: 0, GUIDE: 0, MOTORS: 0}
+        self._in_tick = False
+        self._export_pending = False
+
+    def profile_tick(self, walker, step: Callable[[], None]):
+        """
+        Runs one tick (step) of the walker and records it. For the duration of the tick, the walker's node (th) and
+        guide are wrapped so their calls are timed.
+        """
+        th, guide = walker.th, walker.guide
+        walker.th, walker.guide = _TimedNode(th, self), _TimedGuide(guide, self)
+        spent = self._spent
+        spent[SENSORS] = spent[GUIDE] = spent[MOTORS] = 0
+
+        start = time.perf_counter_ns()
+        self._in_tick = True
+        try:
+            step()
+        finally:
+            end = time.perf_counter_ns()
+            self._in_tick = False
+            walker.th, walker.guide = th, guide
+
+        histograms = self.histograms
+        duration = end - start
+        histograms[TICK].record(duration)
+        for section, spent_ns in spent.items():
+            histograms[section].record(spent_ns)
+        histograms[DECISION].record(max(duration - spent[SENSORS] - spent[GUIDE] - spent[MOTORS], 0))
+        if duration > self.period_ns:
+            self.tick_overruns += 1
+
+        if self._last_tick_start is not None:
+            interval = start - self._last_tick_start
+            histograms[INTERVAL].record(interval)
+            if interval > self.period_ns * (1 + self.interval_tolerance):
+                self.interval_overruns += 1
+        self._last_tick_start = start
+
+        if self._export_pending:
+            self._export_pending = False
+            self.export()
+
+    def on_stop(self):
+        """Called by the walker when it stops, exports to export_path if it's set. Within a tick, once it's recorded."""
+        if not self.export_path:
+            return
+        if self._in_tick:
+            self._export_pending = True
+        else:
+            self.export()
+
+    def summary(self) -> dict:
+        return {
+            "period_ns": self.period_ns,
+            "ticks": self.histograms[TICK].count,
+            "tick_overruns": self.tick_overruns,
+            "interval_overruns": self.interval_overruns,
+            "guide_overruns": self.guide_overruns,
+            "sections": {section: histogram.as_dict() for section, histogram in self.histograms.items()},
+        }
+
+    def export(self, path: Optional[str] = None):
+        """Writes the summary as JSON to path (or export_path)."""
+        path = path or self.export_path
+        if not path:
+            raise ValueError("No path to export the tick statistics to.")
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def __str__(self):
+        lines = [f"{self.histograms[TICK].count} ticks, {self.tick_overruns} tick overrun(s), "
+                 f"{self.interval_overruns} interval overrun(s), {self.guide_overruns} guide overrun(s)"]
+        for section, histogram in self.histograms.items():
+            if histogram.count:
+                lines.append(f"{section:>9}: mean {histogram.total_ns / histogram.count / 1e3:9.1f} us  "
+                             f"p99 <= {histogram.percentile(0.99) / 1e3:9.1f} us  max {histogram.max_ns / 1e3:9.1f} us")
+        return "\n".join(lines)
+
+
+class _TimedNode:
+    """Stands in for the Thymio node of a walker during a profiled tick, reads and writes are timed."""
+
+    __slots__ = ("_node", "_profiler")
+
+    def __init__(self, node, profiler: TickProfiler):
+        self._node = node
+        self._profiler = profiler
+
+    def __getitem__(self, key):
+        start = time.perf_counter_ns()
+        value = self._node[key]
+        self._profiler._spent[SENSORS] += time.perf_counter_ns() - start
+        return value
+
+    def __setitem__(self, key, value):
+        start = time.perf_counter_ns()
+        self._node[key] = value
+        self._profiler._spent[MOTORS] += time.perf_counter_ns() - start
+
+
+class _TimedGuide:
+    """Stands in for the guide of a walker during a profiled tick, calls are timed."""
+
+    __slots__ = ("_guide", "_profiler")
+
+    def __init__(self, guide, profiler: TickProfiler):
+        self._guide = guide
+        self._profiler = profiler
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        start = time.perf_counter_ns()
+        direction = self._guide.on_detected_crossing(options)
+        duration = time.perf_counter_ns() - start
+        self._profiler._spent[GUIDE] += duration
+        if duration > self._profiler.period_ns:
+            self._profiler.guide_overruns += 1
+        return direction
+
+    def __getattr__(self, name):
+        return getattr(self._guide, name)
+
+
+def test_tick_profiler():
+    import os
+    import tempfile
+
+    class SlowGuide:
+        def on_detected_crossing(self, options: Direction) -> Direction:
+            time.sleep(0.002)
+            return Direction.LEFT
+
+    class Walker:
+        def __init__(self):
+            self.th = {"prox": [0, 0, 0]}
+            self.guide = SlowGuide()
+            self.turn = None
+            self.stop_now = False
+
+        def step(self):
+            self.th["motor"] = self.th["prox"][0]
+            self.turn = self.guide.on_detected_crossing(Direction.LEFT | Direction.U_TURN)
+            if self.stop_now:
+                profiler.on_stop()
+
+    walker = Walker()
+    th, guide = walker.th, walker.guide
+    directory = tempfile.TemporaryDirectory()
+    export_path = os.path.join(directory.name, "ticks.json")
+    profiler = TickProfiler(0.001, export_path=export_path)
+    for tick in range(3):
+        walker.stop_now = tick == 2  # stops in the last tick, like MazeWalker does on the end
+        profiler.profile_tick(walker, walker.step)
+
+    assert walker.th is th and walker.guide is guide and walker.turn == Direction.LEFT
+    assert th["motor"] == 0
+    assert profiler.histograms[TICK].count == profiler.histograms[GUIDE].count == 3
+    assert profiler.histograms[INTERVAL].count == 2
+    assert profiler.histograms[GUIDE].min_ns >= 2_000_000
+    assert profiler.tick_overruns == profiler.guide_overruns == 3
+
+    # exported after the last tick was recorded
+    with open(export_path) as file:
+        exported = json.load(file)
+    directory.cleanup()
+    assert exported["ticks"] == 3
+    assert sum(exported["sections"][TICK]["buckets"]) == 3
+
+
+if __name__ == "__main__":
+    test_tick_profiler()
@@ -0,0 +1,293 @@
+import itertools
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from direction import Direction
+from event_log import EventLog, Level
+from grid_search import Maze, Point, as_grid
+from guide import Guide
+from heading import Heading
+from instruction_compiler import InstructionCompiler
+from maze_graph import MazeGraph
+from maze_walker import MazeWalker
+from ordered_instructions_guide import OrderedInstructionsGuide
+from simulator import Simulator
+
+Config = Dict[str, float]
+Mission = Tuple[Maze, Point, Point]  # maze, start, end
+
+# everything the tuner can change on a MazeWalker, ninety_degree_time_ns also scales the U-turn
+PARAMETERS = ("base_speed", "diff_threshold", "opening_prox_threshold", "on_intersection_prox_threshold",
+              "front_space_prox_threshold", "ninety_degree_time_ns")
+
+
+class TuningResult(NamedTuple):
+    config: Config
+    missions: int
+    completed: int  # missions that ended stopped on the end cell
+    completion_time: float  # mean virtual seconds of the completed missions, inf if none completed
+    collisions: int
+    missed_intersections: int  # crossings on the route the walker drove through without asking the guide
+    extra_intersections: int  # guide queries on cells that aren't crossings of the route
+
+    @property
+    def safe(self) -> bool:
+        return self.completed == self.missions and not self.collisions and not self.missed_intersections \
+            and not self.extra_intersections
+
+    @property
+    def score(self) -> float:
+        """Objective to minimise: the completion time for safe configs, worse than any safe one otherwise."""
+        if self.safe:
+            return self.completion_time
+        failures = self.missions - self.completed + self.collisions + self.missed_intersections \
+            + self.extra_intersections
+        return 1e6 * failures
+
+
+def default_config() -> Config:
+    walker = MazeWalker(OrderedInstructionsGuide([]), events=EventLog(Level.OFF))
+    return {parameter: getattr(walker, parameter) for parameter in PARAMETERS}
+
+
+def grid_configs(space: Dict[str, Sequence[float]], base: Optional[Config] = None) -> List[Config]:
+    """Every combination of the given values, parameters not in space keep their value from base (or the default)."""
+    base = base or default_config()
+    names = list(space)
+    return [{**base, **dict(zip(names, values))} for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_configs(space: Dict[str, Tuple[float, float]], count: int, seed: int = 0,
+                   base: Optional[Config] = None) -> List[Config]:
+    """count configs with every parameter in space drawn uniformly from its (low, high) range."""
+    base = base or default_config()
+    rng = random.Random(seed)
+    return [{**base, **{name: rng.uniform(low, high) for name, (low, high) in space.items()}} for _ in range(count)]
+
+
+def sweep(configs: Iterable[Config], missions: Sequence[Mission], workers: Optional[int] = None,
+          period: float = 0.08, max_seconds: float = 600.0) -> List[TuningResult]:
+    """Runs every mission in the simulator with every config, in a process pool, and returns the results in order."""
+    configs = list(configs)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(configs) == 1:
+        return [evaluate(config, missions, period, max_seconds) for config in configs]
+
+    with ProcessPoolExecutor(min(workers, len(configs))) as executor:
+        return list(executor.map(evaluate, configs, itertools.repeat(missions), itertools.repeat(period),
+                                 itertools.repeat(max_seconds)))
+
+
+def bayesian_sweep(space: Dict[str, Tuple[float, float]], missions: Sequence[Mission], iterations: int = 5,
+                   initial: int = 8, batch: Optional[int] = None, workers: Optional[int] = None, seed: int = 0,
+                   period: float = 0.08, max_seconds: float = 600.0) -> List[TuningResult]:
+    """
+    Bayesian optimisation of the score: starts with initial random configs, then fits a Gaussian process to all
+    results so far and runs the batch of candidates with the highest expected improvement, iterations times.
+    Returns all evaluated results.
+    """
+    workers = workers or os.cpu_count() or 1
+    batch = batch or workers
+    rng = random.Random(seed)
+    names = list(space)
+    low = np.array([space[name][0] for name in names], dtype=float)
+    high = np.array([space[name][1] for name in names], dtype=float)
+    base = default_config()
+
+    results = sweep(random_configs(space, initial, seed, base), missions, workers, period, max_seconds)
+    for _ in range(iterations):
+        observed = np.array([[result.config[name] for name in names] for result in results], dtype=float)
+        scores = np.array([result.score for result in results])
+        candidates = random_configs(space, 256 * batch, rng.randrange(2 ** 32), base)
+        points = np.array([[config[name] for name in names] for config in candidates], dtype=float)
+        improvement = expected_improvement((observed - low) / (high - low), scores, (points - low) / (high - low))
+        chosen = [candidates[i] for i in np.argsort(-improvement)[:batch]]
+        results += sweep(chosen, missions, workers, period, max_seconds)
+
+    return results
+
+
+def best(results: Iterable[TuningResult]) -> Optional[TuningResult]:
+    """The fastest safe result, None if no config was safe."""
+    safe = [result for result in results if result.safe]
+    return min(safe, key=lambda result: result.completion_time) if safe else None
+
+
+def evaluate(config: Config, missions: Sequence[Mission], period: float = 0.08,
+             max_seconds: float = 600.0) -> TuningResult:
+    """Runs every mission with a MazeWalker using config in the simulator."""
+    completed, total_time, collisions, missed, extra = 0, 0.0, 0, 0, 0
+    for maze, start, end in missions:
+        graph = MazeGraph.compile(maze)
+        route = graph.route(start, end)
+        if route is None:
+            raise ValueError(f"There is no route from {start} to {end}.")
+
+        simulator = Simulator(maze, start)
+        instructions = InstructionCompiler(maze).compile(graph.cells(route))
+        guide = _RecordingGuide(OrderedInstructionsGuide(instructions), simulator)
+        walker = MazeWalker(guide, events=EventLog(Level.OFF), clock=simulator.clock)
+        _configure(walker, config)
+
+        elapsed = simulator.run(walker, period, max_seconds)
+        if simulator.stopped and simulator.cell == tuple(end):
+            completed += 1
+            total_time += elapsed
+        collisions += simulator.collisions
+
+        expected = route_crossings(maze, graph.cells(route))
+        queried = guide.cells
+        matched = _matched(expected, queried)
+        missed += len(expected) - matched
+        extra += len(queried) - matched
+
+    return TuningResult(config, len(missions), completed, total_time / completed if completed else float("inf"),
+                        collisions, missed, extra)
+
+
+def route_crossings(maze: Maze, path: Sequence[Point]) -> List[Point]:
+    """
+    The cells on the path where MazeWalker is expected to ask its guide: every cell after the start with an opening to
+    the side or a wall in front (relative to the direction it's driven in), including the end if it's a dead end.
+    """
+    grid = as_grid(maze)
+
+    def walkable(x, y):
+        return 0 <= y < grid.shape[0] and 0 <= x < grid.shape[1] and grid[y, x] > 0
+
+    crossings = []
+    for previous, cell in zip(path, path[1:]):
+        heading = Heading.between(previous, cell)
+        for direction in (Direction.LEFT, Direction.RIGHT, Direction.STRAIGHT):
+            dx, dy = heading.turn(direction).offset
+            if walkable(cell[0] + dx, cell[1] + dy) != (direction == Direction.STRAIGHT):
+                crossings.append(cell)
+                break
+
+    return crossings
+
+
+def expected_improvement(observed: np.ndarray, scores: np.ndarray, candidates: np.ndarray,
+                         length_scale: float = 0.3, noise: float = 1e-6) -> np.ndarray:
+    """
+    Expected improvement (for minimisation) of every candidate under a Gaussian process with an RBF kernel fitted to
+    the observed points (all scaled to [0, 1]) and their scores.
+    """
+    # failed configs have huge scores, squash them so they don't dominate the fit
+    values = np.log1p(scores)
+    mean, std = values.mean(), values.std() or 1.0
+    values = (values - mean) / std
+
+    def kernel(a, b):
+        distances = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=-1)
+        return np.exp(-distances / (2 * length_scale ** 2))
+
+    k = kernel(observed, observed) + noise * np.eye(len(observed))
+    k_star = kernel(candidates, observed)
+    weights = np.linalg.solve(k, values)
+    mu = k_star @ weights
+    variance = 1 - np.einsum("ij,ji->i", k_star, np.linalg.solve(k, k_star.T))
+    sigma = np.sqrt(np.maximum(variance, 1e-12))
+
+    improvement = values.min() - mu
+    z = improvement / sigma
+    cdf = 0.5 * (1 + np.vectorize(math.erf)(z / np.sqrt(2)))
+    pdf = np.exp(-z ** 2 / 2) / np.sqrt(2 * np.pi)
+    return improvement * cdf + sigma * pdf
+
+
+class _RecordingGuide(Guide):
+    """Passes decisions through and remembers the cell the simulated robot was on for every query."""
+
+    def __init__(self, guide: Guide, simulator: Simulator):
+        self.guide = guide
+        self.simulator = simulator
+        self.cells: List[Point] = []
+
+    def on_detected_crossing(self, options: Direction) -> Direction:
+        self.cells.append(self.simulator.cell)
+        return self.guide.on_detected_crossing(options)
+
+    def anticipate(self, options: Direction):
+        self.guide.anticipate(options)
+
+
+def _configure(walker: MazeWalker, config: Config):
+    for parameter, value in config.items():
+        if parameter == "ninety_degree_time_ns":
+            factor = value / MazeWalker.ninety_degree_time_ns
+            walker.turn_timings = {direction: {**timings, "duration": round(timings["duration"] * factor)}
+                                   for direction, timings in MazeWalker.turn_timings.items()}
+        elif parameter in PARAMETERS:
+            setattr(walker, parameter, round(value))
+        else:
+            raise ValueError(f"{parameter} can't be tuned.")
+
+
+def _matched(expected: List[Point], queried: List[Point]) -> int:
+    """Length of the longest common subsequence, i.e. how many expected crossings were queried in the right order."""
+    previous = [0] * (len(queried) + 1)
+    for cell in expected:
+        current = [0]
+        for j, other in enumerate(queried):
+            current.append(previous[j] + 1 if cell == other else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def test_tuner():
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+    # the second one goes straight through the junction at (1, 3)
+    missions = [(maze, (7, 0), (1, 6)), (maze, (1, 6), (1, 1))]
+
+    graph = MazeGraph.compile(maze)
+    path = graph.cells(graph.route((7, 0), (1, 6)))
+    assert route_crossings(maze, path) == [(7, 5), (3, 5), (3, 3), (1, 3), (1, 6)]
+    default = evaluate(default_config(), missions[1:])
+    assert default.completed == 1 and default.missed_intersections == default.extra_intersections == 0
+
+    # a quarter of the calibrated turn time can't work, the robot ends up driving into walls
+    results = sweep(grid_configs({"ninety_degree_time_ns": [MazeWalker.ninety_degree_time_ns,
+                                                             MazeWalker.ninety_degree_time_ns / 4]}), missions,
+                    workers=1)
+    assert results[0].safe and results[0].completed == 2
+    assert not results[1].safe
+    assert best(results) is results[0]
+
+    observed = np.array([[0.0], [1.0]])
+    improvement = expected_improvement(observed, np.array([10.0, 20.0]), np.array([[0.1], [0.9]]))
+    assert improvement[0] > improvement[1]
+
+
+def example_sweep():
+    """Tunes base_speed on the maze from demo.py and prints every result, run with python tuner.py --sweep."""
+    results = bayesian_sweep({"base_speed": (200, 500)}, [
+        ([[0, 0, 0, 0, 0, 0, 0, 1, 0],
+          [0, 1, 1, 1, 1, 1, 0, 1, 0],
+          [0, 1, 0, 0, 0, 1, 0, 1, 0],
+          [0, 1, 1, 1, 1, 1, 0, 1, 0],
+          [0, 1, 0, 1, 0, 0, 0, 1, 0],
+          [0, 1, 0, 1, 1, 1, 1, 1, 0],
+          [0, 1, 0, 0, 0, 0, 0, 0, 0]], (7, 0), (1, 6))])
+    for result in sorted(results, key=lambda result: result.score):
+        print(result)
+    print("Best:", best(results))
+
+
+if __name__ == "__main__":
+    test_tuner()
+    if "--sweep" in sys.argv[1:]:
+        example_sweep()
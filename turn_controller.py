@@ -0,0 +1,149 @@
+import math
+from typing import Optional, Tuple
+
+from direction import Direction
+
+# measured wheel speeds, same units as the motor targets. The runner has to read them along with the proximity sensors.
+MOTOR_LEFT_SPEED = "motor.left.speed"
+MOTOR_RIGHT_SPEED = "motor.right.speed"
+
+# heading change per second and unit of speed difference between the wheels, follows from the calibrated
+# MazeWalker.ninety_degree_time_ns (+-100 for that long is a quarter turn)
+RADIANS_PER_UNIT_SECOND = 0.003494
+
+_ANGLES = {Direction.LEFT: (-1, math.pi / 2), Direction.RIGHT: (1, math.pi / 2), Direction.U_TURN: (1, math.pi)}
+
+
+class OdometryTurnController:
+    """
+    Closed-loop turns for the MazeWalker: instead of turning for a fixed time at a low speed, it integrates the measured
+    wheel speeds (MOTOR_LEFT_SPEED, MOTOR_RIGHT_SPEED) into the angle turned so far and stops at the target angle.
+
+    The wheel speed follows a trapezoidal profile: it starts at min_speed, ramps up by acceleration units per second
+    up to max_speed and brakes by deceleration units per second so it arrives at the target angle slowly. Since the
+    speeds are only measured once per tick, the turn ends on the tick where stopping now is closer to the target than
+    going on for another tick, counting settle_time of coasting once the motors are stopped.
+    Pass it to MazeWalker as turn_controller, without one the walker uses its timed turns.
+    """
+
+    def __init__(self, max_speed: int = 400, min_speed: int = 60, acceleration: float = 1500.0,
+                 deceleration: float = 1000.0, settle_time: float = 0.05,
+                 radians_per_unit_second: float = RADIANS_PER_UNIT_SECOND):
+        self.max_speed = max_speed
+        self.min_speed = min_speed
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.settle_time = settle_time  # seconds the wheels keep on turning (at about the same speed) once stopped
+        self.radians_per_unit_second = radians_per_unit_second
+        self.turned = 0.0  # radians turned so far in the current turn, in the direction of the turn
+        self._sign = 1  # 1 turns right (left wheel forward), -1 left
+        self._target = 0.0
+        self._started_ns = 0
+        self._last_ns: Optional[int] = None
+        self._last_rate = 0.0
+
+    @property
+    def remaining(self) -> float:
+        """Radians left to turn in the current turn, negative if it turned too far."""
+        return self._target - self.turned
+
+    def begin(self, direction: Direction, time_ns: int):
+        """Starts a turn (LEFT, RIGHT or U_TURN) at time_ns."""
+        self._sign, self._target = _ANGLES[direction]
+        self.turned = 0.0
+        self._started_ns = time_ns
+        self._last_ns = None
+        self._last_rate = 0.0
+
+    def step(self, node, time_ns: int) -> Optional[Tuple[int, int]]:
+        """Motor targets (left, right) for this tick of the turn, or None once the turn is done."""
+        rate = self._sign * (node[MOTOR_LEFT_SPEED] - node[MOTOR_RIGHT_SPEED]) * self.radians_per_unit_second
+        if self._last_ns is None:
+            tick = 0.0
+        else:
+            tick = (time_ns - self._last_ns) / 1e9
+            self.turned += (rate + self._last_rate) / 2 * tick
+        self._last_ns = time_ns
+        self._last_rate = rate
+
+        # the robot still turns a bit after the motors are stopped, stop on the tick where going on for another one
+        # would end further from the target than stopping now
+        rate = max(rate, 0.0)
+        remaining = self.remaining - rate * self.settle_time
+        if remaining <= rate * tick / 2:
+            return None
+
+        # brake so the speed is down to min_speed by the time the target is reached, taking into account that the speed
+        # set now only takes effect for the next tick. A unit of wheel speed turns the robot by
+        # 2 * radians_per_unit_second since both wheels move.
+        braking = math.sqrt(self.deceleration * max(remaining - rate * tick, 0.0) / self.radians_per_unit_second)
+        ramp = self.min_speed + self.acceleration * (time_ns - self._started_ns) / 1e9
+        speed = round(max(self.min_speed, min(self.max_speed, ramp, braking)))
+        return self._sign * speed, -self._sign * speed
+
+
+def test_odometry_turn_controller():
+    from simulator import Simulator, SimulatedNode
+
+    maze = \
+        [[0, 1, 0],
+         [1, 1, 1],
+         [0, 1, 0]]
+
+    for direction, expected in ((Direction.RIGHT, math.pi / 2), (Direction.LEFT, -math.pi / 2),
+                                (Direction.U_TURN, math.pi)):
+        simulator = Simulator(maze, (1, 1), motor_time_constant=0.05, speed_noise=3.0)
+        node = SimulatedNode(simulator)
+        controller = OdometryTurnController()
+        before = simulator.angle
+        controller.begin(direction, simulator.time_ns())
+        ticks = 0
+        motors = controller.step(node, simulator.time_ns())
+        while motors is not None:
+            simulator.set_motors(*motors)
+            simulator.advance(0.08)
+            ticks += 1
+            motors = controller.step(node, simulator.time_ns())
+        simulator.set_motors(0, 0)
+        simulator.advance(0.5)  # let the wheels spin down
+
+        turned = (simulator.angle - before + math.pi) % (2 * math.pi) - math.pi
+        error = (turned - expected + math.pi) % (2 * math.pi) - math.pi
+        assert abs(math.degrees(error)) < 4, (direction, math.degrees(error))
+        # the timed turn at +-100 needs 28 ticks for a quarter turn
+        assert ticks < (22 if direction == Direction.U_TURN else 15)
+
+
+def test_odometry_maze_run():
+    from event_log import EventLog, Level
+    from instruction_compiler import InstructionCompiler
+    from maze_walker import MazeWalker
+    from ordered_instructions_guide import OrderedInstructionsGuide
+    from simulator import Simulator
+
+    # the dead end at (8, 2) makes (7, 2) a junction the route passes straight through
+    maze = \
+        [[0, 0, 0, 0, 0, 0, 0, 1, 0],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 0, 0, 1, 0, 1, 1],
+         [0, 1, 1, 1, 1, 1, 0, 1, 0],
+         [0, 1, 0, 1, 0, 0, 0, 1, 0],
+         [0, 1, 0, 1, 1, 1, 1, 1, 0],
+         [0, 1, 0, 0, 0, 0, 0, 0, 0]]
+
+    def run(turn_controller):
+        # sluggish wheels: the timed turns come up short, the measured ones don't
+        simulator = Simulator(maze, (7, 0), motor_time_constant=0.1, speed_noise=5.0)
+        walker = MazeWalker(OrderedInstructionsGuide(InstructionCompiler(maze).route((7, 0), (1, 6))[1]),
+                            events=EventLog(Level.OFF), clock=simulator.clock, turn_controller=turn_controller)
+        elapsed = simulator.run(walker, max_seconds=120)
+        return simulator.stopped and simulator.cell == (1, 6) and not simulator.collisions, elapsed
+
+    reached, elapsed = run(OdometryTurnController())
+    assert reached and elapsed < 45
+    assert not run(None)[0]
+
+
+if __name__ == "__main__":
+    test_odometry_turn_controller()
+    test_odometry_maze_run()